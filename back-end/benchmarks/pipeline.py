@@ -0,0 +1,376 @@
+"""
+Per-stage and end-to-end benchmarks for the three services
+
+Runs offline on synthetic inputs (see synthetic.py): leaf-like and non-leaf
+images at several resolutions and random soil vectors. Each stage of the
+image pipelines (decode, plant detection, preprocess, inference) is timed on
+its own through the services' own functions, and each endpoint is timed end
+to end through an in-process ASGI client, so no server or network is needed:
+
+    python benchmarks/pipeline.py --output benchmarks/results.json
+    python benchmarks/pipeline.py --baseline benchmarks/results.json --fail-on-regression
+
+Run from back-end/. The report holds p50/p95/p99 latency and throughput per
+benchmark. With --baseline every benchmark is compared with a stored report
+and flagged when its p50 or p95 grew by more than --tolerance. Baselines are
+machine specific, so record one on the machine that runs the comparison.
+Services whose model file is missing are skipped. The prediction cache is
+disabled unless --cache is given, so repeated inputs still run the pipeline.
+Needs httpx for the ASGI client.
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import contextlib
+import importlib.util
+import logging
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BACKEND_DIR, "plant-disease-classification", "app"))
+sys.path.append(BACKEND_DIR)
+
+from synthetic import SOIL_FEATURES, encode_images, soil_vectors, synthetic_images
+
+logging.disable(logging.INFO)
+
+SERVICES = ("disease", "pest", "crop")
+SERVICE_DIRS = {
+    "disease": os.path.join(BACKEND_DIR, "plant-disease-classification"),
+    "pest": os.path.join(BACKEND_DIR, "pest-classification"),
+    "crop": os.path.join(BACKEND_DIR, "crop-recommendation")
+}
+MODEL_FILES = {
+    "disease": os.path.join("keras_model", "best_model.h5"),
+    "pest": os.path.join("saved_model", "model_hama.h5"),
+    "crop": os.path.join("saved_model", "model_crop_recom.h5")
+}
+IMAGE_KINDS = ("leaf", "non_leaf")
+DEFAULT_RESOLUTIONS = ("224x224", "800x600", "1920x1080", "4000x3000")
+# Settings that change what is being measured, recorded with every report
+PIPELINE_ENV = (
+    "MODEL_BACKEND", "TFLITE_QUANTIZATION", "FAST_START", "GRAPH_PREPROCESSING",
+    "BATCHING_ENABLED", "BATCH_MAX_SIZE", "BATCH_MAX_WAIT_MS", "IMAGE_EXECUTOR", "INFERENCE_EXECUTOR",
+    "PREDICTION_CACHE_ENABLED"
+)
+
+def parse_resolution(value: str) -> Tuple[int, int]:
+    """"WIDTHxHEIGHT" as (height, width)"""
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Resolution must look like 1920x1080, got {value!r}")
+    return height, width
+
+def resolution_label(size: Tuple[int, int]) -> str:
+    return f"{size[1]}x{size[0]}"
+
+def summarize(samples: Sequence[float], wall_seconds: float, items_per_sample: int = 1) -> Dict[str, Any]:
+    """Latency percentiles in milliseconds and throughput in items per second"""
+    ms = np.asarray(samples, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        "n": len(samples),
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "throughput_per_s": round(len(samples) * items_per_sample / wall_seconds, 2)
+    }
+
+def time_calls(fn: Callable[[Any], Any], inputs: Sequence[Any], repeats: int, items_per_call: int = 1) -> Dict[str, Any]:
+    """Time fn on every input, repeats times, after one warmup pass"""
+    for item in inputs:
+        fn(item)
+
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeats):
+        for item in inputs:
+            call_started = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - call_started)
+    return summarize(samples, time.perf_counter() - started, items_per_call)
+
+async def time_requests(send: Callable[[int], Awaitable[Any]], count: int, concurrency: int, warmup: int) -> Dict[str, Any]:
+    """Time count requests with at most concurrency in flight, after warmup requests"""
+    for i in range(warmup):
+        await send(i)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    samples: List[float] = []
+    statuses: Counter = Counter()
+
+    async def one(i: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            response = await send(i)
+            samples.append(time.perf_counter() - started)
+            statuses[str(response.status_code)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return {
+        **summarize(samples, time.perf_counter() - started),
+        "concurrency": concurrency,
+        "statuses": dict(sorted(statuses.items()))
+    }
+
+@contextlib.contextmanager
+def working_directory(path: str) -> Iterator[None]:
+    """Pest and crop resolve their model and label paths against the working directory"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+def load_service(name: str) -> Any:
+    """Import a service's app module; pest and crop both live in app.py, so they get unique names"""
+    if name == "disease":
+        from api import app as module
+        return module
+
+    spec = importlib.util.spec_from_file_location(f"{name}_app", os.path.join(SERVICE_DIRS[name], "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    with working_directory(SERVICE_DIRS[name]):
+        spec.loader.exec_module(module)
+    return module
+
+@contextlib.asynccontextmanager
+async def running(module: Any) -> Any:
+    """Run the app's startup and shutdown events around an ASGI client"""
+    import httpx
+
+    async with module.app.router.lifespan_context(module.app):
+        transport = httpx.ASGITransport(app=module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            yield client
+
+def image_sets(args: argparse.Namespace) -> Iterator[Tuple[str, str, List[bytes]]]:
+    """(kind, resolution label, encoded JPEGs) for every kind and resolution"""
+    for kind in IMAGE_KINDS:
+        for size in args.resolutions:
+            images = synthetic_images(args.images, size, kind, seed=args.seed)
+            yield kind, resolution_label(size), encode_images(images)
+
+def upload(name: str, data: bytes) -> Dict[str, Tuple[str, bytes, str]]:
+    return {"file": (name, data, "image/jpeg")}
+
+def npy_body(array: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+async def bench_disease(module: Any, client: Any, args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    version = module.model_registry.current()
+    target_size = version.info["input_size"]
+    normalization = version.info["host_normalization"]
+    predictor = version.predictor
+    decoded: Dict[str, List[np.ndarray]] = {kind: [] for kind in IMAGE_KINDS}
+
+    for kind, label, files in image_sets(args):
+        results[f"disease.stage.decode.{kind}.{label}"] = time_calls(
+            lambda data: module.ImageProcessor.ingest_image(data, target_size), files, args.repeats
+        )
+        decoded[kind].extend(module.ImageProcessor.ingest_image(data, target_size) for data in files)
+        results[f"disease.endpoint.predict-disease.{kind}.{label}"] = await time_requests(
+            lambda i: client.post("/predict-disease", files=upload(f"{i}.jpg", files[i % len(files)])),
+            args.requests, args.concurrency, args.warmup
+        )
+
+    # Decoding already scaled every upload to the model size, so the later
+    # stages cost the same at every resolution and are timed once per kind
+    for kind, arrays in decoded.items():
+        results[f"disease.stage.plant_detection.{kind}"] = time_calls(
+            module.PlantDetector.detect_plant_leaf, arrays, args.repeats
+        )
+        results[f"disease.stage.preprocess.{kind}"] = time_calls(
+            lambda arr: module.ImageProcessor.preprocess_image(arr, target_size, normalization),
+            arrays, args.repeats
+        )
+
+    # Raw pixels at the model size, as sent by clients that decode frames themselves
+    tensors = [npy_body(arr) for arr in decoded["leaf"]]
+    results["disease.endpoint.predict-disease-tensor.leaf"] = await time_requests(
+        lambda i: client.post(
+            "/predict-disease/tensor", content=tensors[i % len(tensors)], headers={"content-type": "application/x-npy"}
+        ),
+        args.requests, args.concurrency, args.warmup
+    )
+
+    batch = np.concatenate([
+        module.ImageProcessor.preprocess_image(arr, target_size, normalization)
+        for arr in decoded["leaf"][:module.BATCH_MAX_SIZE]
+    ])
+    results["disease.stage.inference.batch1"] = time_calls(predictor, [batch[i:i + 1] for i in range(len(batch))], args.repeats)
+    results[f"disease.stage.inference.batch{len(batch)}"] = time_calls(predictor, [batch], args.repeats, len(batch))
+    return results
+
+async def bench_pest(module: Any, client: Any, args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    results = {}
+    arrays = []
+    version = module.model_registry.current()
+    normalization = version.info["host_normalization"]
+    for kind, label, files in image_sets(args):
+        results[f"pest.stage.preprocess.{kind}.{label}"] = time_calls(
+            lambda data: module.preprocess_image(data, normalization), files, args.repeats
+        )
+        arrays.extend(module.preprocess_image(data, normalization) for data in files)
+        results[f"pest.endpoint.predict.{kind}.{label}"] = await time_requests(
+            lambda i: client.post("/predict", files=upload(f"{i}.jpg", files[i % len(files)])),
+            args.requests, args.concurrency, args.warmup
+        )
+
+    results["pest.stage.inference.batch1"] = time_calls(version.predictor, arrays[:args.images], args.repeats)
+    return results
+
+async def bench_crop(module: Any, client: Any, args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    vectors = soil_vectors(max(args.images, args.requests), seed=args.seed)
+    forms = [
+        {feature: str(int(value) if i < 3 else round(float(value), 4)) for i, (feature, value) in enumerate(zip(SOIL_FEATURES, vector))}
+        for vector in vectors
+    ]
+    return {
+        "crop.stage.inference.batch1": time_calls(
+            module.model_registry.current().predictor, [vector[None, :] for vector in vectors[:args.images]], args.repeats
+        ),
+        "crop.endpoint.predict-recom": await time_requests(
+            lambda i: client.post("/predict/recom", data=forms[i % len(forms)]),
+            args.requests, args.concurrency, args.warmup
+        )
+    }
+
+BENCHMARKS = {"disease": bench_disease, "pest": bench_pest, "crop": bench_crop}
+
+async def run_service(name: str, args: argparse.Namespace) -> Dict[str, Dict[str, Any]]:
+    module = load_service(name)
+    # Startup and every request run inside the service directory because of its relative paths
+    with working_directory(SERVICE_DIRS[name]):
+        async with running(module) as client:
+            return await BENCHMARKS[name](module, client, args)
+
+def environment(args: argparse.Namespace) -> Dict[str, Any]:
+    versions = {}
+    for package in ("numpy", "tensorflow", "keras", "fastapi", "PIL", "cv2"):
+        module = sys.modules.get(package)
+        if module is not None:
+            versions[package] = getattr(module, "__version__", None)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "versions": versions,
+        "env": {key: os.environ[key] for key in PIPELINE_ENV if key in os.environ},
+        "args": {
+            **vars(args),
+            "resolutions": [resolution_label(size) for size in args.resolutions]
+        }
+    }
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print the change against the baseline and return the regressed benchmarks"""
+    baseline_results = baseline.get("results", {})
+    regressions = []
+    print(f"\n{'benchmark':<56}{'p50 base':>10}{'p50':>10}{'change':>9}{'p95 base':>10}{'p95':>10}{'change':>9}")
+    for name, result in results.items():
+        previous = baseline_results.get(name)
+        if previous is None:
+            print(f"{name:<56}{'(new)':>10}")
+            continue
+
+        row = f"{name:<56}"
+        regressed = []
+        for metric in ("p50_ms", "p95_ms"):
+            change = result[metric] / previous[metric] - 1.0 if previous[metric] else 0.0
+            row += f"{previous[metric]:>10.2f}{result[metric]:>10.2f}{change:>+9.1%}"
+            if change > tolerance:
+                regressed.append(f"{metric} {change:+.1%}")
+        if regressed:
+            regressions.append(f"{name}: {', '.join(regressed)}")
+            row += "  REGRESSION"
+        print(row)
+
+    machine = baseline.get("meta", {})
+    if (machine.get("machine"), machine.get("cpu_count")) != (platform.machine(), os.cpu_count()):
+        print("Warning: the baseline was recorded on a different machine")
+    return regressions
+
+def print_results(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'benchmark':<56}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'per s':>10}  statuses")
+    for name, result in results.items():
+        statuses = " ".join(f"{code}:{count}" for code, count in result.get("statuses", {}).items())
+        print(
+            f"{name:<56}{result['n']:>6}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            f"{result['p99_ms']:>10.2f}{result['throughput_per_s']:>10.1f}  {statuses}"
+        )
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if not args.cache:
+        os.environ["PREDICTION_CACHE_ENABLED"] = "false"
+
+    results, skipped = {}, {}
+    for name in args.services:
+        model_file = os.path.join(SERVICE_DIRS[name], MODEL_FILES[name])
+        if not os.path.exists(model_file):
+            skipped[name] = f"model not found: {model_file}"
+            print(f"Skipping {name}, {skipped[name]}")
+            continue
+        started = time.perf_counter()
+        results.update(asyncio.run(run_service(name, args)))
+        print(f"{name} done in {time.perf_counter() - started:.1f}s")
+
+    return {"meta": {**environment(args), "skipped": skipped}, "results": results}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--services", nargs="+", choices=SERVICES, default=list(SERVICES))
+    parser.add_argument(
+        "--resolutions", nargs="+", type=parse_resolution,
+        default=[parse_resolution(value) for value in DEFAULT_RESOLUTIONS], help="Image sizes as WIDTHxHEIGHT"
+    )
+    parser.add_argument("--images", type=int, default=8, help="Distinct images per kind and resolution")
+    parser.add_argument("--repeats", type=int, default=5, help="Passes over the inputs per stage benchmark")
+    parser.add_argument("--requests", type=int, default=64, help="Requests per endpoint benchmark")
+    parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight per endpoint benchmark")
+    parser.add_argument("--warmup", type=int, default=4, help="Untimed requests before each endpoint benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cache", action="store_true", help="Keep the prediction cache enabled")
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--baseline", help="Report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed p50/p95 growth over the baseline")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_results(report["results"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report["results"], json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regressions over {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            if args.fail_on_regression:
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmark the vectorized PlantDetector against the original implementation
+
+Checks that the float32 detector reproduces the original float64 scores and
+reports per-image latency for the single-image and batched APIs:
+
+    python benchmarks/plant_detector.py --images 256 --batch-size 16
+
+Run from back-end/. Uses real images from --image-dir when given, otherwise
+synthetic leaf-like images.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import logging
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BACKEND_DIR, "plant-disease-classification", "app"))
+sys.path.append(BACKEND_DIR)
+
+from api.app import PLANT_ANALYSIS_SIZE, PlantDetector
+from common.tflite import load_calibration_images
+from synthetic import synthetic_images
+
+logging.disable(logging.INFO)
+
+def reference_scores(img_array: np.ndarray) -> Dict[str, float]:
+    """Original per-image detector: separate conversions, float64 Sobel and np.sqrt"""
+    hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
+    mask1 = cv2.inRange(hsv, np.array([40, 40, 40]), np.array([80, 255, 255]))
+    mask2 = cv2.inRange(hsv, np.array([25, 40, 40]), np.array([40, 255, 255]))
+    green_mask = cv2.bitwise_or(mask1, mask2)
+    green_percentage = np.sum(green_mask > 0) / (img_array.shape[0] * img_array.shape[1])
+    avg_saturation = np.mean(hsv[:, :, 1]) / 255.0
+    avg_value = np.mean(hsv[:, :, 2]) / 255.0
+
+    gray = cv2.cvtColor(img_array, cv2.COLOR_RGB2GRAY)
+    grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
+    edge_density = np.mean(np.sqrt(grad_x**2 + grad_y**2)) / 255.0
+    kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
+    texture_variance = np.var(cv2.filter2D(gray, -1, kernel)) / (255.0 ** 2)
+
+    plant_confidence = (
+        min(green_percentage * 2.5, 1.0) * 0.4 +
+        avg_saturation * 0.25 +
+        min(edge_density * 3.0, 1.0) * 0.25 +
+        min(avg_value * 1.5, 1.0) * 0.1
+    )
+    if avg_saturation < 0.1 and green_percentage < 0.05:
+        plant_confidence *= 0.3
+    if green_percentage < 0.02:
+        plant_confidence *= 0.5
+
+    return {
+        'green_percentage': float(green_percentage),
+        'avg_saturation': float(avg_saturation),
+        'avg_value': float(avg_value),
+        'edge_density': float(edge_density),
+        'texture_variance': float(texture_variance),
+        'plant_confidence': float(plant_confidence)
+    }
+
+def time_per_image(fn, images: np.ndarray, repeats: int) -> float:
+    """Best-of-repeats milliseconds per image"""
+    best = float("inf")
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn(images)
+        best = min(best, time.perf_counter() - started)
+    return best * 1000.0 / len(images)
+
+def check_parity(images: np.ndarray, tolerance: float) -> Tuple[float, int]:
+    """Largest score difference against the reference and the number of flipped decisions"""
+    results = PlantDetector.detect_plant_leaves(images, threshold=0.7)
+    max_diff, flipped = 0.0, 0
+    for img, (is_plant, confidence, details) in zip(images, results):
+        expected = reference_scores(img)
+        actual = {**details['color_features'], **details['texture_features'], 'plant_confidence': confidence}
+        for name, value in expected.items():
+            max_diff = max(max_diff, abs(actual[name] - value))
+        flipped += int(is_plant != (expected['plant_confidence'] >= 0.7))
+
+    if max_diff > tolerance:
+        raise AssertionError(f"Scores differ from the reference by {max_diff:.2e} (tolerance {tolerance:.0e})")
+    return max_diff, flipped
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.image_dir:
+        images = load_calibration_images(args.image_dir, PLANT_ANALYSIS_SIZE, scale=1.0, limit=args.images)
+        images = images.astype(np.uint8)
+    else:
+        images = synthetic_images(args.images, PLANT_ANALYSIS_SIZE)
+
+    max_diff, flipped = check_parity(images, args.tolerance)
+
+    def reference(batch: np.ndarray) -> List[Dict[str, float]]:
+        return [reference_scores(img) for img in batch]
+
+    def single(batch: np.ndarray) -> List[Tuple[bool, float, Dict[str, Any]]]:
+        return [PlantDetector.detect_plant_leaf(img) for img in batch]
+
+    def batched(batch: np.ndarray) -> List[Tuple[bool, float, Dict[str, Any]]]:
+        results = []
+        for start in range(0, len(batch), args.batch_size):
+            results.extend(PlantDetector.detect_plant_leaves(batch[start:start + args.batch_size]))
+        return results
+
+    timings = {
+        "reference_ms": time_per_image(reference, images, args.repeats),
+        "single_ms": time_per_image(single, images, args.repeats),
+        "batched_ms": time_per_image(batched, images, args.repeats)
+    }
+    report = {
+        "images": len(images),
+        "batch_size": args.batch_size,
+        "max_abs_diff": max_diff,
+        "flipped_decisions": flipped,
+        **{name: round(value, 4) for name, value in timings.items()},
+        "speedup_single": round(timings["reference_ms"] / timings["single_ms"], 2),
+        "speedup_batched": round(timings["reference_ms"] / timings["batched_ms"], 2)
+    }
+
+    print(f"{len(images)} images at {PLANT_ANALYSIS_SIZE}, max score diff {max_diff:.2e}, {flipped} flipped decisions")
+    print(f"{'implementation':<16}{'ms/image':>10}{'speedup':>10}")
+    print(f"{'reference':<16}{timings['reference_ms']:>10.4f}{1.0:>10.2f}")
+    print(f"{'single':<16}{timings['single_ms']:>10.4f}{report['speedup_single']:>10.2f}")
+    print(f"{'batched':<16}{timings['batched_ms']:>10.4f}{report['speedup_batched']:>10.2f}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", type=int, default=256, help="Number of images")
+    parser.add_argument("--image-dir", help="Directory of real JPG or PNG images")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5, help="Timing repeats, the best is reported")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Maximum allowed score difference")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    report = run(args)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
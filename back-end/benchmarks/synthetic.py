@@ -0,0 +1,149 @@
+"""
+Synthetic inputs for the benchmarks
+
+Leaf-like images (a close-up, veined green leaf on a blurred, noisy
+background), non-leaf images (noise, flat colour, sky-like gradients) and
+soil feature vectors in the ranges of the crop recommendation dataset. Every
+generator takes a seed, so runs are reproducible without a dataset.
+"""
+
+import io
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# (low, high) per crop feature: N, P, K, temperature, humidity, ph, rainfall
+SOIL_FEATURE_RANGES = (
+    (0.0, 140.0),
+    (5.0, 145.0),
+    (5.0, 205.0),
+    (8.0, 44.0),
+    (14.0, 100.0),
+    (3.5, 10.0),
+    (20.0, 300.0)
+)
+SOIL_FEATURES = ("N", "P", "K", "temperature", "humidity", "ph", "rainfall")
+
+def background(rng: np.random.Generator, height: int, width: int, sigma: Optional[float] = None) -> np.ndarray:
+    """
+    Blurred random noise with sensor-like grain, the texture behind every synthetic image.
+
+    The blur is drawn at 224 pixels and scaled up, which stays fast for
+    photo-sized images; the grain keeps large JPEGs as costly to decode as photos.
+    sigma is the blur at that scale, random between 0.5 and 6 by default.
+    """
+    scale = 224.0 / max(height, width)
+    small = (max(1, round(height * scale)), max(1, round(width * scale)))
+    img = rng.integers(0, 256, size=small + (3,), dtype=np.uint8)
+    img = cv2.GaussianBlur(img, (0, 0), sigmaX=sigma or float(rng.uniform(0.5, 6.0)))
+    if small != (height, width):
+        img = cv2.resize(img, (width, height), interpolation=cv2.INTER_CUBIC)
+    grain = rng.integers(-6, 7, size=(height, width, 3), dtype=np.int16)
+    return np.clip(img + grain, 0, 255).astype(np.uint8)
+
+def leaf_image(rng: np.random.Generator, height: int, width: int) -> np.ndarray:
+    """Close-up of a mottled green leaf with a midrib and side veins on a textured background"""
+    img = background(rng, height, width)
+    scale = min(height, width) / 224.0
+    center = (int(rng.uniform(0.4, 0.6) * width), int(rng.uniform(0.4, 0.6) * height))
+    # Like a close-up photo the leaf fills most of the frame, whatever its aspect ratio
+    axes = (int(rng.uniform(0.4, 0.55) * width), int(rng.uniform(0.3, 0.4) * height))
+    angle = float(rng.uniform(-20, 20))
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.ellipse(mask, center, axes, angle, 0, 360, 255, -1)
+
+    color = np.array([rng.integers(20, 60), rng.integers(130, 210), rng.integers(10, 50)], dtype=np.float32)
+    shading = background(rng, height, width, sigma=1.5)[:, :, 1:2].astype(np.float32)
+    shading = (shading - shading.min()) / max(float(np.ptp(shading)), 1.0)
+    leaf = np.clip(color * (0.4 + 1.2 * shading), 0, 255).astype(np.uint8)
+    img[mask > 0] = leaf[mask > 0]
+
+    theta = np.deg2rad(angle)
+    direction = np.array([np.cos(theta), np.sin(theta)])
+    normal = np.array([-direction[1], direction[0]])
+    vein_color = (170, 210, 120)
+    thickness = max(1, int(2 * scale))
+    tip = np.array(center) + direction * axes[0]
+    base = np.array(center) - direction * axes[0]
+    cv2.line(img, tuple(base.astype(int)), tuple(tip.astype(int)), vein_color, thickness)
+    for t in np.linspace(-0.7, 0.7, 7):
+        start = np.array(center) + direction * axes[0] * t
+        for side in (-1, 1):
+            end = start + direction * axes[0] * 0.25 + normal * side * axes[1] * 0.8
+            cv2.line(img, tuple(start.astype(int)), tuple(end.astype(int)), vein_color, max(1, thickness // 2))
+    return img
+
+def non_leaf_image(rng: np.random.Generator, height: int, width: int) -> np.ndarray:
+    """Noise, a flat grey surface or a sky-like gradient"""
+    kind = rng.integers(0, 3)
+    if kind == 0:
+        return background(rng, height, width)
+    if kind == 1:
+        img = np.full((height, width, 3), int(rng.integers(60, 200)), dtype=np.uint8)
+        grain = rng.integers(-8, 9, size=(height, width, 1), dtype=np.int16)
+        return np.clip(img + grain, 0, 255).astype(np.uint8)
+    rows = np.linspace(0.0, 1.0, height, dtype=np.float32)[:, None, None]
+    top = np.array([90, 150, 230], dtype=np.float32)
+    bottom = np.array([200, 225, 250], dtype=np.float32)
+    return np.broadcast_to(top + (bottom - top) * rows, (height, width, 3)).astype(np.uint8)
+
+def synthetic_images(count: int, size: Tuple[int, int] = (224, 224), kind: str = "leaf", seed: int = 0) -> np.ndarray:
+    """
+    Generate images of one kind.
+
+    Args:
+        count: Number of images
+        size: (height, width)
+        kind: "leaf" or "non_leaf"; "leaf" keeps 30% non-leaf images, as in a real upload mix
+        seed: Random seed
+
+    Returns:
+        uint8 array of shape (count, height, width, 3)
+    """
+    rng = np.random.default_rng(seed)
+    height, width = size
+    images = np.empty((count, height, width, 3), dtype=np.uint8)
+    for i in range(count):
+        if kind == "leaf" and rng.random() < 0.7:
+            images[i] = leaf_image(rng, height, width)
+        else:
+            images[i] = non_leaf_image(rng, height, width)
+    return images
+
+def encode_images(images: np.ndarray, image_format: str = "JPEG") -> List[bytes]:
+    """
+    Encode images the way they arrive as uploads.
+
+    Args:
+        images: uint8 array of shape (N, height, width, 3)
+        image_format: "JPEG" or "PNG"
+
+    Returns:
+        Encoded file bytes per image
+    """
+    encoded = []
+    for img in images:
+        buffer = io.BytesIO()
+        Image.fromarray(img).save(buffer, format=image_format, quality=90)
+        encoded.append(buffer.getvalue())
+    return encoded
+
+def soil_vectors(count: int, seed: int = 0) -> np.ndarray:
+    """
+    Random soil and weather feature vectors for crop recommendation.
+
+    Args:
+        count: Number of vectors
+        seed: Random seed
+
+    Returns:
+        float64 array of shape (count, 7) in SOIL_FEATURES order
+    """
+    rng = np.random.default_rng(seed)
+    low, high = np.array(SOIL_FEATURE_RANGES).T
+    vectors = rng.uniform(low, high, size=(count, len(SOIL_FEATURES)))
+    # The API takes N, P and K as integers
+    vectors[:, :3] = np.round(vectors[:, :3])
+    return vectors
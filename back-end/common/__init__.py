@@ -0,0 +1,3 @@
+"""
+Shared runtime helpers for the GrowMate back-end services
+"""
@@ -0,0 +1,303 @@
+"""
+Admission control and load shedding for the inference endpoints
+
+Without a limit, a burst of uploads piles up inside uvicorn: every request
+waits behind all the others, latency grows for everyone until clients time
+out, and the server still finishes the abandoned work. ``AdmissionMiddleware``
+sits in front of the inference endpoints and keeps the work in progress
+bounded:
+
+1. When the endpoint starts reading the body, a client over its optional
+   token-bucket rate limit gets 429, and if the queue is already full the
+   request gets 503 right away, before any of its body is received.
+2. Once the body is received, the request needs one of
+   ADMISSION_MAX_CONCURRENT slots to go on to decoding and inference. It
+   waits for a slot in a FIFO queue of at most ADMISSION_MAX_QUEUE requests
+   for at most ADMISSION_QUEUE_TIMEOUT_MS, then gets 503.
+
+Rejections carry Retry-After and are raised from ``receive()`` like the
+upload limits of common/uploads.py, so FastAPI answers them inside CORS.
+Slots are taken after the upload, so slow mobile uploads do not hold them,
+and an admitted request waits at most the queue timeout before its own work
+starts. Shed requests are counted in growmate_requests_shed_total by reason.
+
+Configuration through environment variables:
+
+    ADMISSION_MAX_CONCURRENT     requests decoding or predicting at once, default four per CPU core, 0 disables
+    ADMISSION_MAX_QUEUE          requests waiting for a slot, defaults to ADMISSION_MAX_CONCURRENT
+    ADMISSION_QUEUE_TIMEOUT_MS   longest wait for a slot, default 2000
+    ADMISSION_RETRY_AFTER        Retry-After seconds of a 503, default 1
+    RATE_LIMIT_PER_SECOND        requests per second per client, default 0 (no rate limit)
+    RATE_LIMIT_BURST             requests a client may send at once, default 10
+    RATE_LIMIT_CLIENT_HEADER     header identifying the client (e.g. X-Forwarded-For
+                                 behind a proxy, first entry), defaults to the peer address
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Collection, Deque, Dict, Optional
+
+from fastapi import HTTPException
+
+from common.metrics import ServiceMetrics
+
+logger = logging.getLogger(__name__)
+
+OVERLOADED = "Server sedang sibuk, silakan coba lagi dalam beberapa saat"
+RATE_LIMITED = "Terlalu banyak permintaan, silakan coba lagi nanti"
+
+# Clients whose token buckets are kept; the least recently seen are dropped first
+RATE_LIMIT_MAX_CLIENTS = 10000
+
+class Overloaded(Exception):
+    """The request was refused to protect the latency of admitted requests"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request shed: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+def handed_over(waiter: asyncio.Future) -> bool:
+    """Whether release() gave a waiting request its slot"""
+    return waiter.done() and not waiter.cancelled()
+
+class AdmissionController:
+    """Bounded number of requests in progress with a bounded, time-limited FIFO queue"""
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        max_queue: Optional[int] = None,
+        queue_timeout: float = 2.0,
+        retry_after: float = 1.0
+    ):
+        """
+        Args:
+            max_concurrent: Requests allowed in progress at once, 0 for no limit
+            max_queue: Requests allowed to wait for a slot, defaults to max_concurrent
+            queue_timeout: Longest wait for a slot in seconds
+            retry_after: Seconds a shed client is asked to wait
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue if max_queue is not None else max_concurrent
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self.active = 0
+        # Requests waiting for a slot, oldest first; release() hands its slot to the first one
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        """Create a controller configured from the ADMISSION_* environment variables"""
+        max_concurrent = int(os.environ.get("ADMISSION_MAX_CONCURRENT", (os.cpu_count() or 1) * 4))
+        max_queue = os.environ.get("ADMISSION_MAX_QUEUE")
+        return cls(
+            max_concurrent,
+            max_queue=int(max_queue) if max_queue else None,
+            queue_timeout=float(os.environ.get("ADMISSION_QUEUE_TIMEOUT_MS", 2000)) / 1000,
+            retry_after=float(os.environ.get("ADMISSION_RETRY_AFTER", 1))
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_concurrent > 0
+
+    @property
+    def waiting(self) -> int:
+        """Requests in the queue"""
+        return len(self._waiters)
+
+    def saturated(self) -> bool:
+        """Whether every slot is taken and the queue is full"""
+        return self.enabled and self.active >= self.max_concurrent and self.waiting >= self.max_queue
+
+    async def acquire(self) -> None:
+        """
+        Take a slot, waiting in the queue if all are taken.
+
+        Raises:
+            Overloaded: If the queue is full or no slot frees up within queue_timeout
+        """
+        if not self.enabled or (self.active < self.max_concurrent and not self._waiters):
+            self.active += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Overloaded("queue_full", self.retry_after)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # The slot may have been handed over just as the timeout fired
+            if not handed_over(waiter):
+                raise Overloaded("queue_timeout", self.retry_after)
+        except BaseException:
+            # Cancelled, e.g. the client went away: pass on a slot it was already given
+            if handed_over(waiter):
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Give back a slot taken by acquire(), handing it straight to the oldest waiting request"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot stays taken, so active is unchanged and no new arrival can take it first
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Limits and current load"""
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "queue_timeout_ms": self.queue_timeout * 1000,
+            "active": self.active,
+            "waiting": self.waiting
+        }
+
+class RateLimiter:
+    """Token bucket per client: rate requests per second with bursts of up to burst requests"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = RATE_LIMIT_MAX_CLIENTS):
+        """
+        Args:
+            rate: Tokens added per second
+            burst: Bucket size
+            max_clients: Buckets kept before the least recently used are dropped
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> Optional["RateLimiter"]:
+        """Create a limiter from RATE_LIMIT_* environment variables, or None if rate limiting is off"""
+        rate = float(os.environ.get("RATE_LIMIT_PER_SECOND", 0))
+        if rate <= 0:
+            return None
+        return cls(rate, float(os.environ.get("RATE_LIMIT_BURST", 10)))
+
+    def take(self, client: str) -> float:
+        """
+        Take a token from a client's bucket.
+
+        Args:
+            client: Client identifier
+
+        Returns:
+            0 if the request is allowed, otherwise the seconds until a token is available
+        """
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = [self.burst, now]
+            self._buckets[client] = bucket
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+def client_key(scope: Dict[str, Any], header: Optional[bytes]) -> str:
+    """Client identifier of a request: the first entry of the configured header, else the peer address"""
+    if header is not None:
+        for name, value in scope["headers"]:
+            if name == header:
+                return value.decode("latin-1").split(",")[0].strip()
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+class AdmissionMiddleware:
+    """ASGI middleware applying admission control and rate limits to some request paths"""
+
+    def __init__(
+        self,
+        app: Any,
+        paths: Collection[str],
+        controller: AdmissionController,
+        rate_limiter: Optional[RateLimiter] = None,
+        metrics: Optional[ServiceMetrics] = None
+    ):
+        """
+        Args:
+            app: ASGI application
+            paths: Request paths to control, e.g. the prediction endpoints
+            controller: Concurrency limit and queue shared by these paths
+            rate_limiter: Per-client rate limit, None for none
+            metrics: Service metrics receiving shed counts and queue wait times
+        """
+        self.app = app
+        self.paths = set(paths)
+        self.controller = controller
+        self.rate_limiter = rate_limiter
+        self.metrics = metrics
+        header = os.environ.get("RATE_LIMIT_CLIENT_HEADER")
+        self.client_header = header.lower().encode("latin-1") if header else None
+
+    def shed(self, reason: str, status_code: int, detail: str, retry_after: float) -> HTTPException:
+        """Count a refused request and build its error response"""
+        if self.metrics is not None and self.metrics.enabled:
+            self.metrics.shed.inc(reason=reason)
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        checked = False
+        admitted = False
+
+        # Raised from receive(), the errors reach the endpoint while it reads
+        # the body and FastAPI answers them like any HTTPException
+        async def admitted_receive() -> Dict[str, Any]:
+            nonlocal checked, admitted
+            if not checked:
+                checked = True
+                if self.rate_limiter is not None:
+                    wait = self.rate_limiter.take(client_key(scope, self.client_header))
+                    if wait > 0:
+                        raise self.shed("rate_limited", 429, RATE_LIMITED, wait)
+                if controller.saturated():
+                    raise self.shed("queue_full", 503, OVERLOADED, controller.retry_after)
+
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False) and not admitted:
+                started = time.perf_counter()
+                try:
+                    await controller.acquire()
+                except Overloaded as e:
+                    raise self.shed(e.reason, 503, OVERLOADED, e.retry_after)
+                admitted = True
+                if self.metrics is not None:
+                    self.metrics.observe_stage("admission_queue", time.perf_counter() - started)
+            return message
+
+        try:
+            await self.app(scope, admitted_receive, send)
+        finally:
+            if admitted:
+                controller.release()
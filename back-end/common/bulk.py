@@ -0,0 +1,303 @@
+"""
+Streaming bulk input and output for tabular prediction endpoints
+
+Bulk endpoints score files with tens of thousands of rows or more, so
+neither the request nor the response is held in memory. ``read_rows`` parses
+the request body as it arrives, in CSV (with a header row), as a JSON array
+or as NDJSON, and yields ``RowChunk`` blocks of at most chunk_rows rows
+whose values are already a float64 matrix, so endpoints validate and score
+each block with vectorized NumPy operations and write its results before
+reading further. Values that are missing or not numbers are NaN in the
+matrix and carry a per-row error; a malformed body stops the stream with
+``BulkFormatError``.
+
+Rows are JSON objects keyed by column name or arrays in column order. An
+optional "id" column or key is passed through to the results so clients can
+join them back to their own records. CSV fields may be quoted but may not
+contain line breaks.
+
+``DuplexStreamingResponse`` streams a response while the endpoint is still
+reading the request body. Starlette's StreamingResponse cannot be used for
+that under uvicorn, because it reads ``receive()`` itself to watch for
+disconnects and would take the body chunks.
+"""
+
+import io
+import csv
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+import numpy as np
+from fastapi.responses import StreamingResponse
+
+CSV_TYPES = ("text/csv", "application/csv")
+JSON_TYPES = ("application/json",)
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+BULK_CONTENT_TYPES = CSV_TYPES + JSON_TYPES + NDJSON_TYPES
+
+ID_COLUMN = "id"
+
+# Longest line or JSON element kept while waiting for its end
+MAX_RECORD_BYTES = 1024 * 1024
+
+INVALID_VALUE = "Nilai kosong atau bukan angka"
+WRONG_FIELD_COUNT = "Jumlah kolom tidak sesuai dengan header"
+INVALID_RECORD = "Baris harus berupa objek atau array JSON"
+EMPTY_ELEMENT = "Elemen array JSON kosong"
+
+class BulkFormatError(ValueError):
+    """The body cannot be parsed any further"""
+
+class RowChunk:
+    """A block of parsed rows"""
+
+    def __init__(self, start: int, values: np.ndarray, ids: List[Any], errors: List[Optional[str]]):
+        """
+        Args:
+            start: Number of the first row, counting data rows from 1
+            values: float64 matrix of shape (rows, columns), NaN where a value is missing or invalid
+            ids: Value of the id column per row, None for rows without one
+            errors: Parse error per row, None for rows that parsed
+        """
+        self.start = start
+        self.values = values
+        self.ids = ids
+        self.errors = errors
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+def to_number(value: Any) -> float:
+    """A JSON or CSV value as a float, NaN if it is not a number"""
+    if isinstance(value, bool) or value is None:
+        return float("nan")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+async def split_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[str]]:
+    """Complete lines from a byte stream, a list per chunk, without line endings"""
+    buffer = b""
+    first = True
+    async for chunk in chunks:
+        buffer += chunk
+        cut = buffer.rfind(b"\n")
+        if cut < 0:
+            if len(buffer) > MAX_RECORD_BYTES:
+                raise BulkFormatError("Baris terlalu panjang")
+            continue
+        complete, buffer = buffer[:cut + 1], buffer[cut + 1:]
+        yield decode(complete, first).splitlines()
+        first = False
+    if buffer:
+        yield decode(buffer, first).splitlines()
+
+def decode(data: bytes, first: bool) -> str:
+    try:
+        # Spreadsheet exports often start with a byte order mark
+        return data.decode("utf-8-sig" if first else "utf-8")
+    except UnicodeDecodeError:
+        raise BulkFormatError("Isi file harus teks UTF-8")
+
+async def csv_records(chunks: AsyncIterator[bytes], columns: Sequence[str]) -> AsyncIterator[List[Any]]:
+    """Rows of a CSV body as [id, values, error], with columns matched to the header by name"""
+    positions: Optional[List[int]] = None
+    id_position: Optional[int] = None
+    width = 0
+
+    async for lines in split_lines(chunks):
+        for fields in csv.reader(line for line in lines if line.strip()):
+            if positions is None:
+                header = {name.strip().lower(): i for i, name in enumerate(fields)}
+                missing = [column for column in columns if column.lower() not in header]
+                if missing:
+                    raise BulkFormatError(f"Kolom tidak ditemukan di header CSV: {', '.join(missing)}")
+                positions = [header[column.lower()] for column in columns]
+                id_position = header.get(ID_COLUMN)
+                width = len(fields)
+                continue
+
+            # Also kept on a row with the wrong field count, if the row reaches the id column
+            row_id = fields[id_position] if id_position is not None and id_position < len(fields) else None
+            if len(fields) != width:
+                yield [row_id, [float("nan")] * len(columns), WRONG_FIELD_COUNT]
+                continue
+            values = [to_number(fields[i].strip() or None) for i in positions]
+            yield [row_id, values, None]
+
+    if positions is None:
+        raise BulkFormatError("File CSV kosong atau tanpa header")
+
+def json_record(element: Any, columns: Sequence[str]) -> List[Any]:
+    """One JSON row as [id, values, error]"""
+    if isinstance(element, dict):
+        return [element.get(ID_COLUMN), [to_number(element.get(column)) for column in columns], None]
+    if isinstance(element, list) and len(element) == len(columns):
+        return [None, [to_number(value) for value in element], None]
+    if isinstance(element, list):
+        return [None, [float("nan")] * len(columns), WRONG_FIELD_COUNT]
+    return [None, [float("nan")] * len(columns), INVALID_RECORD]
+
+async def json_array_records(chunks: AsyncIterator[bytes], columns: Sequence[str]) -> AsyncIterator[List[Any]]:
+    """
+    Rows of a top-level JSON array, decoded element by element as the body arrives.
+
+    An empty element (",," or a leading or trailing comma) becomes a row with
+    an error, like an unparsable NDJSON line; two elements without a comma
+    between them stop the stream.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    opened = closed = False
+    # What may come next inside the array: "first" element, "element" after a comma, or "separator"
+    expecting = "first"
+    # Partial UTF-8 sequences at chunk boundaries are kept until the next chunk
+    pending = b""
+
+    async for chunk in chunks:
+        data = pending + chunk
+        encoding = "utf-8-sig" if not opened and not buffer else "utf-8"
+        try:
+            text, pending = data.decode(encoding), b""
+        except UnicodeDecodeError as e:
+            if e.reason != "unexpected end of data":
+                raise BulkFormatError("Isi file harus teks UTF-8")
+            text, pending = data[:e.start].decode(encoding), data[e.start:]
+        buffer = buffer[position:] + text
+        position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position >= len(buffer):
+                break
+            if closed:
+                raise BulkFormatError("Ada data setelah akhir array JSON")
+            if not opened:
+                if buffer[position] != "[":
+                    raise BulkFormatError("Body JSON harus berupa array")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == ",":
+                position += 1
+                if expecting == "separator":
+                    expecting = "element"
+                else:
+                    yield [None, [float("nan")] * len(columns), EMPTY_ELEMENT]
+                continue
+            if buffer[position] == "]":
+                if expecting == "element":
+                    # Trailing comma
+                    yield [None, [float("nan")] * len(columns), EMPTY_ELEMENT]
+                closed = True
+                position += 1
+                continue
+            if expecting == "separator":
+                raise BulkFormatError("Elemen array JSON harus dipisahkan dengan koma")
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Rows are objects or arrays, so an element that does not decode yet is incomplete
+                if len(buffer) - position > MAX_RECORD_BYTES:
+                    raise BulkFormatError("Elemen JSON terlalu panjang atau tidak valid")
+                break
+            position = end
+            expecting = "separator"
+            yield json_record(element, columns)
+
+    if not closed:
+        raise BulkFormatError("Array JSON tidak lengkap atau tidak valid")
+
+async def ndjson_records(chunks: AsyncIterator[bytes], columns: Sequence[str]) -> AsyncIterator[List[Any]]:
+    """Rows of an NDJSON body, one JSON value per line; unparsable lines become row errors"""
+    async for lines in split_lines(chunks):
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                element = json.loads(line)
+            except json.JSONDecodeError:
+                yield [None, [float("nan")] * len(columns), INVALID_RECORD]
+                continue
+            yield json_record(element, columns)
+
+async def read_rows(
+    chunks: AsyncIterator[bytes],
+    content_type: str,
+    columns: Sequence[str],
+    chunk_rows: int,
+    max_rows: int = 0
+) -> AsyncIterator[RowChunk]:
+    """
+    Parse a bulk request body into blocks of rows as it arrives.
+
+    Args:
+        chunks: Body chunks, e.g. ``request.stream()``
+        content_type: One of BULK_CONTENT_TYPES
+        columns: Numeric columns to read, in model input order
+        chunk_rows: Largest block yielded
+        max_rows: Rows accepted before BulkFormatError, 0 for no limit
+
+    Yields:
+        RowChunk blocks in body order
+
+    Raises:
+        BulkFormatError: If the body is malformed, too long, or not of a bulk content type
+    """
+    if content_type in CSV_TYPES:
+        records = csv_records(chunks, columns)
+    elif content_type in JSON_TYPES:
+        records = json_array_records(chunks, columns)
+    elif content_type in NDJSON_TYPES:
+        records = ndjson_records(chunks, columns)
+    else:
+        raise BulkFormatError(f"Content-Type harus salah satu dari {', '.join(BULK_CONTENT_TYPES)}")
+
+    start = 1
+    block: List[List[Any]] = []
+    try:
+        async for record in records:
+            if max_rows and start + len(block) > max_rows:
+                raise BulkFormatError(f"Jumlah baris melebihi batas {max_rows}")
+            block.append(record)
+            if len(block) >= chunk_rows:
+                yield make_chunk(start, block)
+                start += len(block)
+                block = []
+    except BulkFormatError:
+        # Rows parsed before the error still get their results
+        if block:
+            yield make_chunk(start, block)
+        raise
+    if block:
+        yield make_chunk(start, block)
+
+def make_chunk(start: int, block: List[List[Any]]) -> RowChunk:
+    return RowChunk(
+        start,
+        np.array([record[1] for record in block], dtype=np.float64),
+        [record[0] for record in block],
+        [record[2] for record in block]
+    )
+
+def csv_text(rows: Sequence[Sequence[Any]]) -> str:
+    """Rows formatted as CSV lines"""
+    output = io.StringIO()
+    csv.writer(output, lineterminator="\n").writerows(rows)
+    return output.getvalue()
+
+def ndjson_text(records: Sequence[Dict[str, Any]]) -> str:
+    """Records formatted as NDJSON lines"""
+    return "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in records)
+
+class DuplexStreamingResponse(StreamingResponse):
+    """StreamingResponse that leaves receive() to the endpoint, which is still reading the body"""
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        # A disconnect surfaces through the body stream (ClientDisconnect) or a failed send
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
@@ -0,0 +1,257 @@
+"""
+Content-addressed prediction cache with in-flight request coalescing
+
+Results are keyed by a hash of the uploaded bytes, the model version and
+the request flags that change the result. Entries are evicted by LRU order,
+by age (TTL) and by a memory budget. Identical requests that arrive while
+the first one is still computing wait for that computation instead of
+starting their own.
+
+Configuration through environment variables:
+
+    PREDICTION_CACHE_ENABLED      "true" (default) or "false"
+    PREDICTION_CACHE_MAX_ENTRIES  default 2048
+    PREDICTION_CACHE_TTL_SECONDS  default 3600
+    PREDICTION_CACHE_MAX_BYTES    default 32MB, estimated from the JSON size
+"""
+
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from common.deadlines import RequestAbandoned
+from common.profiling import current_profile
+
+logger = logging.getLogger(__name__)
+
+CACHE_HIT = "hit"
+CACHE_MISS = "miss"
+CACHE_COALESCED = "coalesced"
+CACHE_BYPASS = "bypass"
+
+class PredictionCache:
+    """LRU/TTL cache of prediction results with a memory budget"""
+
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: float = 3600.0,
+        max_bytes: int = 32 * 1024 * 1024,
+        enabled: bool = True
+    ):
+        """
+        Args:
+            max_entries: Maximum number of cached results
+            ttl_seconds: Seconds a result stays valid
+            max_bytes: Memory budget for cached results, estimated from their JSON size
+            enabled: Whether results are cached at all
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+        self._entries: "OrderedDict[str, Tuple[Any, float, int]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @classmethod
+    def from_env(cls) -> "PredictionCache":
+        """Create a cache configured from PREDICTION_CACHE_* environment variables"""
+        return cls(
+            max_entries=int(os.environ.get("PREDICTION_CACHE_MAX_ENTRIES", 2048)),
+            ttl_seconds=float(os.environ.get("PREDICTION_CACHE_TTL_SECONDS", 3600)),
+            max_bytes=int(os.environ.get("PREDICTION_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+            enabled=os.environ.get("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+        )
+
+    @staticmethod
+    def make_key(data: bytes, model_version: str, **flags: Any) -> str:
+        """
+        Build a cache key from the uploaded bytes, model version and result-affecting flags.
+
+        Args:
+            data: Uploaded file bytes
+            model_version: Version of the model that produces the result
+            **flags: Request options that change the result
+
+        Returns:
+            Hex digest identifying the request
+        """
+        digest = hashlib.sha256(data)
+        digest.update(b"\0" + model_version.encode("utf-8"))
+        for name in sorted(flags):
+            digest.update(f"\0{name}={flags[name]}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached result, dropping it if it has expired.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached result, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at, size = entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: Any) -> None:
+        """
+        Store a result, evicting least recently used entries to stay within budget.
+
+        Args:
+            key: Cache key
+            value: JSON-serializable result; callers must not mutate it afterwards
+        """
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl_seconds, size)
+            self._total_bytes += size
+
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        """Remove an entry; the lock must be held"""
+        _, _, size = self._entries.pop(key)
+        self._total_bytes -= size
+
+    async def get_or_compute(
+        self,
+        key: str,
+        compute: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, str]:
+        """
+        Return the cached result, wait for an identical in-flight request, or compute it.
+
+        Exceptions are not cached, but requests coalesced onto a failing
+        computation receive the same exception. If the computing request is
+        abandoned (deadline, disconnect or cancellation), a waiting request
+        computes the result itself.
+
+        Args:
+            key: Cache key
+            compute: Coroutine function producing the result
+
+        Returns:
+            Tuple of (result, cache outcome: "hit", "miss", "coalesced" or "bypass")
+        """
+        # Profiled requests always run the pipeline, see common/profiling.py
+        if not self.enabled or current_profile() is not None:
+            return await compute(), CACHE_BYPASS
+
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value, CACHE_HIT
+
+        in_flight = self._in_flight.get(key)
+        while in_flight is not None:
+            try:
+                value = await asyncio.shield(in_flight)
+                self.coalesced += 1
+                return value, CACHE_COALESCED
+            except asyncio.CancelledError:
+                # Only the computing request was abandoned, not this one
+                if not in_flight.cancelled():
+                    raise
+            in_flight = self._in_flight.get(key)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await compute()
+        except BaseException as e:
+            if isinstance(e, (asyncio.CancelledError, RequestAbandoned)):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                # Mark retrieved so an uncoalesced failure is not logged as unhandled
+                future.exception()
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value, CACHE_MISS
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            entries = len(self._entries)
+            total_bytes = self._total_bytes
+
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "in_flight": len(self._in_flight),
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0
+        }
+
+def file_fingerprint(path: str) -> str:
+    """A model file's size and modification time, which change when the file is replaced"""
+    try:
+        stat = os.stat(path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+    except OSError:
+        return "missing"
+
+def file_model_version(path: str, *variant: str) -> str:
+    """
+    Derive a model version from the model file's name, size and modification time.
+
+    Args:
+        path: Path to the model file
+        *variant: Extra parts that change outputs, e.g. backend and quantization
+
+    Returns:
+        Short version string such as "best_model-3f2a9c1e"
+    """
+    digest = hashlib.sha256(":".join((file_fingerprint(path),) + variant).encode("utf-8")).hexdigest()[:8]
+    return f"{os.path.splitext(os.path.basename(path))[0]}-{digest}"
@@ -0,0 +1,153 @@
+"""
+Two-stage cascade inference for classifiers with a rejection threshold
+
+Most images a classifier sees are easy: photos that are plainly not what it
+is meant for, and clear examples of one class. A cascade decides those
+cheaply and only runs the full model on the rest:
+
+1. The statistics gate rejects near-uniform images (blank frames, covered
+   lenses, flat screenshots) whose pixel standard deviation is below
+   CASCADE_MIN_CONTRAST, measured on a subsample of the uint8 pixels.
+2. The first-stage model, a small and reduced-resolution model distilled
+   from the full one (see tools/pest_cascade.py), accepts images it
+   classifies with at least CASCADE_ACCEPT confidence and rejects those
+   below CASCADE_REJECT.
+3. Everything else escalates to the full model.
+
+The stages that decided each image are counted in ``stats()`` and in
+growmate_cascade_images_total by stage and decision, so the share of images
+that never reach the full model can be followed in production.
+``tools/pest_cascade.py evaluate`` measures how often the cascade agrees
+with the full model on a folder of images before it is turned on.
+
+Configuration through environment variables:
+
+    CASCADE_ENABLED         "true" to run the cascade, default false
+    CASCADE_ACCEPT          first-stage confidence to accept without the full model, default 0.98
+    CASCADE_REJECT          first-stage confidence below which the image is rejected, default 0.5
+    CASCADE_MIN_CONTRAST    pixel standard deviation below which the gate rejects, default 6, 0 disables
+"""
+
+import os
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from common.metrics import ServiceMetrics
+
+STAGES = ("gate", "first_stage", "full_model")
+
+# Every GATE_STRIDE-th pixel in both directions is enough to tell a flat image from a photo
+GATE_STRIDE = 4
+
+class Cascade:
+    """Thresholds and decision counts of a two-stage cascade"""
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        accept: float = 0.98,
+        reject: float = 0.5,
+        min_contrast: float = 6.0,
+        metrics: Optional[ServiceMetrics] = None
+    ):
+        """
+        Args:
+            enabled: Whether requests go through the cascade
+            accept: First-stage confidence at or above which its answer is kept
+            reject: First-stage confidence below which the image is rejected
+            min_contrast: Pixel standard deviation below which the gate rejects, 0 for no gate
+            metrics: Service metrics receiving decision counts
+
+        Raises:
+            ValueError: If reject is not below accept
+        """
+        if enabled and reject >= accept:
+            raise ValueError(f"CASCADE_REJECT ({reject}) must be below CASCADE_ACCEPT ({accept})")
+        self.enabled = enabled
+        self.accept = accept
+        self.reject = reject
+        self.min_contrast = min_contrast
+        self.metrics = metrics
+
+        self._lock = threading.Lock()
+        self._counts: Dict[Tuple[str, str], int] = {}
+
+    @classmethod
+    def from_env(cls, metrics: Optional[ServiceMetrics] = None) -> "Cascade":
+        """Create a cascade configured from the CASCADE_* environment variables"""
+        return cls(
+            enabled=os.environ.get("CASCADE_ENABLED", "false").lower() == "true",
+            accept=float(os.environ.get("CASCADE_ACCEPT", 0.98)),
+            reject=float(os.environ.get("CASCADE_REJECT", 0.5)),
+            min_contrast=float(os.environ.get("CASCADE_MIN_CONTRAST", 6.0)),
+            metrics=metrics
+        )
+
+    def tag(self, first_stage_version: Optional[str]) -> str:
+        """Identify the settings that change results, for cache keys"""
+        if not self.enabled:
+            return "off"
+        return f"{first_stage_version or 'gate'}:{self.accept}:{self.reject}:{self.min_contrast}"
+
+    def gate(self, pixels: np.ndarray) -> np.ndarray:
+        """
+        Find images too uniform to show anything.
+
+        Args:
+            pixels: uint8 batch of shape (N, H, W, 3)
+
+        Returns:
+            Boolean mask of the images the gate rejects
+        """
+        if self.min_contrast <= 0:
+            return np.zeros(len(pixels), dtype=bool)
+        sample = pixels[:, ::GATE_STRIDE, ::GATE_STRIDE].reshape(len(pixels), -1).astype(np.float32)
+        return sample.std(axis=1) < self.min_contrast
+
+    def decide(self, probabilities: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Split first-stage outputs into the images it decides and the ones to escalate.
+
+        Args:
+            probabilities: First-stage softmax outputs of shape (N, classes)
+
+        Returns:
+            Boolean masks of the accepted and the rejected images; the rest escalate
+        """
+        confidence = probabilities.max(axis=1)
+        return confidence >= self.accept, confidence < self.reject
+
+    def record(self, stage: str, decision: str, count: int = 1) -> None:
+        """Count images decided at a stage, e.g. ("first_stage", "accepted")"""
+        if count <= 0:
+            return
+        with self._lock:
+            self._counts[(stage, decision)] = self._counts.get((stage, decision), 0) + count
+        if self.metrics is not None and self.metrics.enabled:
+            self.metrics.cascade.inc(count, stage=stage, decision=decision)
+
+    def stats(self) -> Dict[str, Any]:
+        """Settings and the number and share of images decided at each stage"""
+        with self._lock:
+            counts = dict(self._counts)
+        total = sum(counts.values())
+
+        stages: Dict[str, Any] = {}
+        for stage in STAGES:
+            decisions = {decision: n for (name, decision), n in sorted(counts.items()) if name == stage}
+            handled = sum(decisions.values())
+            stages[stage] = {
+                "images": handled,
+                "fraction": round(handled / total, 4) if total else 0.0,
+                **decisions
+            }
+        return {
+            "enabled": self.enabled,
+            "accept": self.accept,
+            "reject": self.reject,
+            "min_contrast": self.min_contrast,
+            "images": total,
+            "stages": stages
+        }
@@ -0,0 +1,218 @@
+"""
+Request deadlines and client disconnect checks
+
+Mobile clients on weak connections often give up after a few seconds, and
+without checks the server still runs plant detection, preprocessing and
+inference for them. ``DeadlineMiddleware`` gives every request on the
+prediction paths a budget, REQUEST_TIMEOUT_MS by default or shorter if the
+client sends ``X-Request-Timeout-Ms``, counted from when the request
+arrived. Between pipeline stages ``check_deadline(stage)`` stops a request
+whose budget is spent (504) or whose client has disconnected (499), and
+``StageExecutor.run`` checks again when a queued task gets its pool slot,
+so expired work is dropped before it reaches a pool or the model. The
+micro-batcher drops expired samples before building a batch.
+
+The deadline of the request being handled is kept in a context variable,
+like the profile of common/profiling.py, so the pipeline code needs no extra
+arguments. Abandoned requests are counted in
+growmate_requests_abandoned_total by reason and stage.
+
+Configuration through environment variables:
+
+    REQUEST_TIMEOUT_MS    default and largest budget per request, default 30000, 0 for none
+"""
+
+import os
+import time
+import logging
+from contextvars import ContextVar
+from typing import Any, Callable, Collection, Dict, Optional
+
+import anyio
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from common.metrics import ServiceMetrics
+
+logger = logging.getLogger(__name__)
+
+TIMEOUT_HEADER = b"x-request-timeout-ms"
+
+# 499 is the de facto status for requests the client closed; it only reaches logs and metrics
+CLIENT_CLOSED_REQUEST = 499
+
+_current: ContextVar[Optional["Deadline"]] = ContextVar("request_deadline", default=None)
+
+class RequestAbandoned(Exception):
+    """The request was stopped between stages because nobody is waiting for its result"""
+
+    reason = "abandoned"
+    status_code = 500
+    detail = "Request dihentikan"
+
+    def __init__(self, stage: str):
+        super().__init__(f"Request {self.reason} before {stage}")
+        self.stage = stage
+
+class DeadlineExceeded(RequestAbandoned):
+    """The request's time budget ran out"""
+
+    reason = "deadline"
+    status_code = 504
+    detail = "Batas waktu request terlampaui sebelum prediksi selesai"
+
+class ClientDisconnected(RequestAbandoned):
+    """The client closed the connection"""
+
+    reason = "disconnected"
+    status_code = CLIENT_CLOSED_REQUEST
+    detail = "Koneksi klien terputus"
+
+def current_deadline() -> Optional["Deadline"]:
+    """Deadline of the request being handled, or None outside the deadline paths"""
+    return _current.get()
+
+async def check_deadline(stage: str) -> None:
+    """
+    Stop the current request if its budget is spent or its client is gone.
+
+    Args:
+        stage: Stage about to start, recorded with the abandoned request
+
+    Raises:
+        RequestAbandoned: If the request should not go on
+    """
+    deadline = _current.get()
+    if deadline is not None:
+        await deadline.check(stage)
+
+async def abandoned_response(request: Request, exc: RequestAbandoned) -> JSONResponse:
+    """Exception handler answering abandoned requests, registered by each service"""
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail})
+
+class Deadline:
+    """Time budget and disconnect state of one request"""
+
+    def __init__(self, budget: Optional[float], receive: Callable, metrics: Optional[ServiceMetrics] = None):
+        """
+        Args:
+            budget: Seconds from now, None for no time limit
+            receive: ASGI receive of the request, polled for http.disconnect
+            metrics: Service metrics receiving abandoned request counts
+        """
+        self.expires_at = time.monotonic() + budget if budget is not None else None
+        self.body_received = False
+        self.disconnected = False
+        self._receive = receive
+        self._metrics = metrics
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, None without a time limit"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    async def client_disconnected(self) -> bool:
+        """Whether the client has closed the connection, without waiting for it"""
+        # Until the endpoint has read the whole body, receive() returns body chunks
+        if self.disconnected or not self.body_received:
+            return self.disconnected
+        with anyio.CancelScope() as scope:
+            scope.cancel()
+            message = await self._receive()
+            if message.get("type") == "http.disconnect":
+                self.disconnected = True
+        return self.disconnected
+
+    def exceeded(self, stage: str) -> DeadlineExceeded:
+        """Count and return the error for a request that ran out of time before stage"""
+        return self.abandon(DeadlineExceeded(stage))
+
+    def abandon(self, error: RequestAbandoned) -> RequestAbandoned:
+        if self._metrics is not None and self._metrics.enabled:
+            self._metrics.abandoned.inc(reason=error.reason, stage=error.stage)
+        logger.info(f"Abandoned request: {str(error)}")
+        return error
+
+    async def check(self, stage: str) -> None:
+        """
+        Raise if the request should not go on to stage.
+
+        Raises:
+            DeadlineExceeded: If the budget is spent
+            ClientDisconnected: If the client has closed the connection
+        """
+        if self.expired():
+            raise self.exceeded(stage)
+        if await self.client_disconnected():
+            raise self.abandon(ClientDisconnected(stage))
+
+def request_budget(scope: Dict[str, Any], default: Optional[float]) -> Optional[float]:
+    """
+    Budget of a request in seconds: X-Request-Timeout-Ms if it is shorter than the default.
+
+    Args:
+        scope: ASGI scope of the request
+        default: Budget in seconds, None for no limit
+
+    Returns:
+        Seconds, or None for no time limit
+    """
+    for name, value in scope["headers"]:
+        if name == TIMEOUT_HEADER:
+            try:
+                requested = float(value) / 1000
+            except ValueError:
+                break
+            if requested > 0:
+                return requested if default is None else min(requested, default)
+            break
+    return default
+
+class DeadlineMiddleware:
+    """ASGI middleware giving requests on some paths a deadline checked between stages"""
+
+    def __init__(
+        self,
+        app: Any,
+        paths: Collection[str],
+        metrics: Optional[ServiceMetrics] = None,
+        timeout_ms: Optional[float] = None
+    ):
+        """
+        Args:
+            app: ASGI application
+            paths: Request paths to give a deadline, e.g. the prediction endpoints
+            metrics: Service metrics receiving abandoned request counts
+            timeout_ms: Default budget, defaults to REQUEST_TIMEOUT_MS; 0 for none
+        """
+        self.app = app
+        self.paths = set(paths)
+        self.metrics = metrics
+        if timeout_ms is None:
+            timeout_ms = float(os.environ.get("REQUEST_TIMEOUT_MS", 30000))
+        self.default_budget = timeout_ms / 1000 if timeout_ms > 0 else None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        deadline = Deadline(request_budget(scope, self.default_budget), receive, self.metrics)
+
+        async def tracked_receive() -> Dict[str, Any]:
+            message = await receive()
+            if message["type"] == "http.request" and not message.get("more_body", False):
+                deadline.body_received = True
+            elif message["type"] == "http.disconnect":
+                deadline.disconnected = True
+            return message
+
+        token = _current.set(deadline)
+        try:
+            await self.app(scope, tracked_receive, send)
+        finally:
+            _current.reset(token)
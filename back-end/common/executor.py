@@ -0,0 +1,235 @@
+"""
+Bounded execution pools for CPU-bound request work
+
+Image decoding, validation and model inference block the asyncio event loop
+when called directly from an ``async def`` handler. ``StageExecutor`` runs
+them on a bounded thread or process pool and lets the handler await the
+result, so the event loop stays free for I/O and health checks.
+
+Pools are process-wide singletons looked up by name with ``get_executor``.
+Each pool is configured from environment variables prefixed with its
+upper-cased name, e.g. for ``get_executor("image")``:
+
+    IMAGE_EXECUTOR_KIND         "thread" (default) or "process"
+    IMAGE_EXECUTOR_WORKERS      pool size, defaults to the number of CPU cores
+    IMAGE_EXECUTOR_MAX_PENDING  tasks queued or running before callers wait,
+                                defaults to four per worker
+
+Model inference uses a thread-only pool: the loaded model lives in the serving
+process, and TensorFlow releases the GIL while it runs.
+"""
+
+import os
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from common.deadlines import current_deadline
+from common.profiling import current_profile
+
+logger = logging.getLogger(__name__)
+
+EXECUTOR_KINDS = ("thread", "process")
+
+class StageExecutor:
+    """Bounded thread or process pool that async handlers can await"""
+
+    def __init__(
+        self,
+        name: str,
+        kind: str = "thread",
+        max_workers: Optional[int] = None,
+        max_pending: Optional[int] = None
+    ):
+        """
+        Create a bounded pool.
+
+        Args:
+            name: Name used in thread names and logs
+            kind: "thread" or "process"
+            max_workers: Number of pool workers, defaults to the number of CPU cores
+            max_pending: Maximum tasks queued or running at once before callers wait
+
+        Raises:
+            ValueError: If kind is not supported
+        """
+        if kind not in EXECUTOR_KINDS:
+            raise ValueError(f"Unsupported executor kind '{kind}', expected one of {EXECUTOR_KINDS}")
+
+        self.name = name
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+
+    @classmethod
+    def from_env(
+        cls,
+        name: str,
+        default_kind: str = "thread",
+        kinds: Tuple[str, ...] = EXECUTOR_KINDS
+    ) -> "StageExecutor":
+        """
+        Create a pool configured from <NAME>_EXECUTOR_* environment variables.
+
+        Args:
+            name: Pool name, also used as the environment variable prefix
+            default_kind: Pool kind used when <NAME>_EXECUTOR_KIND is not set
+            kinds: Pool kinds allowed for this pool
+
+        Returns:
+            Configured StageExecutor
+
+        Raises:
+            ValueError: If the configured kind is not allowed
+        """
+        prefix = f"{name.upper()}_EXECUTOR"
+        kind = os.environ.get(f"{prefix}_KIND", default_kind).lower()
+        if kind not in kinds:
+            raise ValueError(f"{prefix}_KIND must be one of {kinds}, got '{kind}'")
+
+        workers = os.environ.get(f"{prefix}_WORKERS")
+        pending = os.environ.get(f"{prefix}_MAX_PENDING")
+        return cls(
+            name,
+            kind=kind,
+            max_workers=int(workers) if workers else None,
+            max_pending=int(pending) if pending else None
+        )
+
+    def _get_executor(self) -> Executor:
+        """Create the underlying pool on first use"""
+        with self._lock:
+            if self._executor is None:
+                if self.kind == "process":
+                    # TensorFlow is not fork-safe, so workers are spawned fresh
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_workers,
+                        thread_name_prefix=f"{self.name}-worker"
+                    )
+                logger.info(
+                    f"Started {self.kind} pool '{self.name}' "
+                    f"(workers={self.max_workers}, max_pending={self.max_pending})"
+                )
+            return self._executor
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """
+        Run a blocking function on the pool and await its result.
+
+        Waits without blocking the event loop while max_pending tasks are already
+        queued or running. A task of a request with a deadline (common/deadlines.py)
+        is dropped if the deadline passed or the client left while it waited.
+
+        Args:
+            fn: Function to call; must be picklable for process pools
+            *args: Positional arguments for fn
+            **kwargs: Keyword arguments for fn
+
+        Returns:
+            Return value of fn
+
+        Raises:
+            RequestAbandoned: If the request's deadline passed or its client disconnected
+        """
+        loop = asyncio.get_running_loop()
+        if self._slots is None:
+            # Created lazily so the semaphore belongs to the serving event loop
+            self._slots = asyncio.Semaphore(self.max_pending)
+
+        async with self._slots:
+            deadline = current_deadline()
+            if deadline is not None:
+                await deadline.check(self.name)
+            with self._lock:
+                self._pending += 1
+            try:
+                call = functools.partial(fn, *args, **kwargs)
+                profile = current_profile()
+                if profile is not None:
+                    if self.kind == "thread":
+                        call = profile.wrap(call)
+                    else:
+                        profile.note(f"Work on the '{self.name}' process pool is not profiled")
+                return await loop.run_in_executor(self._get_executor(), call)
+            finally:
+                with self._lock:
+                    self._pending -= 1
+
+    def pending(self) -> int:
+        """Number of tasks currently queued or running"""
+        with self._lock:
+            return self._pending
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool configuration and current load"""
+        return {
+            "kind": self.kind,
+            "workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "pending": self.pending()
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """
+        Shut down the underlying pool.
+
+        Args:
+            wait: Whether to wait for running tasks to finish
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+_executors: Dict[str, StageExecutor] = {}
+_executors_lock = threading.Lock()
+
+def get_executor(
+    name: str,
+    default_kind: str = "thread",
+    kinds: Tuple[str, ...] = EXECUTOR_KINDS
+) -> StageExecutor:
+    """
+    Get the process-wide pool with the given name, creating it from the environment.
+
+    Services running in the same process share pools by name.
+
+    Args:
+        name: Pool name, e.g. "image" or "inference"
+        default_kind: Pool kind used when <NAME>_EXECUTOR_KIND is not set
+        kinds: Pool kinds allowed for this pool
+
+    Returns:
+        Shared StageExecutor
+    """
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = StageExecutor.from_env(name, default_kind, kinds)
+        return _executors[name]
+
+def shutdown_executors(wait: bool = True) -> None:
+    """
+    Shut down every pool created through get_executor.
+
+    Args:
+        wait: Whether to wait for running tasks to finish
+    """
+    with _executors_lock:
+        executors = list(_executors.values())
+        _executors.clear()
+    for executor in executors:
+        executor.shutdown(wait=wait)
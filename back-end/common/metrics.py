@@ -0,0 +1,433 @@
+"""
+Prometheus metrics shared by the services
+
+Each service creates one ``ServiceMetrics``, wraps its app in
+``MetricsMiddleware`` and serves ``ServiceMetrics.render()`` on ``/metrics``
+in the Prometheus text format. It records:
+
+    growmate_requests_total             requests by route, method and status code
+    growmate_request_duration_seconds   request latency histogram by route
+    growmate_requests_in_flight         requests currently being handled
+    growmate_stage_duration_seconds     latency histogram per pipeline stage
+    growmate_queue_depth                items waiting in each pool or batcher queue
+    growmate_requests_shed_total        requests refused by admission control, by reason
+    growmate_requests_abandoned_total   requests stopped on deadline or disconnect, by reason and stage
+    growmate_cascade_images_total       images decided at each stage of a cascade, by stage and decision
+    growmate_model_load_seconds         time it took to load the model
+
+Recording is a dictionary lookup and a few additions under a lock; queue
+depths are sampled only when /metrics is scraped.
+
+Workers forked by common/runner.py each record their own metrics. With
+METRICS_MULTIPROC_DIR set (the runner sets it), every worker also writes a
+snapshot there and /metrics merges them, so any worker answers for all of
+them: counters and histograms are summed, including those of workers that
+have exited, and gauges are summed over the live workers (the model load
+time takes their maximum).
+
+Configuration through environment variables:
+
+    METRICS_ENABLED          "true" (default) or "false" to skip recording
+    METRICS_MULTIPROC_DIR    directory for per-worker snapshots, unset for a single process
+"""
+
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from common.profiling import current_profile
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from a cached hit to a slow CPU forward pass
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Seconds between snapshot writes in multi-process mode
+SNAPSHOT_INTERVAL = 2.0
+
+class Metric:
+    """Labelled metric values guarded by a lock"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        """
+        Args:
+            name: Metric name
+            documentation: HELP text
+            labelnames: Names of the labels each sample carries
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        """Current (label values, value) pairs"""
+        with self._lock:
+            return [(key, self._copy(value)) for key, value in self._values.items()]
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return value
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+class Gauge(Metric):
+    """Value that goes up and down, or is sampled from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        multiprocess_mode: str = "livesum"
+    ):
+        """
+        Args:
+            name: Metric name
+            documentation: HELP text
+            labelnames: Names of the labels each sample carries
+            multiprocess_mode: How workers' values merge, "livesum" or "max" (live workers only)
+        """
+        super().__init__(name, documentation, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn: Callable[[], float], **labels: Any) -> None:
+        """Sample the value from fn whenever metrics are collected"""
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def snapshot(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        samples = dict(super().snapshot())
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, fn in functions:
+            try:
+                samples[key] = float(fn())
+            except Exception as e:
+                logger.warning(f"Could not sample {self.name}{key}: {str(e)}")
+        return list(samples.items())
+
+class Histogram(Metric):
+    """Bucketed distribution of observed values, stored as [bucket counts..., sum, count]"""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0.0] * (len(self.buckets) + 3)
+            counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        return list(value)
+
+class MetricsRegistry:
+    """Set of metrics rendered together, optionally merged across worker processes"""
+
+    def __init__(self, const_labels: Optional[Dict[str, str]] = None, multiprocess: bool = True):
+        """
+        Args:
+            const_labels: Labels added to every sample, e.g. the service name
+            multiprocess: Whether to merge snapshots from METRICS_MULTIPROC_DIR when it is set
+        """
+        self.const_labels = dict(const_labels or {})
+        self.multiprocess = multiprocess
+        self._metrics: Dict[str, Metric] = {}
+        self._snapshot_pid: Optional[int] = None
+        self._snapshot_prefix = "-".join(str(value) for value in self.const_labels.values()) or "metrics"
+
+    @property
+    def multiprocess_dir(self) -> Optional[str]:
+        """
+        Snapshot directory, read when used: the prefork runner sets it after
+        some services have already been imported.
+        """
+        return (os.environ.get("METRICS_MULTIPROC_DIR") or None) if self.multiprocess else None
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, List[Tuple[Tuple[str, ...], Any]]]:
+        """Current values of every metric in this process"""
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self, pid: int) -> str:
+        return os.path.join(self.multiprocess_dir, f"{self._snapshot_prefix}-{pid}.json")
+
+    def _snapshot_pids(self) -> List[int]:
+        prefix = f"{self._snapshot_prefix}-"
+        pids = []
+        try:
+            names = os.listdir(self.multiprocess_dir)
+        except OSError:
+            return pids
+        for name in names:
+            if name.startswith(prefix) and name.endswith(".json"):
+                suffix = name[len(prefix):-len(".json")]
+                if suffix.isdigit():
+                    pids.append(int(suffix))
+        return pids
+
+    def write_snapshot(self) -> None:
+        """Write this process's values for the other workers to merge"""
+        if not self.multiprocess_dir:
+            return
+        path = self._snapshot_path(os.getpid())
+        data = {name: [[list(key), value] for key, value in samples] for name, samples in self.snapshot().items()}
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(data, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot {path}: {str(e)}")
+
+    def start_snapshots(self) -> None:
+        """Write snapshots periodically from this process; cheap to call on every request"""
+        if not self.multiprocess_dir or self._snapshot_pid == os.getpid():
+            return
+        # Threads do not survive a fork, so each worker starts its own
+        self._snapshot_pid = os.getpid()
+        os.makedirs(self.multiprocess_dir, exist_ok=True)
+
+        def write_periodically():
+            while True:
+                self.write_snapshot()
+                time.sleep(SNAPSHOT_INTERVAL)
+
+        threading.Thread(target=write_periodically, name="metrics-snapshot", daemon=True).start()
+
+    def collect(self) -> Dict[str, Dict[Tuple[str, ...], Any]]:
+        """Values of every metric, merged with the other workers' snapshots"""
+        merged: Dict[str, Dict[Tuple[str, ...], Any]] = {
+            name: dict(samples) for name, samples in self.snapshot().items()
+        }
+        if not self.multiprocess_dir:
+            return merged
+
+        own_pid = os.getpid()
+        for pid in self._snapshot_pids():
+            if pid == own_pid:
+                continue
+            try:
+                with open(self._snapshot_path(pid)) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = pid_alive(pid)
+
+            for name, samples in data.items():
+                metric = self._metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                values = merged.setdefault(name, {})
+                for key, value in samples:
+                    key = tuple(key)
+                    if metric.kind == "histogram":
+                        current = values.get(key)
+                        values[key] = value if current is None else [a + b for a, b in zip(current, value)]
+                    elif metric.kind == "gauge" and metric.multiprocess_mode == "max":
+                        values[key] = max(values.get(key, value), value)
+                    else:
+                        values[key] = values.get(key, 0.0) + value
+        return merged
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, values in self.collect().items():
+            metric = self._metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(values.items()):
+                labels = {**self.const_labels, **dict(zip(metric.labelnames, key))}
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+                    continue
+
+                cumulative = 0.0
+                for bound, count in zip(metric.buckets + (float("inf"),), value):
+                    cumulative += count
+                    bucket_labels = {**labels, "le": "+Inf" if bound == float("inf") else format_value(bound)}
+                    lines.append(f"{name}_bucket{format_labels(bucket_labels)} {format_value(cumulative)}")
+                lines.append(f"{name}_sum{format_labels(labels)} {format_value(value[-2])}")
+                lines.append(f"{name}_count{format_labels(labels)} {format_value(value[-1])}")
+        return "\n".join(lines) + "\n"
+
+def pid_alive(pid: int) -> bool:
+    """Whether a process with this pid exists"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def format_labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+
+    def escape(value: Any) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels.items()) + "}"
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class ServiceMetrics:
+    """The standard metrics of one service"""
+
+    def __init__(self, service: str, enabled: Optional[bool] = None):
+        """
+        Args:
+            service: Service name, added as the "service" label
+            enabled: Whether to record anything, defaults to METRICS_ENABLED
+        """
+        if enabled is None:
+            enabled = os.environ.get("METRICS_ENABLED", "true").lower() == "true"
+
+        self.service = service
+        self.enabled = enabled
+        self.registry = MetricsRegistry({"service": service}, multiprocess=enabled)
+        self.requests = self.registry.register(Counter(
+            "growmate_requests_total", "HTTP requests by route, method and status code", ("route", "method", "status")
+        ))
+        self.request_duration = self.registry.register(Histogram(
+            "growmate_request_duration_seconds", "HTTP request latency", ("route",)
+        ))
+        self.in_flight = self.registry.register(Gauge(
+            "growmate_requests_in_flight", "HTTP requests currently being handled"
+        ))
+        self.stage_duration = self.registry.register(Histogram(
+            "growmate_stage_duration_seconds", "Latency of each pipeline stage", ("stage",)
+        ))
+        self.queue_depth = self.registry.register(Gauge(
+            "growmate_queue_depth", "Items queued or running in each pool or batcher", ("queue",)
+        ))
+        self.shed = self.registry.register(Counter(
+            "growmate_requests_shed_total", "Requests refused by admission control", ("reason",)
+        ))
+        self.abandoned = self.registry.register(Counter(
+            "growmate_requests_abandoned_total",
+            "Requests stopped before a stage because their deadline passed or their client disconnected",
+            ("reason", "stage")
+        ))
+        self.cascade = self.registry.register(Counter(
+            "growmate_cascade_images_total", "Images decided at each stage of a cascade", ("stage", "decision")
+        ))
+        self.model_load = self.registry.register(Gauge(
+            "growmate_model_load_seconds", "Time it took to load the model", multiprocess_mode="max"
+        ))
+
+    def observe_stage(self, stage: str, seconds: float) -> None:
+        """Record the duration of a pipeline stage, also for the request's profile if it has one"""
+        profile = current_profile()
+        if profile is not None:
+            profile.record_stage(stage, seconds)
+        if self.enabled:
+            self.stage_duration.observe(seconds, stage=stage)
+
+    @contextmanager
+    def time_stage(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block, including awaits, as a pipeline stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started)
+
+    def track_queue(self, queue: str, depth: Callable[[], float]) -> None:
+        """Sample a queue's depth from depth() whenever metrics are scraped"""
+        self.queue_depth.set_function(depth, queue=queue)
+
+    def render(self) -> str:
+        """Metrics in the Prometheus text format"""
+        return self.registry.render()
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts, latency and in-flight requests"""
+
+    def __init__(self, app: Any, metrics: ServiceMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http" or not self.metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        metrics = self.metrics
+        metrics.registry.start_snapshots()
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_with_status(message: Dict[str, Any]) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        metrics.in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            metrics.in_flight.dec()
+            # The route template, not the raw path, keeps the label set small
+            route = getattr(scope.get("route"), "path", "unmatched")
+            metrics.requests.inc(route=route, method=scope["method"], status=status_code)
+            metrics.request_duration.observe(time.perf_counter() - started, route=route)
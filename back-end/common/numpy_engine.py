@@ -0,0 +1,273 @@
+"""
+Pure-NumPy inference for small fully connected Keras models
+
+A model of a handful of Dense layers, like the crop recommendation model,
+spends far more time in TensorFlow's call overhead than in its arithmetic,
+and TensorFlow itself adds seconds of import time and hundreds of MB to every
+worker. ``load_numpy_predictor`` reads the architecture and weights of a
+saved Sequential model once with h5py and runs the forward pass as NumPy
+matrix products, without importing TensorFlow.
+
+Supported layers are InputLayer, Dense, BatchNormalization (over the last
+axis), Activation, and the layers that do nothing at inference (Dropout,
+GaussianNoise, GaussianDropout, ActivityRegularization). BatchNormalization
+uses its moving statistics and is folded into the neighbouring Dense kernel
+where possible, so the engine does no more work than the Dense layers. Any
+other layer raises ValueError at load time rather than producing wrong
+outputs.
+
+Outputs match Keras up to float32 rounding; ``tools/numpy_backend.py parity``
+checks a model against Keras before it is served this way. NumPy state
+survives a fork, so the predictor can be loaded once in the prefork parent
+(see common/runner.py).
+"""
+
+import io
+import json
+import time
+import logging
+import zipfile
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Layers that are the identity at inference
+IDENTITY_LAYERS = ("Dropout", "GaussianNoise", "GaussianDropout", "ActivityRegularization")
+
+def softmax(x: np.ndarray) -> np.ndarray:
+    exp = np.exp(x - x.max(axis=-1, keepdims=True))
+    return exp / exp.sum(axis=-1, keepdims=True)
+
+ACTIVATIONS: Dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0.0, out=x),
+    "sigmoid": lambda x: 1.0 / (1.0 + np.exp(-x)),
+    "tanh": np.tanh,
+    "softmax": softmax
+}
+
+def activation_name(config: Dict[str, Any]) -> str:
+    """A layer's activation as a name in ACTIVATIONS"""
+    activation = config.get("activation") or "linear"
+    if not isinstance(activation, str) or activation not in ACTIVATIONS:
+        raise ValueError(f"Activation '{activation}' is not supported by the NumPy engine")
+    return activation
+
+def read_h5_model(model_path: str) -> Tuple[Dict[str, Any], Dict[str, List[np.ndarray]]]:
+    """
+    Read the architecture and per-layer weights of a saved Keras model.
+
+    Args:
+        model_path: Path to a .h5 or .keras model file
+
+    Returns:
+        Model config and each layer's weights, by layer name, in the layer's weight order
+    """
+    import h5py
+
+    if model_path.endswith(".keras"):
+        with zipfile.ZipFile(model_path) as archive:
+            config = json.loads(archive.read("config.json"))
+            weights_file = io.BytesIO(archive.read("model.weights.h5"))
+        with h5py.File(weights_file, "r") as f:
+            layers = f["layers"]
+            weights = {
+                name: [layers[name]["vars"][str(i)][()] for i in range(len(layers[name]["vars"]))]
+                for name in layers
+            }
+        return config, weights
+
+    with h5py.File(model_path, "r") as f:
+        config = f.attrs.get("model_config")
+        if config is None:
+            raise ValueError(f"{model_path} has no model config; save the whole model, not only its weights")
+        config = json.loads(config.decode("utf-8") if isinstance(config, bytes) else config)
+        # Weights are under model_weights/ in full-model files and at the top level in weight files
+        root = f["model_weights"] if "model_weights" in f else f
+        weights = {}
+        for name in root:
+            names = root[name].attrs.get("weight_names", [])
+            weights[name] = [
+                root[name][weight.decode("utf-8") if isinstance(weight, bytes) else weight][()]
+                for weight in names
+            ]
+    return config, weights
+
+class NumpyPredictor:
+    """Runs a Sequential Dense network as NumPy matrix products"""
+
+    mode = "numpy"
+
+    def __init__(
+        self,
+        steps: List[Tuple[Optional[np.ndarray], Optional[np.ndarray], str]],
+        input_shape: Tuple[Optional[int], ...]
+    ):
+        """
+        Args:
+            steps: (weight, bias, activation) per step; a 2-D weight is a kernel
+                multiplied from the right, a 1-D weight a per-feature scale, and
+                either may be None
+            input_shape: Model input shape with a leading None batch axis
+        """
+        self.steps = steps
+        self.input_shape = input_shape
+        self.dtype = np.dtype(np.float32)
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run the network on a batch.
+
+        Args:
+            batch: Input array with a leading batch axis, cast to float32 like Keras does
+
+        Returns:
+            Model outputs as a float32 NumPy array
+        """
+        # A copy, so biases and activations can be applied in place
+        x = np.array(batch, dtype=self.dtype)
+        for weight, bias, activation in self.steps:
+            if weight is not None:
+                x = x @ weight if weight.ndim == 2 else x * weight
+            if bias is not None:
+                x += bias
+            x = ACTIVATIONS[activation](x)
+        return x
+
+    def warmup(self, batch_sizes: Iterable[int] = (1,)) -> float:
+        """
+        Run dummy batches, which only touches the weights so they are paged in.
+
+        Args:
+            batch_sizes: Batch sizes to run
+
+        Returns:
+            Warmup duration in seconds
+        """
+        started = time.perf_counter()
+        for size in sorted(set(batch_sizes)):
+            self(np.zeros((size,) + tuple(self.input_shape[1:]), dtype=self.dtype))
+        elapsed = time.perf_counter() - started
+        logger.info(f"Warmed up numpy predictor in {elapsed * 1000:.1f}ms")
+        return elapsed
+
+def batch_norm_affine(config: Dict[str, Any], weights: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Inference-time BatchNormalization as a per-feature scale and shift"""
+    axis = config.get("axis", -1)
+    if isinstance(axis, list):
+        axis = axis[0] if len(axis) == 1 else None
+    if axis not in (-1, 1):
+        raise ValueError(f"BatchNormalization over axis {axis} is not supported by the NumPy engine")
+
+    weights = list(weights)
+    gamma = weights.pop(0) if config.get("scale", True) else 1.0
+    beta = weights.pop(0) if config.get("center", True) else 0.0
+    moving_mean, moving_variance = weights
+    scale = gamma / np.sqrt(moving_variance.astype(np.float64) + config.get("epsilon", 0.001))
+    return scale, beta - moving_mean * scale
+
+def build_steps(
+    layers: List[Dict[str, Any]],
+    weights: Dict[str, List[np.ndarray]]
+) -> List[Tuple[Optional[np.ndarray], Optional[np.ndarray], str]]:
+    """
+    Turn Sequential layer configs into NumPy steps, folding BatchNormalization into Dense kernels.
+
+    Args:
+        layers: Layer configs of a Sequential model
+        weights: Each layer's weights by layer name
+
+    Returns:
+        (weight, bias, activation) steps for NumpyPredictor, in float64 until the caller casts them
+
+    Raises:
+        ValueError: If a layer is not supported
+    """
+    steps: List[List[Any]] = []
+    # A BatchNormalization scale and shift not yet folded into a Dense layer
+    pending: Optional[Tuple[np.ndarray, np.ndarray]] = None
+
+    def flush() -> None:
+        nonlocal pending
+        if pending is not None:
+            steps.append([pending[0], pending[1], "linear"])
+            pending = None
+
+    for layer in layers:
+        kind, config = layer["class_name"], layer["config"]
+        name = config.get("name")
+        if kind == "InputLayer" or kind in IDENTITY_LAYERS:
+            continue
+
+        if kind == "Dense":
+            kernel = weights[name][0].astype(np.float64)
+            bias = weights[name][1].astype(np.float64) if config.get("use_bias", True) else np.zeros(kernel.shape[1])
+            if pending is not None:
+                # (x * s + t) @ W + b == x @ (s[:, None] * W) + (t @ W + b)
+                scale, shift = pending
+                kernel, bias = scale[:, np.newaxis] * kernel, shift @ kernel + bias
+                pending = None
+            steps.append([kernel, bias, activation_name(config)])
+        elif kind == "BatchNormalization":
+            scale, shift = batch_norm_affine(config, weights[name])
+            if pending is not None:
+                scale, shift = pending[0] * scale, pending[1] * scale + shift
+                pending = None
+            if steps and steps[-1][2] == "linear" and steps[-1][0] is not None and steps[-1][0].ndim == 2:
+                # Right after a linear Dense: (x @ W + b) * s + t == x @ (W * s) + (b * s + t)
+                steps[-1][0] = steps[-1][0] * scale
+                steps[-1][1] = steps[-1][1] * scale + shift
+            else:
+                pending = (scale, shift)
+        elif kind == "Activation":
+            activation = activation_name(config)
+            flush()
+            if steps and steps[-1][2] == "linear":
+                steps[-1][2] = activation
+            else:
+                steps.append([None, None, activation])
+        else:
+            raise ValueError(f"Layer {kind} ('{name}') is not supported by the NumPy engine")
+    flush()
+    return [(weight, bias, activation) for weight, bias, activation in steps]
+
+def input_shape_of(layers: List[Dict[str, Any]]) -> Tuple[Optional[int], ...]:
+    """Input shape from the InputLayer (Keras 3) or the first layer's batch_input_shape (Keras 2)"""
+    for layer in layers[:1]:
+        config = layer["config"]
+        shape = config.get("batch_shape") or config.get("batch_input_shape")
+        if shape:
+            return (None,) + tuple(shape[1:])
+    raise ValueError("The model config does not declare an input shape")
+
+def load_numpy_predictor(model_path: str) -> NumpyPredictor:
+    """
+    Load a saved Sequential Keras model into a NumpyPredictor.
+
+    Args:
+        model_path: Path to a .h5 or .keras model file
+
+    Returns:
+        Predictor callable on NumPy batches, like the Keras predictors
+
+    Raises:
+        ValueError: If the model is not a Sequential model of supported layers
+    """
+    config, weights = read_h5_model(model_path)
+    if config.get("class_name") != "Sequential":
+        raise ValueError(f"The NumPy engine runs Sequential models, {model_path} is {config.get('class_name')}")
+    layers = config["config"]["layers"] if isinstance(config["config"], dict) else config["config"]
+
+    steps = [
+        (
+            None if weight is None else weight.astype(np.float32),
+            None if bias is None else bias.astype(np.float32),
+            activation
+        )
+        for weight, bias, activation in build_steps(layers, weights)
+    ]
+    predictor = NumpyPredictor(steps, input_shape_of(layers))
+    logger.info(f"Loaded {model_path} into the NumPy engine ({len(steps)} steps)")
+    return predictor
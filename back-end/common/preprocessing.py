@@ -0,0 +1,160 @@
+"""
+Input normalization for the image classification models
+
+Each model expects its pixels scaled one way: divided by 255 ("rescale"),
+mapped to [-1, 1] like MobileNet's ``preprocess_input`` ("mobilenet"), or left
+at 0-255 because the model starts with its own Rescaling or Normalization
+layer ("none"). The scheme is resolved once when the model is loaded.
+
+By default the scaling becomes part of the model: ``with_preprocessing``
+wraps the model behind a uint8 input and a Rescaling layer, so requests send
+the decoded uint8 pixels straight in without building float copies.
+
+Configuration through environment variables:
+
+    MODEL_NORMALIZATION   "auto" (default), "rescale", "mobilenet" or "none"
+    GRAPH_PREPROCESSING   "true" (default) to scale inside the model graph,
+                          "false" to scale on the host before inference
+"""
+
+import os
+import json
+import zipfile
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NORMALIZATIONS = ("rescale", "mobilenet", "none")
+
+# (scale, offset) applied as pixels * scale + offset
+NORMALIZATION_PARAMS: Dict[str, Tuple[float, float]] = {
+    "rescale": (1.0 / 255.0, 0.0),
+    "mobilenet": (1.0 / 127.5, -1.0),
+    "none": (1.0, 0.0)
+}
+
+# Layers that mean the model scales raw 0-255 pixels itself
+SELF_NORMALIZING_LAYERS = ("Rescaling", "Normalization")
+
+def read_model_config(model_path: str) -> Optional[Dict[str, Any]]:
+    """
+    Read a saved Keras model's architecture config without building the model.
+
+    Args:
+        model_path: Path to a .h5 or .keras model file
+
+    Returns:
+        Parsed model config, or None if it cannot be read
+    """
+    try:
+        if model_path.endswith(".keras"):
+            with zipfile.ZipFile(model_path) as archive:
+                return json.loads(archive.read("config.json"))
+
+        import h5py
+        with h5py.File(model_path, "r") as f:
+            config = f.attrs.get("model_config")
+            if config is None:
+                return None
+            if isinstance(config, bytes):
+                config = config.decode("utf-8")
+            return json.loads(config)
+    except Exception as e:
+        logger.warning(f"Could not read model config from {model_path}: {str(e)}")
+        return None
+
+def detect_normalization(model_path: str) -> str:
+    """
+    Detect the input normalization a saved model expects.
+
+    Models that contain a Rescaling or Normalization layer (including inside a
+    nested base model, as in EfficientNet) take raw pixels. Everything else
+    gets the /255 scaling the services have always applied first.
+
+    Args:
+        model_path: Path to a .h5 or .keras model file
+
+    Returns:
+        "none" or "rescale"
+    """
+    config = read_model_config(model_path)
+
+    def contains_layer(node: Any) -> bool:
+        if isinstance(node, dict):
+            if node.get("class_name") in SELF_NORMALIZING_LAYERS:
+                return True
+            return any(contains_layer(value) for value in node.values())
+        if isinstance(node, list):
+            return any(contains_layer(value) for value in node)
+        return False
+
+    return "none" if config is not None and contains_layer(config) else "rescale"
+
+def resolve_normalization(model_path: str, normalization: Optional[str] = None) -> str:
+    """
+    Resolve the normalization scheme for a model once at load time.
+
+    Args:
+        model_path: Path to the Keras model file
+        normalization: Scheme or "auto", defaults to MODEL_NORMALIZATION
+
+    Returns:
+        One of NORMALIZATIONS
+
+    Raises:
+        ValueError: If the configured scheme is not supported
+    """
+    normalization = (normalization or os.environ.get("MODEL_NORMALIZATION", "auto")).lower()
+    if normalization == "auto":
+        normalization = detect_normalization(model_path)
+        logger.info(f"Detected input normalization '{normalization}' for {model_path}")
+    elif normalization not in NORMALIZATIONS:
+        raise ValueError(f"MODEL_NORMALIZATION must be 'auto' or one of {NORMALIZATIONS}, got '{normalization}'")
+    return normalization
+
+def graph_preprocessing_enabled() -> bool:
+    """Whether normalization runs inside the model graph (GRAPH_PREPROCESSING)"""
+    return os.environ.get("GRAPH_PREPROCESSING", "true").lower() == "true"
+
+def normalize_pixels(pixels: np.ndarray, normalization: str) -> np.ndarray:
+    """
+    Scale uint8 pixels on the host, for models without in-graph preprocessing.
+
+    Args:
+        pixels: uint8 pixel array
+        normalization: One of NORMALIZATIONS
+
+    Returns:
+        float32 array
+    """
+    scale, offset = NORMALIZATION_PARAMS[normalization]
+    normalized = pixels.astype(np.float32)
+    normalized *= scale
+    if offset:
+        normalized += offset
+    return normalized
+
+def with_preprocessing(model: Any, normalization: str) -> Any:
+    """
+    Wrap a Keras model so it takes uint8 pixels and scales them in-graph.
+
+    Resizing stays in the decode stage, which already produces pixels at the
+    model input size; a resize layer would need full-resolution tensors.
+
+    Args:
+        model: Loaded Keras model with a single float image input
+        normalization: One of NORMALIZATIONS
+
+    Returns:
+        Keras model with a uint8 input of the same shape
+    """
+    from tensorflow import keras
+
+    scale, offset = NORMALIZATION_PARAMS[normalization]
+    inputs = keras.Input(shape=tuple(model.input_shape[1:]), dtype="uint8", name="pixels")
+    # Rescaling casts to float32 first, so it also covers "none"
+    scaled = keras.layers.Rescaling(scale, offset=offset, name=f"{normalization}_preprocessing")(inputs)
+    return keras.Model(inputs, model(scaled, training=False), name=f"{model.name}_uint8")
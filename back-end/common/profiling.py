@@ -0,0 +1,305 @@
+"""
+Opt-in profiling of single requests
+
+A trusted caller can ask where the time of one request went by sending the
+``X-Profile`` header (or the ``profile`` query parameter) together with an
+``X-Profile-Token`` header matching PROFILING_TOKEN. The mode selects what
+is collected:
+
+    timing       stage durations in a Server-Timing header (also "1" or "true")
+    cprofile     also the top functions by cumulative time, profiled with
+                 cProfile on the image and inference thread pools
+    tracemalloc  also the peak traced memory and the largest allocation sites
+
+Stage durations come from ``ServiceMetrics.observe_stage``, which reports to
+the profile of the current request through a context variable, so every
+stage a service already measures shows up without changes to its handlers.
+cProfile and tracemalloc summaries are added to JSON responses under a
+``profile`` key. tracemalloc traces the whole process, so allocations of
+concurrent requests are included. Profiled requests bypass the prediction
+cache, so the pipeline always runs.
+
+Without PROFILING_TOKEN the middleware passes every request straight
+through, and for ordinary requests the hooks are a single context variable
+lookup.
+
+Configuration through environment variables:
+
+    PROFILING_TOKEN    shared secret for X-Profile-Token, unset to disable profiling
+"""
+
+import os
+import hmac
+import json
+import time
+import cProfile
+import pstats
+import logging
+import threading
+import tracemalloc
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from urllib.parse import parse_qs
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MODES = ("timing", "cprofile", "tracemalloc")
+# Entries listed in the cProfile and tracemalloc summaries
+TOP_ENTRIES = 25
+
+_current: ContextVar[Optional["RequestProfile"]] = ContextVar("request_profile", default=None)
+
+# tracemalloc is process-wide: the first traced request starts it, the last one stops it
+_tracing_lock = threading.Lock()
+_tracing_requests = 0
+
+def current_profile() -> Optional["RequestProfile"]:
+    """Profile of the request being handled, or None when it is not profiled"""
+    profile = _current.get()
+    if profile is not None and profile.active:
+        return profile
+    return None
+
+def short_path(path: str) -> str:
+    """Last two components of a source path, enough to recognize the module"""
+    return "/".join(path.replace("\\", "/").split("/")[-2:])
+
+class RequestProfile:
+    """Stage durations and optional cProfile/tracemalloc data for one request"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.active = True
+        self.stages: Dict[str, float] = {}
+        self.notes: List[str] = []
+        self._lock = threading.Lock()
+        self._stats: Optional[pstats.Stats] = None
+        self._traced = False
+
+    def record_stage(self, stage: str, seconds: float) -> None:
+        """Add the duration of a pipeline stage; repeated stages are summed"""
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def wrap(self, call: Callable[[], Any]) -> Callable[[], Any]:
+        """
+        Profile a call that runs on a pool thread.
+
+        Args:
+            call: Function without arguments
+
+        Returns:
+            call itself unless the mode is "cprofile"
+        """
+        if self.mode != "cprofile":
+            return call
+
+        def profiled() -> Any:
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return call()
+            finally:
+                profiler.disable()
+                self._add_stats(profiler)
+
+        return profiled
+
+    def note(self, message: str) -> None:
+        """Record a caveat shown with the summary, once"""
+        with self._lock:
+            if message not in self.notes:
+                self.notes.append(message)
+
+    def _add_stats(self, profiler: cProfile.Profile) -> None:
+        with self._lock:
+            if not self.active:
+                return
+            if self._stats is None:
+                self._stats = pstats.Stats(profiler)
+            else:
+                self._stats.add(profiler)
+
+    def start(self) -> None:
+        """Start tracing allocations for the "tracemalloc" mode"""
+        global _tracing_requests
+        if self.mode != "tracemalloc":
+            return
+        with _tracing_lock:
+            if _tracing_requests == 0:
+                tracemalloc.start()
+            else:
+                self.note("Other profiled requests were traced at the same time")
+            _tracing_requests += 1
+            tracemalloc.reset_peak()
+        self._traced = True
+
+    def finish(self) -> Dict[str, Any]:
+        """
+        Stop collecting and summarize the request.
+
+        Returns:
+            Summary dictionary, empty for the "timing" mode or when already finished
+        """
+        global _tracing_requests
+        with self._lock:
+            if not self.active:
+                return {}
+            self.active = False
+
+        summary: Dict[str, Any] = {}
+        if self.mode == "cprofile":
+            summary["cprofile"] = self._cprofile_summary()
+        if self._traced:
+            with _tracing_lock:
+                summary["tracemalloc"] = self._tracemalloc_summary()
+                _tracing_requests -= 1
+                if _tracing_requests == 0:
+                    tracemalloc.stop()
+            self._traced = False
+        if summary and self.notes:
+            summary["notes"] = self.notes
+        return summary
+
+    def _cprofile_summary(self) -> List[Dict[str, Any]]:
+        if self._stats is None:
+            self.note("No work ran on a thread pool, nothing was profiled")
+            return []
+
+        rows = []
+        for (filename, line, name), (_, calls, total, cumulative, _) in self._stats.stats.items():
+            rows.append({
+                "function": f"{short_path(filename)}:{line}({name})",
+                "calls": calls,
+                "total_ms": round(total * 1000.0, 3),
+                "cumulative_ms": round(cumulative * 1000.0, 3)
+            })
+        rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+        return rows[:TOP_ENTRIES]
+
+    def _tracemalloc_summary(self) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>")
+        ))
+        return {
+            "peak_kb": round(peak / 1024.0, 1),
+            "retained_kb": round(current / 1024.0, 1),
+            "retained_by_line": [
+                {
+                    "location": f"{short_path(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+                    "size_kb": round(stat.size / 1024.0, 1),
+                    "count": stat.count
+                }
+                for stat in snapshot.statistics("lineno")[:TOP_ENTRIES]
+            ]
+        }
+
+    def server_timing(self, total: float) -> str:
+        """Server-Timing header value with the stage durations and the total in milliseconds"""
+        with self._lock:
+            stages = list(self.stages.items())
+        entries = [f"{stage};dur={seconds * 1000.0:.2f}" for stage, seconds in stages]
+        entries.append(f"total;dur={total * 1000.0:.2f}")
+        return ", ".join(entries)
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests that carry a valid X-Profile-Token"""
+
+    def __init__(self, app: Any, paths: Sequence[str], token: Optional[str] = None):
+        """
+        Args:
+            app: ASGI application
+            paths: Request paths that may be profiled
+            token: Shared secret, defaults to PROFILING_TOKEN; profiling is off without one
+        """
+        self.app = app
+        self.paths = frozenset(paths)
+        token = token if token is not None else os.environ.get("PROFILING_TOKEN", "")
+        self.token = token.encode() if token else None
+
+    def requested_mode(self, scope: Dict[str, Any]) -> Optional[str]:
+        """Profile mode asked for by a trusted caller, or None"""
+        mode = token = None
+        for name, value in scope["headers"]:
+            if name == b"x-profile-token":
+                token = value
+            elif name == b"x-profile":
+                mode = value.decode("latin-1")
+        if token is None:
+            return None
+        if not hmac.compare_digest(token, self.token):
+            logger.warning(f"Ignoring profiling request with an invalid token for {scope['path']}")
+            return None
+
+        if mode is None:
+            mode = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("profile", [None])[0]
+        if mode is None:
+            return None
+        mode = mode.strip().lower()
+        if mode in ("1", "true"):
+            return "timing"
+        return mode if mode in PROFILE_MODES else None
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if self.token is None or scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        mode = self.requested_mode(scope)
+        if mode is None:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(mode)
+        started = time.perf_counter()
+        start_message: Optional[Dict[str, Any]] = None
+        body: List[bytes] = []
+
+        async def send_profiled(message: Dict[str, Any]) -> None:
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                if mode != "timing" and content_type.startswith(b"application/json"):
+                    # Held back until the body is complete so the summary can be added
+                    start_message = message
+                    return
+                message.setdefault("headers", []).append(
+                    (b"server-timing", profile.server_timing(time.perf_counter() - started).encode())
+                )
+            elif message["type"] == "http.response.body" and start_message is not None:
+                body.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                message = {"type": "http.response.body", "body": self.with_summary(b"".join(body), profile)}
+                headers = [(name, value) for name, value in start_message["headers"] if name != b"content-length"]
+                headers.append((b"content-length", str(len(message["body"])).encode()))
+                headers.append((b"server-timing", profile.server_timing(time.perf_counter() - started).encode()))
+                await send({**start_message, "headers": headers})
+            await send(message)
+
+        reset = _current.set(profile)
+        profile.start()
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            _current.reset(reset)
+            profile.finish()
+
+    @staticmethod
+    def with_summary(body: bytes, profile: RequestProfile) -> bytes:
+        """JSON body with the profile summary under "profile", unchanged if it is not an object"""
+        summary = profile.finish()
+        try:
+            content = json.loads(body)
+        except ValueError:
+            return body
+        if not isinstance(content, dict):
+            return body
+        content["profile"] = {
+            "mode": profile.mode,
+            "stages_ms": {stage: round(seconds * 1000.0, 3) for stage, seconds in profile.stages.items()},
+            **summary
+        }
+        return json.dumps(content, ensure_ascii=False).encode()
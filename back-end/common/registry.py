@@ -0,0 +1,338 @@
+"""
+Versioned model registry with zero-downtime hot-swap
+
+A ``ModelRegistry`` holds the model version that serves requests. A new
+version (e.g. a retrained file written over MODEL_PATH) is loaded and warmed
+up on a background thread while the current one keeps serving, then swapped
+in atomically. Requests pin the version they started with through
+``acquire()``, so a request never mixes two models, and a replaced version
+is released once its last in-flight request has finished:
+
+    registry = ModelRegistry("pest", load_version, MODEL_PATH)
+    with registry.acquire() as version:
+        output = version.predictor(batch)
+    registry.swap_in_background()
+
+Only one load runs at a time. A swap is triggered through the admin
+endpoints from ``admin_router`` or by sending SIGUSR2 to the process.
+
+Under common/runner.py the workers do not swap in place, since a forked
+worker cannot run TensorFlow to convert a changed model. The admin endpoint
+sends SIGUSR2 to the runner instead, which loads the new model through the
+service's preload hook and then replaces the workers one at a time; the new
+workers share the new model copy-on-write and every worker serves until its
+replacement is up.
+
+Configuration through environment variables:
+
+    ADMIN_TOKEN    shared secret for the admin endpoints (X-Admin-Token), unset to disable them
+"""
+
+import os
+import hmac
+import time
+import signal
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+
+from common.cache import file_fingerprint
+
+logger = logging.getLogger(__name__)
+
+class ModelVersion:
+    """A loaded and warmed-up model version with the settings requests need to use it"""
+
+    def __init__(
+        self,
+        version: str,
+        predictor: Any,
+        source: str,
+        info: Optional[Dict[str, Any]] = None,
+        on_close: Optional[Callable[["ModelVersion"], None]] = None
+    ):
+        """
+        Args:
+            version: Version string, part of responses and cache keys
+            predictor: Callable mapping an input batch to model outputs
+            source: Path the model was loaded from
+            info: Service-specific settings such as the input size
+            on_close: Called once when the version is released
+        """
+        self.version = version
+        self.predictor = predictor
+        self.source = source
+        self.info = info or {}
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self.retired = False
+        self._on_close = on_close
+
+    def close(self) -> None:
+        """Release the model; called by the registry once no request uses it"""
+        if self._on_close is not None:
+            try:
+                self._on_close(self)
+            except Exception as e:
+                logger.warning(f"Error releasing model version {self.version}: {str(e)}")
+        self.predictor = None
+        self.info = {}
+        logger.info(f"Released model version {self.version}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "source": self.source,
+            "loaded_at": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.loaded_at)),
+            "in_flight": self.in_flight
+        }
+
+class ModelRegistry:
+    """Serving model version with thread-safe loading and atomic swaps"""
+
+    def __init__(self, name: str, loader: Callable[[str], ModelVersion], default_source: str):
+        """
+        Args:
+            name: Service name used in logs and thread names
+            loader: Loads, warms up and returns a version from a model path
+            default_source: Model path used when no path is given
+        """
+        self.name = name
+        self.loader = loader
+        self.default_source = default_source
+        self.load_error: Optional[str] = None
+        # Taken at import, i.e. in the runner's parent before any worker is forked
+        self._deployed_fingerprint = file_fingerprint(default_source)
+
+        self._current: Optional[ModelVersion] = None
+        self._retiring: List[ModelVersion] = []
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._swap: Dict[str, Any] = {"state": "idle"}
+
+    def deployed_version(self, source: str) -> Optional[str]:
+        """
+        MODEL_VERSION, if source is still the model file deployed with the process.
+
+        A swap under common/runner.py replaces the default file in place, and
+        workers forked afterwards load it as their first version. Comparing the
+        file with its fingerprint from process start keeps them from reporting
+        the deploy-time MODEL_VERSION for the new model.
+
+        Args:
+            source: Path being loaded
+
+        Returns:
+            MODEL_VERSION, or None if it is unset or the file is not the deployed one
+        """
+        if source != self.default_source or file_fingerprint(source) != self._deployed_fingerprint:
+            return None
+        return os.environ.get("MODEL_VERSION")
+
+    def current(self) -> Optional[ModelVersion]:
+        """Serving version, or None before the first successful load"""
+        return self._current
+
+    def load(self, source: Optional[str] = None) -> ModelVersion:
+        """
+        Load a version and swap it in, blocking until it serves.
+
+        Args:
+            source: Model path, defaults to default_source
+
+        Returns:
+            The new serving version
+
+        Raises:
+            Exception: Whatever the loader raises; the current version keeps serving
+        """
+        with self._load_lock:
+            return self._load_and_install(source or self.default_source)
+
+    def ensure_loaded(self) -> Optional[ModelVersion]:
+        """
+        Load the initial version unless one is serving already.
+
+        Returns:
+            Serving version, or None if loading failed (see load_error)
+        """
+        current = self._current
+        if current is not None:
+            return current
+
+        with self._load_lock:
+            if self._current is None:
+                try:
+                    self._load_and_install(self.default_source)
+                except Exception as e:
+                    self.load_error = str(e)
+                    logger.error(f"Error loading {self.name} model: {str(e)}")
+                    logger.error(traceback.format_exc())
+            return self._current
+
+    def swap_in_background(self, source: Optional[str] = None) -> bool:
+        """
+        Start loading a new version on a background thread and swap it in when it is warm.
+
+        Safe to call from a signal handler.
+
+        Args:
+            source: Model path, defaults to default_source
+
+        Returns:
+            False if a load is already running
+        """
+        if not self._load_lock.acquire(blocking=False):
+            return False
+
+        source = source or self.default_source
+        self._swap = {"state": "loading", "source": source, "started_at": time.time()}
+
+        def run() -> None:
+            try:
+                previous = self._current.version if self._current is not None else None
+                started = time.perf_counter()
+                version = self._load_and_install(source)
+                self._swap = {
+                    "state": "swapped",
+                    "version": version.version,
+                    "previous": previous,
+                    "seconds": round(time.perf_counter() - started, 2)
+                }
+            except Exception as e:
+                logger.error(f"Model swap for {self.name} failed, keeping the current version: {str(e)}")
+                logger.error(traceback.format_exc())
+                self._swap = {"state": "failed", "source": source, "error": str(e)}
+            finally:
+                self._load_lock.release()
+
+        threading.Thread(target=run, name=f"{self.name}-model-swap", daemon=True).start()
+        return True
+
+    def _load_and_install(self, source: str) -> ModelVersion:
+        """Load a version and make it the serving one; the caller holds the load lock"""
+        logger.info(f"Loading {self.name} model from {source}")
+        version = self.loader(source)
+
+        with self._lock:
+            previous, self._current = self._current, version
+            release = previous is not None and previous.in_flight == 0
+            if previous is not None:
+                previous.retired = True
+                if not release:
+                    self._retiring.append(previous)
+        self.load_error = None
+        logger.info(f"Serving {self.name} model version {version.version}")
+
+        if release:
+            previous.close()
+        return version
+
+    @contextmanager
+    def acquire(self) -> Iterator[ModelVersion]:
+        """
+        Pin the serving version for the duration of a request.
+
+        Yields:
+            Serving version, kept alive until the block exits even if a swap happens
+
+        Raises:
+            RuntimeError: If no version is loaded
+        """
+        with self._lock:
+            version = self._current
+            if version is None:
+                raise RuntimeError(f"No {self.name} model is loaded")
+            version.in_flight += 1
+        try:
+            yield version
+        finally:
+            with self._lock:
+                version.in_flight -= 1
+                release = version.retired and version.in_flight == 0 and version in self._retiring
+                if release:
+                    self._retiring.remove(version)
+            if release:
+                version.close()
+
+    def install_signal_handler(self, sig: int = signal.SIGUSR2) -> None:
+        """Swap in the model from default_source whenever the process receives sig"""
+        if os.environ.get("RUNNER_PID"):
+            # Workers of common/runner.py are swapped by the runner
+            return
+        if threading.current_thread() is not threading.main_thread():
+            # Only the main thread may set signal handlers, e.g. not under TestClient
+            logger.warning(f"Not on the main thread, {self.name} model swaps on {signal.Signals(sig).name} are unavailable")
+            return
+        signal.signal(sig, lambda signum, frame: self.swap_in_background())
+
+    def status(self) -> Dict[str, Any]:
+        """Serving version, versions still finishing requests and the last swap"""
+        with self._lock:
+            current = self._current.describe() if self._current is not None else None
+            retiring = [version.describe() for version in self._retiring]
+        return {
+            "current": current,
+            "retiring": retiring,
+            "swap": self._swap,
+            "load_error": self.load_error,
+            "pid": os.getpid()
+        }
+
+def admin_router(registry: ModelRegistry, token: Optional[str] = None) -> APIRouter:
+    """
+    Admin endpoints for the model registry, guarded by X-Admin-Token.
+
+        GET  /admin/model        registry status
+        POST /admin/model/swap   load a new version in the background and swap it in
+
+    Args:
+        registry: Registry of the service
+        token: Shared secret, defaults to ADMIN_TOKEN; the endpoints answer 403 without one
+
+    Returns:
+        Router to include in the service's app
+    """
+    router = APIRouter(prefix="/admin/model", include_in_schema=False)
+    expected = token if token is not None else os.environ.get("ADMIN_TOKEN", "")
+
+    def authorize(given: Optional[str]) -> None:
+        if not expected:
+            raise HTTPException(status_code=403, detail="Endpoint admin dinonaktifkan (ADMIN_TOKEN belum diatur)")
+        if given is None or not hmac.compare_digest(given.encode(), expected.encode()):
+            raise HTTPException(status_code=403, detail="Token admin tidak valid")
+
+    @router.get("")
+    def model_status(x_admin_token: Optional[str] = Header(None)) -> Dict[str, Any]:
+        authorize(x_admin_token)
+        return registry.status()
+
+    @router.post("/swap", status_code=202)
+    def swap_model(
+        path: Optional[str] = Query(None, description="Model file to load, defaults to MODEL_PATH"),
+        x_admin_token: Optional[str] = Header(None)
+    ) -> Dict[str, Any]:
+        authorize(x_admin_token)
+        if path is not None and not os.path.exists(path):
+            raise HTTPException(status_code=404, detail=f"File model tidak ditemukan: {path}")
+
+        runner_pid = os.environ.get("RUNNER_PID")
+        if runner_pid:
+            # The runner loads MODEL_PATH and replaces every worker
+            if path is not None:
+                raise HTTPException(
+                    status_code=409,
+                    detail="Dengan beberapa worker, timpa file MODEL_PATH lalu panggil endpoint ini tanpa path"
+                )
+            os.kill(int(runner_pid), signal.SIGUSR2)
+            return {"status": "loading", "workers": "rolling restart", "source": registry.default_source}
+
+        if not registry.swap_in_background(path):
+            raise HTTPException(status_code=409, detail="Model lain sedang dimuat")
+        return {"status": "loading", "source": path or registry.default_source}
+
+    return router
@@ -0,0 +1,71 @@
+"""
+Static JSON responses that clients can cache
+
+Class metadata (names, translations, treatment suggestions) only changes with
+a deploy, so it is serialized once and served with a content-hash ETag and a
+long Cache-Control lifetime. Clients fetch it once, then revalidate with
+If-None-Match and get an empty 304 while it is unchanged, and predictions
+can refer to classes by id in the compact response mode.
+
+Configuration through environment variables:
+
+    CLASSES_CACHE_MAX_AGE    seconds clients may reuse /classes without revalidating, default 86400
+"""
+
+import os
+import json
+import hashlib
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+CLASSES_CACHE_MAX_AGE = int(os.environ.get("CLASSES_CACHE_MAX_AGE", 86400))
+
+# Fields of a prediction kept by the compact response mode
+COMPACT_FIELDS = ("class_id", "confidence", "model_version")
+
+def compact_result(result: dict) -> dict:
+    """Prediction reduced to COMPACT_FIELDS, for clients that read the rest from /classes"""
+    return {field: result[field] for field in COMPACT_FIELDS if field in result}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Check an If-None-Match header against an ETag, using the weak comparison of RFC 9110.
+
+    Args:
+        if_none_match: Header value, a list of entity tags or "*"
+        etag: Quoted entity tag of the current representation
+
+    Returns:
+        True if the client's copy is current
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+class StaticJSON:
+    """JSON body serialized once and served with an ETag and long-lived cache headers"""
+
+    def __init__(self, content: Any, max_age: int = CLASSES_CACHE_MAX_AGE):
+        """
+        Args:
+            content: JSON-serializable content, fixed for the life of the process
+            max_age: Seconds clients may reuse the response without revalidating
+        """
+        self.body = json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:16]}"'
+        self.headers = {"ETag": self.etag, "Cache-Control": f"public, max-age={max_age}"}
+
+    def response(self, request: Request) -> Response:
+        """The body, or an empty 304 if the request's If-None-Match already has it"""
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers=self.headers)
+        return Response(self.body, media_type="application/json", headers=self.headers)
@@ -0,0 +1,587 @@
+"""
+Production server runner: preload once, fork workers that share the model
+
+The parent process imports the application and runs its preload hook, then
+forks the workers. Everything loaded before the fork (Python modules, the
+TensorFlow and NumPy libraries, a TFLite model and its weights) is shared
+copy-on-write between the workers instead of being loaded N times.
+
+Only fork-safe state may be created before the fork. A TFLite interpreter
+and NumPy weights (common/numpy_engine.py) are; TensorFlow's runtime is not
+(a Keras model loaded in the parent hangs in the workers), so the preload
+hooks load the model only for those backends and Keras workers load their
+own copy on startup. Threads do not survive a fork either, so micro-batchers
+and worker pools are started by each worker on startup.
+
+Workers run uvicorn without the reloader, on uvloop and httptools when they
+are installed. The parent restarts workers that exit and handles signals:
+
+    SIGTERM, SIGINT   graceful shutdown of all workers
+    SIGHUP            rolling restart, one worker at a time: each old worker
+                      is stopped only once its replacement has finished startup
+    SIGUSR1           log the memory report
+    SIGUSR2           model hot-swap: the preload hook runs again, then a rolling
+                      restart forks workers that share the new model
+                      (see common/registry.py)
+
+Each worker sizes its TensorFlow, OpenCV and BLAS thread pools to its share
+of the cores and, with CPU_AFFINITY, is pinned to them (see common/threads.py).
+
+Usage, from the service directory:
+
+    python -m common.runner app:app --preload app:preload_model --port 5000
+
+Configuration through environment variables:
+
+    WEB_CONCURRENCY            number of workers, defaults to the CPU count
+    WORKER_MAX_REQUESTS        restart a worker after this many requests, 0 (default) never
+    WORKER_GRACEFUL_TIMEOUT    seconds a stopping worker may finish requests, default 30
+    WORKER_STARTUP_TIMEOUT     seconds a replacement worker may take to start during a rolling restart, default 120
+    MEMORY_REPORT_DELAY        seconds after startup to log the memory report, default 30, 0 disables
+"""
+
+import os
+import sys
+import time
+import errno
+import shutil
+import select
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import importlib.util
+import tempfile
+from functools import reduce
+from typing import Any, Callable, Dict, List, Optional
+
+from common.threads import configure_blas, pin_worker
+
+logger = logging.getLogger(__name__)
+
+# Backends whose loaded models can be shared with forked workers
+FORK_SAFE_BACKENDS = ("tflite", "numpy")
+
+# Memory fields read from /proc/<pid>/smaps_rollup, in kB
+MEMORY_FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+def import_from_string(path: str) -> Any:
+    """
+    Import an object from a "module:attribute" string.
+
+    Args:
+        path: Module path and attribute, which may be dotted ("api.app:ModelService.load_model")
+
+    Returns:
+        The imported object
+    """
+    module_name, _, attribute = path.partition(":")
+    if not attribute:
+        raise ValueError(f"Expected 'module:attribute', got '{path}'")
+    module = importlib.import_module(module_name)
+    return reduce(getattr, attribute.split("."), module)
+
+def read_memory(pid: int) -> Optional[Dict[str, int]]:
+    """
+    Read a process's memory usage from /proc.
+
+    Args:
+        pid: Process id
+
+    Returns:
+        MEMORY_FIELDS in kB, or None if the process is gone or /proc is unavailable
+    """
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+
+    usage = {}
+    for line in lines:
+        name, _, value = line.partition(":")
+        if name in MEMORY_FIELDS:
+            usage[name] = int(value.split()[0])
+    return usage
+
+def memory_report(parent_pid: int, worker_pids: List[int]) -> Optional[Dict[str, Any]]:
+    """
+    Compare the workers' resident memory with what they actually add.
+
+    RSS counts shared pages in full in every process, PSS divides them between
+    the processes sharing them. The difference is the memory the workers
+    would use on top if each loaded everything itself.
+
+    Args:
+        parent_pid: Pid of the preloading parent
+        worker_pids: Pids of the forked workers
+
+    Returns:
+        Report with per-worker and total figures in MB, or None without /proc
+    """
+    parent = read_memory(parent_pid)
+    workers = {pid: usage for pid in worker_pids if (usage := read_memory(pid)) is not None}
+    if parent is None or not workers:
+        return None
+
+    def mb(kb: float) -> float:
+        return round(kb / 1024.0, 1)
+
+    total_rss = parent["Rss"] + sum(usage["Rss"] for usage in workers.values())
+    total_pss = parent["Pss"] + sum(usage["Pss"] for usage in workers.values())
+    return {
+        "parent": {"pid": parent_pid, "rss_mb": mb(parent["Rss"]), "pss_mb": mb(parent["Pss"])},
+        "workers": [
+            {
+                "pid": pid,
+                "rss_mb": mb(usage["Rss"]),
+                "pss_mb": mb(usage["Pss"]),
+                "shared_mb": mb(usage["Shared_Clean"] + usage["Shared_Dirty"]),
+                "private_mb": mb(usage["Private_Clean"] + usage["Private_Dirty"])
+            }
+            for pid, usage in workers.items()
+        ],
+        "total_rss_mb": mb(total_rss),
+        "total_pss_mb": mb(total_pss),
+        "saved_mb": mb(total_rss - total_pss),
+        "saved_per_worker_mb": mb((total_rss - total_pss) / len(workers))
+    }
+
+def log_memory_report(parent_pid: int, worker_pids: List[int]) -> None:
+    """Log memory_report as one summary line and one line per worker"""
+    report = memory_report(parent_pid, worker_pids)
+    if report is None:
+        logger.info("Memory report unavailable (no /proc/<pid>/smaps_rollup)")
+        return
+
+    logger.info(
+        f"Memory: {len(report['workers'])} workers, RSS {report['total_rss_mb']}MB, "
+        f"PSS {report['total_pss_mb']}MB, sharing saves {report['saved_mb']}MB "
+        f"({report['saved_per_worker_mb']}MB per worker)"
+    )
+    for worker in report["workers"]:
+        logger.info(
+            f"Worker {worker['pid']}: RSS {worker['rss_mb']}MB, PSS {worker['pss_mb']}MB, "
+            f"shared {worker['shared_mb']}MB, private {worker['private_mb']}MB"
+        )
+
+def notify_started(server: Any, ready_fd: int) -> None:
+    """
+    Make a uvicorn server write to ready_fd once lifespan startup is complete and it is listening.
+
+    Args:
+        server: uvicorn.Server about to run
+        ready_fd: Write end of the pipe the parent waits on
+    """
+    startup = server.startup
+
+    async def startup_and_notify(sockets: Optional[List[socket.socket]] = None) -> None:
+        await startup(sockets=sockets)
+        try:
+            if server.started:
+                os.write(ready_fd, b"1")
+        except BrokenPipeError:
+            # The parent gave up waiting and is stopping this worker
+            pass
+        os.close(ready_fd)
+
+    server.startup = startup_and_notify
+
+def server_config(app: Any, **options: Any) -> Any:
+    """
+    Build the uvicorn config for a worker.
+
+    Args:
+        app: ASGI application
+        **options: Extra uvicorn.Config options
+
+    Returns:
+        uvicorn.Config using uvloop and httptools when they are installed
+    """
+    import uvicorn
+
+    return uvicorn.Config(
+        app,
+        loop="uvloop" if importlib.util.find_spec("uvloop") else "asyncio",
+        http="httptools" if importlib.util.find_spec("httptools") else "h11",
+        lifespan="on",
+        **options
+    )
+
+class Arbiter:
+    """Forks the workers and keeps them running"""
+
+    def __init__(
+        self,
+        app: Any,
+        sock: socket.socket,
+        workers: int,
+        max_requests: int = 0,
+        graceful_timeout: float = 30.0,
+        memory_report_delay: float = 30.0,
+        preload: Optional[Callable[[], None]] = None,
+        startup_timeout: float = 120.0
+    ):
+        """
+        Args:
+            app: Preloaded ASGI application
+            sock: Bound listening socket shared by the workers
+            workers: Number of workers
+            max_requests: Requests after which a worker restarts, 0 for never
+            graceful_timeout: Seconds a stopping worker may take before it is killed
+            memory_report_delay: Seconds after startup to log the memory report, 0 to skip
+            preload: Preload hook, run again before the rolling restart on SIGUSR2
+            startup_timeout: Seconds a replacement worker may take to finish startup
+        """
+        self.app = app
+        self.preload = preload
+        self.sock = sock
+        self.num_workers = workers
+        self.max_requests = max_requests
+        self.graceful_timeout = graceful_timeout
+        self.memory_report_delay = memory_report_delay
+        self.startup_timeout = startup_timeout
+
+        self.workers: Dict[int, float] = {}
+        # Worker pid to its slot, which picks its cores under CPU_AFFINITY
+        self.slots: Dict[int, int] = {}
+        self._stopping: Dict[int, float] = {}
+        # Read ends of the pipes replacement workers write to once started
+        self._ready: Dict[int, int] = {}
+        self._signals: List[int] = []
+        self._wakeup_read, self._wakeup_write = os.pipe()
+
+    def spawn_worker(self, slot: Optional[int] = None, notify: bool = False) -> int:
+        """
+        Fork one worker; returns its pid in the parent, never returns in the worker.
+
+        Args:
+            slot: Slot of the worker being replaced, defaults to the lowest free one
+            notify: Whether the worker reports the end of its startup, see wait_started
+        """
+        if slot is None:
+            used = {self.slots[pid] for pid in self.workers if pid in self.slots}
+            slot = min(set(range(len(self.workers) + 1)) - used)
+        ready_read, ready_write = os.pipe() if notify else (None, None)
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            self.slots[pid] = slot
+            if notify:
+                os.close(ready_write)
+                self._ready[pid] = ready_read
+            logger.info(f"Started worker {pid}")
+            return pid
+
+        exit_code = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1, signal.SIGCHLD):
+                signal.signal(sig, signal.SIG_DFL)
+            # Model swaps are done by the parent (swap_model), a stray SIGUSR2 must not kill the worker
+            signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+            os.close(self._wakeup_read)
+            os.close(self._wakeup_write)
+            for fd in list(self._ready.values()) + ([ready_read] if notify else []):
+                os.close(fd)
+            cpus = pin_worker(slot, self.num_workers)
+            if cpus is not None:
+                logger.info(f"Worker {os.getpid()} pinned to cores {cpus}")
+
+            options = {"timeout_graceful_shutdown": self.graceful_timeout}
+            if self.max_requests:
+                options["limit_max_requests"] = self.max_requests
+            import uvicorn
+            server = uvicorn.Server(server_config(self.app, **options))
+            if notify:
+                notify_started(server, ready_write)
+            server.run(sockets=[self.sock])
+            if not server.started:
+                # Startup failed, e.g. the model could not be loaded
+                exit_code = 3
+        except BaseException:
+            logger.exception(f"Worker {os.getpid()} failed")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def stop_worker(self, pid: int, sig: int = signal.SIGTERM) -> None:
+        """Ask a worker to finish its requests and exit"""
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            return
+        self._stopping.setdefault(pid, time.monotonic())
+
+    def reap_workers(self) -> List[float]:
+        """Collect exited workers; returns the lifetimes of those that exited unexpectedly"""
+        crashed = []
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            started = self.workers.pop(pid, None)
+            self.slots.pop(pid, None)
+            ready_fd = self._ready.pop(pid, None)
+            if ready_fd is not None:
+                os.close(ready_fd)
+            expected = self._stopping.pop(pid, None) is not None
+            if started is not None and not expected:
+                code = os.waitstatus_to_exitcode(status)
+                lifetime = time.monotonic() - started
+                if code == 0:
+                    logger.info(f"Worker {pid} exited, replacing it")
+                else:
+                    logger.warning(f"Worker {pid} exited with code {code} after {lifetime:.1f}s")
+                    crashed.append(lifetime)
+        return crashed
+
+    def kill_stuck_workers(self) -> None:
+        """Kill stopping workers that exceeded the graceful timeout"""
+        now = time.monotonic()
+        for pid, since in list(self._stopping.items()):
+            if now - since > self.graceful_timeout + 5:
+                logger.warning(f"Worker {pid} did not stop in time, killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def wait_started(self, pid: int) -> bool:
+        """
+        Wait until a worker spawned with notify has finished startup.
+
+        Args:
+            pid: Worker pid
+
+        Returns:
+            True once it reports startup complete; False if it exits, does not start
+            within startup_timeout, or a shutdown signal arrives first
+        """
+        ready_fd = self._ready.get(pid)
+        deadline = time.monotonic() + self.startup_timeout
+        while ready_fd is not None and time.monotonic() < deadline:
+            if any(sig in (signal.SIGTERM, signal.SIGINT) for sig in self._signals):
+                return False
+            ready, _, _ = select.select([ready_fd, self._wakeup_read], [], [], 0.5)
+            if self._wakeup_read in ready:
+                self.wait(0)
+            if ready_fd in ready:
+                # One byte after startup; end of file without it means the worker exited
+                started = os.read(ready_fd, 1) == b"1"
+                os.close(self._ready.pop(pid))
+                return started
+            self.reap_workers()
+            if pid not in self.workers:
+                return False
+        return False
+
+    def reload(self) -> None:
+        """
+        Replace the workers one at a time.
+
+        Each replacement is forked first and the old worker is only stopped once
+        the replacement has finished startup (including loading its model), so
+        the other workers keep serving throughout. If a replacement fails to
+        start, it is stopped and the remaining old workers are kept.
+        """
+        logger.info("Rolling restart of the workers")
+        for pid in list(self.workers):
+            if pid not in self.workers:
+                continue
+            slot = self.slots.pop(pid, None)
+            replacement = self.spawn_worker(slot, notify=True)
+            if not self.wait_started(replacement):
+                logger.error(f"Worker {replacement} did not start, keeping the remaining workers")
+                ready_fd = self._ready.pop(replacement, None)
+                if ready_fd is not None:
+                    os.close(ready_fd)
+                if replacement in self.workers:
+                    self.stop_worker(replacement)
+                    self.workers.pop(replacement, None)
+                    self.slots.pop(replacement, None)
+                if slot is not None:
+                    self.slots[pid] = slot
+                return
+            self.stop_worker(pid)
+            self.workers.pop(pid, None)
+            logger.info(f"Worker {replacement} replaced worker {pid}")
+
+    def swap_model(self) -> None:
+        """
+        Load the new model in the parent, then replace the workers one at a time.
+
+        Workers do not load the model themselves: converting a changed model
+        needs TensorFlow, which hangs in a forked worker. Workers forked after
+        the load share the new model like the original one, and a worker
+        being replaced finishes its requests with the old model.
+        """
+        if self.preload is not None:
+            logger.info("Loading the new model before swapping the workers")
+            try:
+                self.preload()
+            except Exception:
+                logger.exception("Loading the new model failed, the workers keep the current one")
+                return
+        self.reload()
+
+    def handle_signal(self, sig: int, frame: Any) -> None:
+        self._signals.append(sig)
+
+    def wait(self, timeout: float) -> None:
+        """Sleep until a signal arrives or the timeout passes"""
+        try:
+            ready, _, _ = select.select([self._wakeup_read], [], [], timeout)
+            if ready:
+                while os.read(self._wakeup_read, 64) == 64:
+                    pass
+        except OSError as e:
+            if e.errno not in (errno.EINTR, errno.EAGAIN):
+                raise
+
+    def run(self) -> None:
+        """Start the workers and supervise them until a shutdown signal"""
+        os.set_blocking(self._wakeup_read, False)
+        os.set_blocking(self._wakeup_write, False)
+        signal.set_wakeup_fd(self._wakeup_write)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGUSR1, signal.SIGUSR2, signal.SIGCHLD):
+            signal.signal(sig, self.handle_signal)
+
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+
+        report_at = time.monotonic() + self.memory_report_delay if self.memory_report_delay > 0 else None
+        backoff = 0.0
+        while True:
+            while self._signals:
+                sig = self._signals.pop(0)
+                if sig in (signal.SIGTERM, signal.SIGINT):
+                    self.shutdown()
+                    return
+                if sig == signal.SIGHUP:
+                    self.reload()
+                elif sig == signal.SIGUSR1:
+                    log_memory_report(os.getpid(), list(self.workers))
+                elif sig == signal.SIGUSR2:
+                    self.swap_model()
+
+            crashed = self.reap_workers()
+            self.kill_stuck_workers()
+            if crashed:
+                # Back off while workers keep failing right after start, e.g. the model cannot load
+                backoff = min(max(backoff * 2, 1.0), 30.0) if min(crashed) < 10 else 1.0
+                logger.warning(f"Restarting workers in {backoff:.0f}s")
+                self.wait(backoff)
+                continue
+            while len(self.workers) < self.num_workers:
+                self.spawn_worker()
+
+            if report_at is not None and time.monotonic() >= report_at:
+                log_memory_report(os.getpid(), list(self.workers))
+                report_at = None
+            self.wait(1.0)
+
+    def shutdown(self) -> None:
+        """Stop all workers gracefully, killing those that exceed the timeout"""
+        logger.info(f"Shutting down {len(self.workers)} workers")
+        for pid in list(self.workers):
+            self.stop_worker(pid)
+        self.workers.clear()
+
+        while self._stopping:
+            self.reap_workers()
+            self.kill_stuck_workers()
+            self.wait(0.2)
+        logger.info("All workers stopped")
+
+def serve(
+    app_path: str,
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    workers: Optional[int] = None,
+    preload: Optional[str] = None
+) -> None:
+    """
+    Preload the application and serve it with forked workers.
+
+    Args:
+        app_path: ASGI application as "module:attribute"
+        host: Address to bind
+        port: Port to bind
+        workers: Number of workers, defaults to WEB_CONCURRENCY or the CPU count
+        preload: Optional "module:callable" run in the parent before forking
+    """
+    if workers is None:
+        workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # Workers size their thread pools from it, see common/threads.py
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+
+    # Lets /metrics on any worker report all of them, see common/metrics.py
+    metrics_dir = os.environ.get("METRICS_MULTIPROC_DIR")
+    owns_metrics_dir = not metrics_dir
+    if owns_metrics_dir:
+        metrics_dir = os.environ["METRICS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="growmate-metrics-")
+    else:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.endswith(".json"):
+                os.remove(os.path.join(metrics_dir, name))
+
+    # Lets the admin endpoint of any worker ask for a model swap in all of them
+    os.environ["RUNNER_PID"] = str(os.getpid())
+
+    # Before the application imports NumPy
+    configure_blas()
+
+    started = time.perf_counter()
+    app = import_from_string(app_path)
+    preload_hook = import_from_string(preload) if preload else None
+    if preload_hook is not None:
+        preload_hook()
+    logger.info(f"Preloaded {app_path} in {time.perf_counter() - started:.2f}s")
+
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    logger.info(f"Listening on {host}:{port} with {workers} workers")
+
+    arbiter = Arbiter(
+        app,
+        sock,
+        workers=workers,
+        max_requests=int(os.environ.get("WORKER_MAX_REQUESTS", 0)),
+        graceful_timeout=float(os.environ.get("WORKER_GRACEFUL_TIMEOUT", 30)),
+        memory_report_delay=float(os.environ.get("MEMORY_REPORT_DELAY", 30)),
+        preload=preload_hook,
+        startup_timeout=float(os.environ.get("WORKER_STARTUP_TIMEOUT", 120))
+    )
+    try:
+        arbiter.run()
+    finally:
+        sock.close()
+        if owns_metrics_dir:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("app", help="ASGI application, e.g. app:app")
+    parser.add_argument("--preload", help="Callable run before forking, e.g. app:preload_model")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)))
+    parser.add_argument("--workers", type=int, help="Defaults to WEB_CONCURRENCY or the CPU count")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    serve(args.app, host=args.host, port=args.port, workers=args.workers, preload=args.preload)
+
+if __name__ == "__main__":
+    main()
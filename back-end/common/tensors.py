@@ -0,0 +1,152 @@
+"""
+Raw uint8 image tensors for clients that already have decoded frames
+
+Clients such as greenhouse edge gateways hold decoded RGB frames at the model
+input size. Sending them as raw pixels skips JPEG encoding on the client and
+PIL/OpenCV decoding on the server. Two body formats are accepted:
+
+    application/x-npy         a .npy file (numpy.save) of uint8 pixels with
+                              shape (H, W, 3) or (N, H, W, 3), in C order
+    application/octet-stream  a 16-byte header, the magic b"RGB8" followed by
+                              N, H and W as little-endian uint32, then
+                              N * H * W * 3 RGB bytes in row-major order
+
+H and W must match the model input size. The pixels are viewed in place in
+the request body with ``np.frombuffer``, so the body is the only copy. The
+raw format can be written without NumPy:
+
+    header = struct.pack("<4sIII", b"RGB8", len(frames), 224, 224)
+    body = header + b"".join(frame.tobytes() for frame in frames)
+"""
+
+import io
+import struct
+from typing import Tuple
+
+import numpy as np
+from fastapi import Request
+
+from .uploads import UploadTooLarge
+
+NPY_CONTENT_TYPES = {"application/x-npy", "application/npy"}
+RAW_CONTENT_TYPE = "application/octet-stream"
+TENSOR_CONTENT_TYPES = NPY_CONTENT_TYPES | {RAW_CONTENT_TYPE}
+
+RAW_MAGIC = b"RGB8"
+RAW_HEADER = struct.Struct("<4sIII")
+# Largest .npy preamble: magic, version, header length and a padded header
+NPY_MAX_PREAMBLE = 64 * 1024
+
+class InvalidTensor(ValueError):
+    """The body is not a uint8 image tensor of the expected shape"""
+
+def tensor_body_limit(max_batch: int, input_size: Tuple[int, int]) -> int:
+    """Largest valid body for a batch of max_batch images at input_size, in bytes"""
+    height, width = input_size
+    return max_batch * height * width * 3 + NPY_MAX_PREAMBLE
+
+async def read_body(request: Request, max_bytes: int) -> bytearray:
+    """
+    Read a request body, refusing it as soon as it passes max_bytes.
+
+    Args:
+        request: Incoming request
+        max_bytes: Largest accepted body size
+
+    Returns:
+        Body bytes
+
+    Raises:
+        UploadTooLarge: If the body is larger than max_bytes
+    """
+    content_length = request.headers.get("content-length", "")
+    if content_length.isdigit() and int(content_length) > max_bytes:
+        raise UploadTooLarge(int(content_length), max_bytes)
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_bytes:
+            raise UploadTooLarge(len(body), max_bytes)
+    return body
+
+def parse_tensor(
+    body: bytearray,
+    content_type: str,
+    input_size: Tuple[int, int],
+    max_batch: int
+) -> Tuple[np.ndarray, bool]:
+    """
+    View a request body as a batch of uint8 RGB images.
+
+    Args:
+        body: Request body in one of TENSOR_CONTENT_TYPES
+        content_type: Media type of the body, without parameters
+        input_size: (height, width) expected by the model
+        max_batch: Largest accepted number of images
+
+    Returns:
+        Tuple of (uint8 array of shape (N, H, W, 3) sharing memory with body,
+        whether the client sent a batch rather than a single image)
+
+    Raises:
+        InvalidTensor: If the body is malformed or has the wrong dtype or shape
+    """
+    if content_type in NPY_CONTENT_TYPES:
+        shape, offset = read_npy_header(body)
+    else:
+        if len(body) < RAW_HEADER.size:
+            raise InvalidTensor(f"Header tensor harus {RAW_HEADER.size} byte")
+        magic, count, height, width = RAW_HEADER.unpack_from(body)
+        if magic != RAW_MAGIC:
+            raise InvalidTensor(f"Header tensor harus diawali {RAW_MAGIC.decode()}")
+        shape, offset = (count, height, width, 3), RAW_HEADER.size
+
+    height, width = input_size
+    batched = len(shape) == 4
+    if len(shape) not in (3, 4) or tuple(shape[-3:]) != (height, width, 3):
+        raise InvalidTensor(
+            f"Tensor harus berbentuk ({height}, {width}, 3) atau (N, {height}, {width}, 3), diterima {tuple(shape)}"
+        )
+    count = shape[0] if batched else 1
+    if not 1 <= count <= max_batch:
+        raise InvalidTensor(f"Jumlah gambar dalam tensor harus 1 sampai {max_batch}, diterima {count}")
+
+    size = count * height * width * 3
+    if len(body) - offset != size:
+        raise InvalidTensor(f"Tensor {tuple(shape)} membutuhkan {size} byte data, diterima {len(body) - offset}")
+    pixels = np.frombuffer(body, dtype=np.uint8, count=size, offset=offset)
+    return pixels.reshape(count, height, width, 3), batched
+
+def read_npy_header(body: bytearray) -> Tuple[Tuple[int, ...], int]:
+    """
+    Parse the preamble of a .npy body without reading the array.
+
+    Args:
+        body: .npy file contents
+
+    Returns:
+        Tuple of (array shape, offset of the array data)
+
+    Raises:
+        InvalidTensor: If the preamble is malformed or the array is not C-ordered uint8
+    """
+    preamble = io.BytesIO(bytes(body[:NPY_MAX_PREAMBLE]))
+    try:
+        version = np.lib.format.read_magic(preamble)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(preamble)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(preamble)
+        else:
+            raise InvalidTensor(f"Versi format .npy {version} tidak didukung")
+    except InvalidTensor:
+        raise
+    except ValueError as e:
+        raise InvalidTensor(f"File .npy tidak valid: {str(e)}")
+
+    if dtype != np.uint8:
+        raise InvalidTensor(f"Tensor harus bertipe uint8, diterima {dtype}")
+    if fortran_order and len(shape) > 1:
+        raise InvalidTensor("Tensor harus berurutan C (row-major)")
+    return shape, preamble.tell()
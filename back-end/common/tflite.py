@@ -0,0 +1,285 @@
+"""
+Quantized TFLite backend for the image classification models
+
+The Keras model is converted once to a TFLite flatbuffer and cached next to
+the original file as ``<model>[.<variant>].<quantization>.tflite``, where the
+variant tags a model wrapped with in-graph preprocessing. The cached file is
+rebuilt when the Keras model is newer. Requests then run through the TFLite
+interpreter, which uses less memory and less CPU per image than the full
+float32 Keras graph.
+
+Configuration through environment variables:
+
+    MODEL_BACKEND                "keras" (default) or "tflite"
+    TFLITE_QUANTIZATION          "dynamic" (default), "float16", "int8" or "none"
+    TFLITE_THREADS               interpreter threads, defaults to TF_INTRA_OP_THREADS (see common/threads.py)
+    TFLITE_CALIBRATION_DIR       images used to calibrate int8 quantization
+    TFLITE_CALIBRATION_SAMPLES   maximum calibration images, default 200
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Iterable, Optional, Tuple
+
+import numpy as np
+
+from common.threads import intra_op_threads
+
+logger = logging.getLogger(__name__)
+
+MODEL_BACKENDS = ("keras", "tflite")
+TFLITE_QUANTIZATIONS = ("none", "dynamic", "float16", "int8")
+CALIBRATION_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+def tflite_path_for(model_path: str, quantization: str, variant: Optional[str] = None) -> str:
+    """
+    Path of the cached TFLite artifact for a Keras model file.
+
+    Args:
+        model_path: Path to the Keras model file
+        quantization: Quantization mode
+        variant: Tag for a wrapped model, e.g. "uint8-rescale" for in-graph preprocessing
+
+    Returns:
+        Path next to the Keras model file
+    """
+    base = os.path.splitext(model_path)[0]
+    if variant:
+        base = f"{base}.{variant}"
+    return f"{base}.{quantization}.tflite"
+
+def load_calibration_images(
+    directory: str,
+    target_size: Tuple[int, int],
+    scale: float = 1.0 / 255.0,
+    limit: int = 200
+) -> np.ndarray:
+    """
+    Load and preprocess images used to calibrate int8 quantization.
+
+    Args:
+        directory: Directory containing JPG or PNG images
+        target_size: Model input size (height, width)
+        scale: Factor applied to uint8 pixel values
+        limit: Maximum number of images to load
+
+    Returns:
+        float32 array of shape (N, height, width, 3)
+
+    Raises:
+        ValueError: If the directory contains no usable images
+    """
+    from PIL import Image
+
+    names = sorted(
+        name for name in os.listdir(directory)
+        if name.lower().endswith(CALIBRATION_EXTENSIONS)
+    )[:limit]
+
+    samples = []
+    for name in names:
+        try:
+            with Image.open(os.path.join(directory, name)) as img:
+                img = img.convert("RGB").resize((target_size[1], target_size[0]))
+                samples.append(np.asarray(img, dtype=np.float32) * scale)
+        except Exception as e:
+            logger.warning(f"Skipping calibration image {name}: {str(e)}")
+
+    if not samples:
+        raise ValueError(f"No calibration images found in {directory}")
+    return np.stack(samples)
+
+def convert_to_tflite(
+    model: Any,
+    quantization: str = "dynamic",
+    calibration_data: Optional[np.ndarray] = None
+) -> bytes:
+    """
+    Convert a Keras model to a TFLite flatbuffer.
+
+    Args:
+        model: Loaded Keras model with a single input
+        quantization: "none", "dynamic", "float16" or "int8"
+        calibration_data: Preprocessed samples for int8 calibration
+
+    Returns:
+        Serialized TFLite model
+
+    Raises:
+        ValueError: If the quantization mode is unsupported or int8 has no calibration data
+    """
+    import tensorflow as tf
+
+    if quantization not in TFLITE_QUANTIZATIONS:
+        raise ValueError(f"TFLITE_QUANTIZATION must be one of {TFLITE_QUANTIZATIONS}, got '{quantization}'")
+    if quantization == "int8" and calibration_data is None:
+        raise ValueError("int8 quantization needs calibration data, set TFLITE_CALIBRATION_DIR")
+
+    input_dtype = tf.as_dtype(model.inputs[0].dtype).as_numpy_dtype
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if quantization != "none":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization == "int8":
+        def representative_dataset():
+            for sample in calibration_data:
+                yield [np.expand_dims(sample, axis=0).astype(input_dtype)]
+
+        # Input and output stay float32 so callers do not change
+        converter.representative_dataset = representative_dataset
+
+    return converter.convert()
+
+def get_interpreter_class() -> Any:
+    """
+    Find a TFLite interpreter, preferring the standalone runtimes that do not import TensorFlow.
+
+    Returns:
+        Interpreter class
+    """
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        pass
+    import tensorflow as tf
+    return tf.lite.Interpreter
+
+class TFLitePredictor:
+    """Runs inference through the TFLite interpreter"""
+
+    mode = "tflite"
+
+    def __init__(self, model_path: str, num_threads: Optional[int] = None):
+        """
+        Load a TFLite model.
+
+        Args:
+            model_path: Path to the .tflite file
+            num_threads: Interpreter threads, None for the TFLite default
+        """
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self._interpreter = get_interpreter_class()(model_path=model_path, num_threads=num_threads)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self._batch_size = int(self._input["shape"][0])
+        self._lock = threading.Lock()
+
+        signature = self._input.get("shape_signature", self._input["shape"])
+        self.input_shape: Tuple[Optional[int], ...] = (None,) + tuple(int(dim) for dim in signature[1:])
+        self.dtype = np.dtype(self._input["dtype"])
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        """
+        Run the interpreter on a batch.
+
+        The interpreter is not thread-safe, so calls are serialized. The input
+        tensor is resized only when the batch size changes.
+
+        Args:
+            batch: Input array with a leading batch axis
+
+        Returns:
+            Model outputs as a NumPy array
+        """
+        batch = np.ascontiguousarray(batch, dtype=self.dtype)
+        with self._lock:
+            if batch.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input["index"], batch.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = batch.shape[0]
+            self._interpreter.set_tensor(self._input["index"], batch)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+    def warmup(self, batch_sizes: Iterable[int] = (1,)) -> float:
+        """
+        Run dummy batches so tensors are allocated before the first request.
+
+        Args:
+            batch_sizes: Batch sizes to run
+
+        Returns:
+            Warmup duration in seconds
+        """
+        started = time.perf_counter()
+        for size in sorted(set(batch_sizes)):
+            self(np.zeros((size,) + self.input_shape[1:], dtype=self.dtype))
+        elapsed = time.perf_counter() - started
+        logger.info(f"Warmed up tflite predictor in {elapsed * 1000:.1f}ms")
+        return elapsed
+
+def load_tflite_predictor(
+    model_path: str,
+    load_keras_model: Callable[[], Any],
+    quantization: Optional[str] = None,
+    num_threads: Optional[int] = None,
+    calibration_scale: float = 1.0 / 255.0,
+    variant: Optional[str] = None
+) -> TFLitePredictor:
+    """
+    Load the cached TFLite artifact for a Keras model, converting it first if needed.
+
+    The Keras model is only loaded when the cached artifact is missing or older
+    than the Keras file, and is released again after conversion.
+
+    Args:
+        model_path: Path to the Keras model file
+        load_keras_model: Callable that loads the Keras model
+        quantization: Quantization mode, defaults to TFLITE_QUANTIZATION
+        num_threads: Interpreter threads, defaults to TFLITE_THREADS or the TensorFlow intra-op count
+        calibration_scale: Pixel scale used for int8 calibration images
+        variant: Tag of the model returned by load_keras_model, see tflite_path_for
+
+    Returns:
+        Ready TFLitePredictor
+    """
+    quantization = (quantization or os.environ.get("TFLITE_QUANTIZATION", "dynamic")).lower()
+    if num_threads is None:
+        num_threads = int(os.environ["TFLITE_THREADS"]) if os.environ.get("TFLITE_THREADS") else intra_op_threads()
+
+    tflite_path = tflite_path_for(model_path, quantization, variant)
+    is_stale = (
+        not os.path.exists(tflite_path)
+        or (os.path.exists(model_path) and os.path.getmtime(model_path) > os.path.getmtime(tflite_path))
+    )
+
+    if is_stale:
+        logger.info(f"Converting {model_path} to TFLite ({quantization})")
+        started = time.perf_counter()
+        keras_model = load_keras_model()
+
+        calibration_data = None
+        if quantization == "int8":
+            calibration_dir = os.environ.get("TFLITE_CALIBRATION_DIR")
+            if not calibration_dir:
+                raise ValueError("int8 quantization needs calibration data, set TFLITE_CALIBRATION_DIR")
+            calibration_data = load_calibration_images(
+                calibration_dir,
+                tuple(keras_model.input_shape[1:3]),
+                scale=calibration_scale,
+                limit=int(os.environ.get("TFLITE_CALIBRATION_SAMPLES", 200))
+            )
+
+        flatbuffer = convert_to_tflite(keras_model, quantization, calibration_data)
+        with open(tflite_path, "wb") as f:
+            f.write(flatbuffer)
+        logger.info(
+            f"Saved {tflite_path} ({len(flatbuffer) / (1024 * 1024):.1f}MB) "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        del keras_model
+
+    logger.info(f"Loading TFLite model from: {tflite_path}")
+    return TFLitePredictor(tflite_path, num_threads=num_threads)
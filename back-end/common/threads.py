@@ -0,0 +1,169 @@
+"""
+CPU thread pools and core affinity for model serving
+
+TensorFlow, OpenCV and the BLAS library each start a thread pool as large
+as the machine. With several runner workers per node every worker does, so
+N workers run N times as many busy threads as there are cores and spend
+their time switching between them. Each worker is therefore given its share
+of the cores (the cores available to the process divided by WEB_CONCURRENCY
+under common/runner.py, all of them in a single process) and every library
+is sized to it:
+
+    TensorFlow   intra-op threads = share, inter-op threads = min(2, share),
+                 set by configure_tensorflow() before the first model is
+                 loaded; TFLite interpreters use the intra-op count unless
+                 TFLITE_THREADS is set
+    OpenCV       cv2.setNumThreads(share), applied by import_cv2()
+    BLAS         OMP/OpenBLAS/MKL thread variables, set by the runner
+                 before NumPy is imported (set them yourself without it)
+
+With CPU_AFFINITY the runner also pins worker i to its own share of the
+cores, so workers do not migrate onto each other's caches.
+tools/autotune_threads.py measures which combination of workers, threads
+and batch size gives the most throughput within a latency target.
+
+Configuration through environment variables ("auto" follows the worker's
+share, 0 keeps the library default):
+
+    TF_INTRA_OP_THREADS    default auto
+    TF_INTER_OP_THREADS    default auto, min(2, share)
+    OPENCV_THREADS         default auto
+    BLAS_THREADS           default auto
+    CPU_AFFINITY           "true" to pin each runner worker to its cores, default false
+"""
+
+import os
+import sys
+import logging
+from typing import Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BLAS_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+_tensorflow_configured_pid: Optional[int] = None
+_cv2: Any = None
+_pinned_cpus: Optional[List[int]] = None
+
+def available_cpus() -> List[int]:
+    """Cores this process may run on, respecting container cpusets"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def worker_count() -> int:
+    """Workers sharing the machine: WEB_CONCURRENCY under common/runner.py, else 1"""
+    if os.environ.get("RUNNER_PID"):
+        return max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+    return 1
+
+def cores_per_worker() -> int:
+    """This worker's share of the cores"""
+    if _pinned_cpus is not None:
+        return len(_pinned_cpus)
+    return max(1, len(available_cpus()) // worker_count())
+
+def thread_setting(name: str, auto: int) -> Optional[int]:
+    """
+    Read a thread count from the environment.
+
+    Args:
+        name: Environment variable
+        auto: Count used for "auto", the default
+
+    Returns:
+        Thread count, or None to keep the library default
+
+    Raises:
+        ValueError: If the value is neither "auto" nor an integer
+    """
+    value = os.environ.get(name, "auto").strip().lower()
+    if value == "auto":
+        return auto
+    try:
+        count = int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be 'auto' or a number of threads, got '{value}'")
+    return count if count > 0 else None
+
+def intra_op_threads() -> Optional[int]:
+    return thread_setting("TF_INTRA_OP_THREADS", cores_per_worker())
+
+def inter_op_threads() -> Optional[int]:
+    return thread_setting("TF_INTER_OP_THREADS", min(2, cores_per_worker()))
+
+def configure_blas() -> None:
+    """
+    Size the BLAS thread pools through their environment variables.
+
+    Must run before NumPy is imported; variables already set are kept.
+    """
+    threads = thread_setting("BLAS_THREADS", cores_per_worker())
+    if threads is None:
+        return
+    if "numpy" in sys.modules:
+        logger.warning("NumPy is already imported, BLAS_THREADS only applies to processes started later")
+    for variable in BLAS_VARIABLES:
+        os.environ.setdefault(variable, str(threads))
+
+def configure_tensorflow() -> None:
+    """
+    Size TensorFlow's thread pools, once per process and before it runs its first op.
+
+    Call right before loading a Keras model. TensorFlow's pools cannot be
+    resized once it has started, so later calls (e.g. on a model swap) are no-ops.
+    """
+    global _tensorflow_configured_pid
+    if _tensorflow_configured_pid == os.getpid():
+        return
+    _tensorflow_configured_pid = os.getpid()
+
+    import tensorflow as tf
+    intra, inter = intra_op_threads(), inter_op_threads()
+    try:
+        if intra is not None:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter is not None:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        # Raised when the runtime started first, e.g. in a worker forked after a TFLite conversion
+        logger.warning(f"TensorFlow threads already fixed, keeping them: {str(e)}")
+        return
+    logger.info(f"TensorFlow threads: intra-op {intra or 'default'}, inter-op {inter or 'default'}")
+
+def import_cv2() -> Any:
+    """OpenCV, with its thread pool sized by OPENCV_THREADS on first import"""
+    global _cv2
+    if _cv2 is None:
+        import cv2
+        threads = thread_setting("OPENCV_THREADS", cores_per_worker())
+        if threads is not None:
+            cv2.setNumThreads(threads)
+        _cv2 = cv2
+    return _cv2
+
+def pin_worker(index: int, workers: int) -> Optional[List[int]]:
+    """
+    Pin the calling process to worker index's share of the cores, if CPU_AFFINITY is set.
+
+    Args:
+        index: Worker slot, 0 to workers - 1
+        workers: Number of workers sharing the cores
+
+    Returns:
+        The cores the worker now runs on, or None if affinity is off or unsupported
+    """
+    global _pinned_cpus
+    if os.environ.get("CPU_AFFINITY", "false").lower() != "true" or not hasattr(os, "sched_setaffinity"):
+        return None
+
+    cpus = available_cpus()
+    if workers >= len(cpus):
+        pinned = [cpus[index % len(cpus)]]
+    else:
+        share = len(cpus) // workers
+        start = (index % workers) * share
+        pinned = cpus[start:start + share]
+    os.sched_setaffinity(0, pinned)
+    _pinned_cpus = pinned
+    return pinned
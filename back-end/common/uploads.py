@@ -0,0 +1,148 @@
+"""
+Bounded-memory reading of uploaded images
+
+Oversized uploads are refused before their bytes pile up in memory:
+
+1. ``UploadLimitMiddleware`` checks Content-Length when the endpoint starts
+   reading the body, before the multipart form is parsed, and keeps a
+   running count of the body chunks as they arrive, so uploads without a
+   length (chunked) are aborted as soon as they pass the limit.
+2. The form parser keeps at most 1MB of a file in memory and spools the
+   rest to disk.
+3. ``read_upload`` sniffs the magic bytes first, so a file that is not an
+   accepted image is refused without reading the rest, then reads the file
+   into one buffer of at most the limit plus one byte.
+
+Peak memory per upload request is therefore bounded by the service's file
+size limit, whatever the client sends, and a file is held only once.
+"""
+
+from typing import Any, Callable, Collection, Dict, Optional, Tuple, Union
+
+from fastapi import HTTPException, UploadFile
+
+# Room for the multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png")
+)
+SIGNATURE_BYTES = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+class UploadTooLarge(ValueError):
+    """The upload is larger than the allowed number of bytes"""
+
+    def __init__(self, size: int, max_bytes: int):
+        super().__init__(f"Upload exceeds {max_bytes} bytes")
+        self.size = size
+        self.max_bytes = max_bytes
+
+class UnsupportedUpload(ValueError):
+    """The upload's magic bytes do not match an accepted file type"""
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """
+    Detect the image type from the first bytes of a file.
+
+    Args:
+        head: At least the first 8 bytes of the file
+
+    Returns:
+        "image/jpeg" or "image/png", or None for anything else
+    """
+    for signature, media_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    return None
+
+async def read_upload(file: UploadFile, max_bytes: int, image_types: Optional[Collection[str]] = None) -> bytes:
+    """
+    Read an uploaded file, never holding more than max_bytes + 1 bytes of it.
+
+    Args:
+        file: Uploaded file
+        max_bytes: Largest accepted file size
+        image_types: Accepted media types, checked against the magic bytes
+            before the rest of the file is read; None accepts any content
+
+    Returns:
+        File contents
+
+    Raises:
+        UploadTooLarge: If the file is larger than max_bytes
+        UnsupportedUpload: If the content is not one of image_types
+    """
+    # The form parser already counted the bytes of a fully received file
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLarge(file.size, max_bytes)
+
+    if image_types is not None:
+        head = await file.read(SIGNATURE_BYTES)
+        if sniff_image_type(head) not in image_types:
+            raise UnsupportedUpload("Uploaded file is not an accepted image type")
+        await file.seek(0)
+
+    # One read into a single buffer, sized from the parsed size when known
+    # because reading from the disk spool allocates the requested size up
+    # front. Reading one byte past the limit tells an oversized file apart.
+    contents = await file.read((file.size if file.size is not None else max_bytes) + 1)
+    if len(contents) > max_bytes:
+        raise UploadTooLarge(len(contents), max_bytes)
+    return contents
+
+class UploadLimitMiddleware:
+    """ASGI middleware refusing request bodies larger than a per-path limit"""
+
+    def __init__(
+        self,
+        app: Any,
+        limits: Dict[str, Union[int, Tuple[int, str, int]]],
+        detail: str,
+        status_code: int = 413
+    ):
+        """
+        Args:
+            app: ASGI application
+            limits: Largest accepted file size in bytes per request path, or a
+                (size, detail, status code) tuple for a path answered with its
+                own error; the body may be MULTIPART_OVERHEAD larger
+            detail: Error detail returned to the client
+            status_code: Status code of the error response
+        """
+        self.app = app
+        self.limits: Dict[str, Tuple[int, str, int]] = {}
+        for path, limit in limits.items():
+            size, path_detail, path_status = limit if isinstance(limit, tuple) else (limit, detail, status_code)
+            self.limits[path] = (size + MULTIPART_OVERHEAD, path_detail, path_status)
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        path_limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if path_limit is None:
+            await self.app(scope, receive, send)
+            return
+        limit, detail, status_code = path_limit
+
+        content_length = None
+        for name, value in scope["headers"]:
+            if name == b"content-length":
+                content_length = int(value) if value.isdigit() else None
+                break
+
+        received = 0
+
+        # Raised from receive(), the error reaches the endpoint while it parses
+        # the form and FastAPI answers it like any HTTPException, inside CORS.
+        # Checking Content-Length on the first call means nothing was read yet.
+        async def limited_receive() -> Dict[str, Any]:
+            nonlocal received
+            if content_length is not None and content_length > limit:
+                raise HTTPException(status_code=status_code, detail=detail)
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=status_code, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
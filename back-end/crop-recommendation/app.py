@@ -1,8 +1,34 @@
-from fastapi import FastAPI, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Form, Query, Request
+from fastapi.responses import JSONResponse, Response
+from starlette.requests import ClientDisconnect
 import numpy as np
-from tensorflow.keras.models import load_model
 from fastapi.middleware.cors import CORSMiddleware
+import os
+import sys
+import time
+import contextlib
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.admission import OVERLOADED, AdmissionController, AdmissionMiddleware, Overloaded, RateLimiter
+from common.bulk import (
+    BULK_CONTENT_TYPES,
+    INVALID_VALUE,
+    BulkFormatError,
+    DuplexStreamingResponse,
+    csv_text,
+    ndjson_text,
+    read_rows
+)
+from common.cache import file_model_version
+from common.executor import get_executor, shutdown_executors
+from common.inference import build_predictor
+from common.metrics import CONTENT_TYPE, MetricsMiddleware, ServiceMetrics
+from common.numpy_engine import load_numpy_predictor
+from common.registry import ModelRegistry, ModelVersion, admin_router
+from common.responses import StaticJSON, compact_result
+from common.runner import FORK_SAFE_BACKENDS
+from common.threads import configure_tensorflow
 
 app = FastAPI()
 
@@ -14,14 +40,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Load model
-try:
-    model = load_model("saved_model/model_crop_recom.h5", compile=False)
-except Exception as e:
-    model = None
-    load_model_error = str(e)
-else:
-    load_model_error = None
+# Metrik request, latensi inferensi, dan antrian untuk /metrics
+metrics = ServiceMetrics("crop")
+metrics.track_queue("inference", lambda: get_executor("inference", kinds=("thread",)).pending())
+
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+# Batas request yang diproses bersamaan dan antriannya; saat penuh request langsung
+# dijawab 503 dengan Retry-After, lihat common/admission.py
+admission = AdmissionController.from_env()
+metrics.track_queue("admission", lambda: admission.waiting)
+app.add_middleware(
+    AdmissionMiddleware,
+    paths=("/predict/recom",),
+    controller=admission,
+    rate_limiter=RateLimiter.from_env(),
+    metrics=metrics
+)
+
+# /predict/recom/bulk menjalankan file berisi ribuan baris, jadi dibatasi terpisah:
+# request bulk di atas BULK_MAX_CONCURRENT langsung dijawab 503 tanpa antrian
+bulk_admission = AdmissionController(int(os.environ.get("BULK_MAX_CONCURRENT", 2)), max_queue=0)
+# Baris yang divalidasi dan diprediksi sekaligus, dan batas baris per request (0 = tanpa batas)
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 4096))
+BULK_MAX_ROWS = int(os.environ.get("BULK_MAX_ROWS", 1000000))
+
+# Kolom input model, urutannya sama dengan form /predict/recom
+FEATURES = ("N", "P", "K", "temperature", "humidity", "ph", "rainfall")
+BULK_CSV_FIELDS = ("row", "id", "class_id", "recom_prediction", "confidence", "error")
+BULK_CSV_COMPACT_FIELDS = ("row", "id", "class_id", "confidence", "error")
+
+NEGATIVE_VALUE = "Nilai tidak boleh negatif"
+PH_RANGE = "pH harus antara 0 hingga 14"
+HUMIDITY_RANGE = "Kelembaban harus antara 0 hingga 100"
+NOT_INTEGER = "N, P, dan K harus bilangan bulat"
+
+# Relatif terhadap file ini, bukan direktori kerja, supaya service juga bisa dimuat oleh gateway/
+MODEL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saved_model", "model_crop_recom.h5")
+
+# "numpy" menjalankan bobot model .h5 sebagai perkalian matriks NumPy tanpa memuat
+# TensorFlow (lihat common/numpy_engine.py); "keras" memakai model Keras seperti sebelumnya
+CROP_BACKENDS = ("numpy", "keras")
+CROP_BACKEND = os.environ.get("CROP_BACKEND", "numpy").lower()
+if CROP_BACKEND not in CROP_BACKENDS:
+    raise ValueError(f"CROP_BACKEND must be one of {CROP_BACKENDS}, got '{CROP_BACKEND}'")
+
+# Memuat dan memanaskan satu versi model; dipakai registry saat start dan saat hot-swap
+def load_version(path: str) -> ModelVersion:
+    load_started = time.perf_counter()
+    # MODEL_VERSION hanya untuk file model yang di-deploy bersama proses; file hasil swap
+    # (termasuk MODEL_PATH yang ditimpa) di-fingerprint
+    version = model_registry.deployed_version(path) or file_model_version(path)
+
+    if CROP_BACKEND == "numpy":
+        predictor = load_numpy_predictor(path)
+    else:
+        # Thread pool TensorFlow sesuai jatah core worker ini, lihat common/threads.py
+        configure_tensorflow()
+        from tensorflow.keras.models import load_model
+        predictor = build_predictor(load_model(path, compile=False))
+    metrics.model_load.set(time.perf_counter() - load_started)
+    predictor.warmup()
+    return ModelVersion(version, predictor, path)
+
+# Versi model yang melayani request, bisa diganti tanpa downtime lewat /admin/model/swap atau SIGUSR2.
+# Jika gagal dimuat, alasannya ada di model_registry.load_error
+model_registry = ModelRegistry("crop", load_version, MODEL_PATH)
+app.include_router(admin_router(model_registry))
+
+# Dipanggil oleh common/runner.py sebelum fork supaya semua worker berbagi model,
+# dan lagi saat SIGUSR2 supaya worker baru memakai model terbaru.
+# Model Keras tidak aman di-fork, jadi dengan CROP_BACKEND=keras dimuat oleh tiap worker.
+def preload_model():
+    if CROP_BACKEND in FORK_SAFE_BACKENDS:
+        model_registry.load()
 
 # Label bahasa Inggris ke Bahasa Indonesia
 label_translation = {
@@ -49,6 +141,31 @@ label_translation = {
     'watermelon': 'Semangka'
 }
 
+# Metadata kelas disusun sekali saat start; urutannya sama dengan output model
+CLASS_INFO = [
+    {"class_id": class_id, "label": label_en, "recom_prediction": label_id}
+    for class_id, (label_en, label_id) in enumerate(label_translation.items())
+]
+classes_response = StaticJSON({"classes": CLASS_INFO})
+
+@app.on_event("startup")
+async def startup_event():
+    model_registry.ensure_loaded()
+    model_registry.install_signal_handler()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_executors()
+
+# Metadata semua kelas dengan ETag dan header cache panjang (304 jika tidak berubah)
+@app.get("/classes")
+def classes(request: Request):
+    return classes_response.response(request)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 @app.post("/predict/recom")
 async def predict_recom(
     N: int = Form(...),
@@ -57,39 +174,42 @@ async def predict_recom(
     temperature: float = Form(...),
     humidity: float = Form(...),
     ph: float = Form(...),
-    rainfall: float = Form(...)
+    rainfall: float = Form(...),
+    compact: bool = Query(False, description="Hanya class_id, confidence, dan model_version; metadata kelas dari /classes")
 ):
-    if model is None:
+    if model_registry.current() is None:
         return JSONResponse(
             status_code=500,
-            content={"error": "Model gagal dimuat", "detail": load_model_error}
+            content={"error": "Model gagal dimuat", "detail": model_registry.load_error}
         )
 
     # Validasi nilai
     if any(v < 0 for v in [N, P, K, temperature, humidity, ph, rainfall]):
         return JSONResponse(
             status_code=400,
-            content={"error": "Nilai tidak boleh negatif"}
+            content={"error": NEGATIVE_VALUE}
         )
 
     if not (0 <= ph <= 14):
         return JSONResponse(
             status_code=400,
-            content={"error": "pH harus antara 0 hingga 14"}
+            content={"error": PH_RANGE}
         )
 
     if not (0 <= humidity <= 100):
         return JSONResponse(
             status_code=400,
-            content={"error": "Kelembaban harus antara 0 hingga 100"}
+            content={"error": HUMIDITY_RANGE}
         )
 
     try:
         input_array = np.array([[N, P, K, temperature, humidity, ph, rainfall]])
-        prediction = model.predict(input_array)[0]
+        # Inferensi dijalankan di thread pool agar event loop tetap bebas
+        # Satu request memakai satu versi model walaupun ada swap di tengah jalan
+        with model_registry.acquire() as version, metrics.time_stage("inference"):
+            prediction = (await get_executor("inference", kinds=("thread",)).run(version.predictor, input_array))[0]
         label_index = int(np.argmax(prediction))
-        predicted_crop_en = list(label_translation.keys())[label_index]
-        predicted_crop_id = label_translation[predicted_crop_en]
+        info = CLASS_INFO[label_index]
         confidence = float(prediction[label_index]) * 100
     except Exception as e:
         return JSONResponse(
@@ -97,12 +217,156 @@ async def predict_recom(
             content={"error": "Gagal melakukan prediksi", "detail": str(e)}
         )
 
+    data = {
+        "class_id": label_index,
+        "recom_prediction": info["recom_prediction"],
+        "confidence": f"{confidence:.2f}%",
+        "model_version": version.version
+    }
     return JSONResponse(
         status_code=200,
-        content={
-            "data": {
-                "recom_prediction": predicted_crop_id,
-                "confidence": f"{confidence:.2f}%"
-            }
+        content={"data": compact_result(data) if compact else data}
+    )
+
+# Pesan error validasi per baris untuk satu blok sekaligus, dengan mask NumPy.
+# Urutannya sama dengan /predict/recom: pesan pertama yang berlaku dipakai.
+def validate_rows(values: np.ndarray, parse_errors: list) -> np.ndarray:
+    errors = np.array(parse_errors, dtype=object)
+    unset = np.array([error is None for error in parse_errors], dtype=bool)
+    npk, humidity, ph = values[:, :3], values[:, 4], values[:, 5]
+    checks = (
+        (~np.isfinite(values).all(axis=1), INVALID_VALUE),
+        ((npk != np.floor(npk)).any(axis=1), NOT_INTEGER),
+        ((values < 0).any(axis=1), NEGATIVE_VALUE),
+        (~((ph >= 0) & (ph <= 14)), PH_RANGE),
+        (~((humidity >= 0) & (humidity <= 100)), HUMIDITY_RANGE)
+    )
+    for mask, message in checks:
+        hit = mask & unset
+        errors[hit] = message
+        unset &= ~hit
+    return errors
+
+# Validasi dan prediksi satu blok baris dalam satu batch model; hasilnya teks CSV
+# atau NDJSON sesuai urutan baris, dengan error per baris yang tidak valid
+async def score_rows(version: ModelVersion, chunk, output_format: str, compact: bool) -> str:
+    with metrics.time_stage("validate"):
+        errors = validate_rows(chunk.values, chunk.errors)
+        valid = np.array([error is None for error in errors], dtype=bool)
+
+    class_ids, confidences = [], []
+    if valid.any():
+        with metrics.time_stage("inference"):
+            probabilities = await get_executor("inference", kinds=("thread",)).run(
+                version.predictor, chunk.values[valid]
+            )
+        class_ids = probabilities.argmax(axis=1).tolist()
+        confidences = (probabilities.max(axis=1) * 100).tolist()
+
+    predictions = iter(zip(class_ids, confidences))
+    records = []
+    for offset, error in enumerate(errors):
+        row, row_id = chunk.start + offset, chunk.ids[offset]
+        if error is not None:
+            records.append({"row": row, "id": row_id, "error": error})
+            continue
+        class_id, confidence = next(predictions)
+        data = {
+            "class_id": class_id,
+            "recom_prediction": CLASS_INFO[class_id]["recom_prediction"],
+            "confidence": f"{confidence:.2f}%",
+            "model_version": version.version
         }
-    )
\ No newline at end of file
+        records.append({"row": row, "id": row_id, "data": compact_result(data) if compact else data})
+    return format_records(records, output_format, compact)
+
+def format_records(records: list, output_format: str, compact: bool) -> str:
+    if output_format == "ndjson":
+        # id hanya ditulis jika baris input memilikinya
+        return ndjson_text([
+            {key: value for key, value in record.items() if key != "id" or value is not None}
+            for record in records
+        ])
+    fields = BULK_CSV_COMPACT_FIELDS if compact else BULK_CSV_FIELDS
+    return csv_text([
+        [record.get("data", {}).get(field, record.get(field)) for field in fields]
+        for record in records
+    ])
+
+# Rekomendasi untuk banyak sampel tanah sekaligus: body CSV (dengan header), array JSON,
+# atau NDJSON berisi kolom N, P, K, temperature, humidity, ph, rainfall (dan id opsional).
+# Body dibaca dan hasilnya dikirim per blok BULK_BATCH_SIZE baris, jadi ukuran file
+# tidak dibatasi memori. Hasil berupa NDJSON atau CSV (?format=csv), satu baris per
+# baris input dengan nomor "row" (mulai dari 1) dan "error" untuk baris yang tidak valid.
+@app.post("/predict/recom/bulk")
+async def predict_recom_bulk(
+    request: Request,
+    format: str = Query("ndjson", description="Format hasil: ndjson atau csv"),
+    compact: bool = Query(False, description="Hanya class_id, confidence, dan model_version; metadata kelas dari /classes")
+):
+    if model_registry.current() is None:
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Model gagal dimuat", "detail": model_registry.load_error}
+        )
+
+    output_format = format.lower()
+    if output_format not in ("ndjson", "csv"):
+        return JSONResponse(status_code=400, content={"error": "format harus ndjson atau csv"})
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in BULK_CONTENT_TYPES:
+        return JSONResponse(
+            status_code=415,
+            content={"error": f"Gunakan salah satu Content-Type: {', '.join(BULK_CONTENT_TYPES)}"}
+        )
+
+    try:
+        await bulk_admission.acquire()
+    except Overloaded as e:
+        return JSONResponse(
+            status_code=503,
+            content={"error": OVERLOADED},
+            headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
+
+    # Slot bulk dan versi model dipegang sampai baris terakhir terkirim
+    resources = contextlib.ExitStack()
+    resources.callback(bulk_admission.release)
+    version = resources.enter_context(model_registry.acquire())
+    chunks = read_rows(request.stream(), content_type, FEATURES, BULK_BATCH_SIZE, BULK_MAX_ROWS)
+
+    # Blok pertama dibaca sebelum respons dimulai, jadi header CSV atau body yang salah dijawab 400
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except BulkFormatError as e:
+        resources.close()
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    except BaseException:
+        resources.close()
+        raise
+
+    async def results():
+        next_row = 1
+        try:
+            if output_format == "csv":
+                yield csv_text([BULK_CSV_COMPACT_FIELDS if compact else BULK_CSV_FIELDS])
+            chunk = first
+            while chunk is not None:
+                yield await score_rows(version, chunk, output_format, compact)
+                next_row = chunk.start + len(chunk)
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    chunk = None
+        except BulkFormatError as e:
+            # Respons sudah berjalan, jadi body yang rusak dilaporkan sebagai baris terakhir
+            yield format_records([{"row": next_row, "id": None, "error": str(e)}], output_format, compact)
+        except ClientDisconnect:
+            pass
+        finally:
+            resources.close()
+
+    media_type = "text/csv; charset=utf-8" if output_format == "csv" else "application/x-ndjson"
+    return DuplexStreamingResponse(results(), media_type=media_type, headers={"X-Model-Version": version.version})
@@ -0,0 +1,175 @@
+"""
+Single-process gateway serving the disease, pest and crop services
+
+Each service normally runs as its own process with its own TensorFlow
+runtime, which costs hundreds of MB per node before any traffic arrives.
+The gateway imports the three service apps into one process instead, so
+they share one TensorFlow runtime, the image and inference pools from
+common/executor.py and, under common/runner.py, one set of forked workers.
+
+Every service keeps its own middleware, startup and shutdown. Requests are
+dispatched without changing today's URLs or response formats:
+
+- a path that only one service serves (/predict-disease, /predict,
+  /predict/recom and their variants) goes to that service;
+- every path of a service is also served under its prefix, e.g.
+  /pest/classes, /crop/metrics or /disease/admin/model. Paths that
+  several services share (/classes, /metrics, /stats/cache, /admin/model,
+  /docs) exist only under the prefix.
+
+SIGUSR2 swaps the model of every service (see common/registry.py). Image
+pools of kind "process" only work for the disease routes, because pest and
+crop are imported under names that spawned pool processes cannot import.
+
+Usage, from back-end/gateway:
+
+    PYTHONPATH=.. python -m common.runner app:app --preload app:preload_model --port 8000
+
+Configuration through environment variables:
+
+    GATEWAY_SERVICES    comma-separated services to host, default "disease,pest,crop"
+"""
+
+import os
+import sys
+import signal
+import logging
+import threading
+import contextlib
+import importlib.util
+from typing import Any, Callable, Dict, List, Tuple
+
+from starlette.responses import JSONResponse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+logger = logging.getLogger(__name__)
+
+SERVICES = ("disease", "pest", "crop")
+SERVICE_DIRS = {
+    "disease": os.path.join(BACKEND_DIR, "plant-disease-classification", "app"),
+    "pest": os.path.join(BACKEND_DIR, "pest-classification"),
+    "crop": os.path.join(BACKEND_DIR, "crop-recommendation")
+}
+
+def load_service(name: str) -> Any:
+    """
+    Import a service's app module.
+
+    Pest and crop both live in app.py, so they are imported under the names
+    pest_app and crop_app; the disease app is the api.app package module.
+
+    Args:
+        name: One of SERVICES
+
+    Returns:
+        The imported module, with the FastAPI app as ``app``
+    """
+    if name == "disease":
+        if SERVICE_DIRS["disease"] not in sys.path:
+            sys.path.append(SERVICE_DIRS["disease"])
+        from api import app as module
+        return module
+
+    spec = importlib.util.spec_from_file_location(f"{name}_app", os.path.join(SERVICE_DIRS[name], "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class ServiceGateway:
+    """ASGI app dispatching requests to the service that owns the path"""
+
+    def __init__(self, services: Dict[str, Any]):
+        """
+        Args:
+            services: Service name to imported service module
+        """
+        self.services = services
+        self.apps = {name: module.app for name, module in services.items()}
+
+        owners: Dict[str, List[str]] = {}
+        for name, app in self.apps.items():
+            for route in app.routes:
+                owners.setdefault(route.path, []).append(name)
+
+        # Paths served by exactly one service keep their URL without a prefix
+        self.routes: List[Tuple[Any, str]] = []
+        for name, app in self.apps.items():
+            for route in app.routes:
+                if len(owners[route.path]) == 1 and hasattr(route, "path_regex"):
+                    self.routes.append((route.path_regex, name))
+        shared = sorted(path for path, names in owners.items() if len(names) > 1)
+        logger.info(f"Gateway serving {', '.join(self.apps)}; only under a service prefix: {', '.join(shared)}")
+
+    async def __call__(self, scope: Dict[str, Any], receive: Callable, send: Callable) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        path = scope["path"]
+        prefix, _, rest = path[1:].partition("/")
+        if prefix in self.apps:
+            # The service sees its own paths, so its middleware (upload limits,
+            # profiling, metrics route labels) matches as when it runs alone
+            scope = dict(scope, path="/" + rest, root_path=scope.get("root_path", "") + "/" + prefix)
+            await self.apps[prefix](scope, receive, send)
+            return
+
+        for path_regex, name in self.routes:
+            if path_regex.match(path):
+                await self.apps[name](scope, receive, send)
+                return
+
+        if scope["type"] == "http":
+            await JSONResponse({"detail": "Not Found"}, status_code=404)(scope, receive, send)
+
+    async def lifespan(self, receive: Callable, send: Callable) -> None:
+        """Run the startup and shutdown events of every service, stopping them in reverse order"""
+        await receive()
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                for app in self.apps.values():
+                    await stack.enter_async_context(app.router.lifespan_context(app))
+                self.install_signal_handler()
+            except Exception as e:
+                logger.exception("Gateway startup failed")
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+            await receive()
+        await send({"type": "lifespan.shutdown.complete"})
+
+    def install_signal_handler(self) -> None:
+        """Swap every service's model on SIGUSR2, replacing the handler each service installed"""
+        if os.environ.get("RUNNER_PID"):
+            # Workers of common/runner.py are swapped by the runner
+            return
+        if threading.current_thread() is not threading.main_thread():
+            # Only the main thread may set signal handlers, e.g. not under TestClient
+            logger.warning("Not on the main thread, model swaps on SIGUSR2 are unavailable")
+            return
+
+        def swap_all(signum: int, frame: Any) -> None:
+            for module in self.services.values():
+                module.model_registry.swap_in_background()
+
+        signal.signal(signal.SIGUSR2, swap_all)
+
+# Names are checked before any service is imported
+service_names = [name for name in os.environ.get("GATEWAY_SERVICES", ",".join(SERVICES)).replace(" ", "").split(",") if name]
+unknown = set(service_names) - set(SERVICES)
+if unknown:
+    raise ValueError(f"GATEWAY_SERVICES must be a subset of {SERVICES}, got {sorted(unknown)}")
+services = {name: load_service(name) for name in service_names}
+
+app = ServiceGateway(services)
+
+def preload_model() -> None:
+    """Load the fork-safe models of every service in the prefork parent (common/runner.py)"""
+    for module in services.values():
+        preload = getattr(module, "preload_model", None)
+        if preload is not None:
+            preload()
@@ -1,10 +1,33 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 from tensorflow.keras.models import load_model
 import numpy as np
 import json
 from PIL import Image, UnidentifiedImageError
 import io
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.admission import AdmissionController, AdmissionMiddleware, RateLimiter
+from common.cache import PredictionCache, file_model_version
+from common.cascade import Cascade
+from common.deadlines import DeadlineMiddleware, RequestAbandoned, abandoned_response
+from common.executor import get_executor, shutdown_executors
+from common.inference import build_predictor
+from common.metrics import CONTENT_TYPE, MetricsMiddleware, ServiceMetrics
+from common.preprocessing import graph_preprocessing_enabled, normalize_pixels, resolve_normalization, with_preprocessing
+from common.profiling import ProfilingMiddleware
+from common.registry import ModelRegistry, ModelVersion, admin_router
+from common.responses import StaticJSON, compact_result
+from common.runner import FORK_SAFE_BACKENDS
+from common.tensors import TENSOR_CONTENT_TYPES, InvalidTensor, parse_tensor, read_body, tensor_body_limit
+from common.threads import configure_tensorflow
+from common.tflite import MODEL_BACKENDS, load_tflite_predictor
+from common.uploads import UnsupportedUpload, UploadLimitMiddleware, UploadTooLarge, read_upload
 
 app = FastAPI()
 
@@ -16,10 +39,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-MODEL_PATH = 'saved_model/model_hama.h5'
-LABELS_PATH = 'saved_model/class_labels.json'
+# Metrik request, latensi per tahap, dan antrian untuk /metrics
+metrics = ServiceMetrics("pest")
+metrics.track_queue("image", lambda: get_executor("image").pending())
+metrics.track_queue("inference", lambda: get_executor("inference", kinds=("thread",)).pending())
+
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+# Server-Timing per tahap untuk pemanggil tepercaya, lihat common/profiling.py
+app.add_middleware(ProfilingMiddleware, paths=("/predict",))
+
+# Relatif terhadap file ini, bukan direktori kerja, supaya service juga bisa dimuat oleh gateway/
+SAVED_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'saved_model')
+MODEL_PATH = os.path.join(SAVED_MODEL_DIR, 'model_hama.h5')
+LABELS_PATH = os.path.join(SAVED_MODEL_DIR, 'class_labels.json')
 
-model = load_model(MODEL_PATH)
+# "keras" atau "tflite" (model terkuantisasi, lihat common/tflite.py)
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "keras").lower()
+if MODEL_BACKEND not in MODEL_BACKENDS:
+    raise ValueError(f"MODEL_BACKEND must be one of {MODEL_BACKENDS}, got '{MODEL_BACKEND}'")
+
+# Cache hasil prediksi per isi file, lihat common/cache.py untuk konfigurasi
+prediction_cache = PredictionCache.from_env()
+
+# Mode kaskade (CASCADE_ENABLED): gambar yang jelas bukan hama atau jelas hamanya
+# diputuskan oleh gate statistik gambar dan model kecil tahap pertama, hanya sisanya
+# dijalankan di model penuh; lihat common/cascade.py. Tanpa file model tahap pertama
+# hanya gate yang dipakai.
+cascade = Cascade.from_env(metrics)
+CASCADE_MODEL_PATH = os.environ.get("CASCADE_MODEL_PATH", os.path.join(SAVED_MODEL_DIR, 'model_hama_cascade.keras'))
 
 with open(LABELS_PATH, 'r') as f:
     class_labels = json.load(f)
@@ -41,55 +88,328 @@ suggestions = {
     "Kutu Beras": "Simpan hasil panen di tempat tertutup rapat. Bisa taruh daun salam atau serai untuk mengusir kutu secara alami."
 }
 
+# Bagian respons per kelas disusun sekali saat start, bukan di setiap prediksi.
+# /classes mengirim semuanya sekali, jadi respons compact cukup berisi class_id.
+CLASS_INFO = [
+    {
+        "class_id": class_id,
+        "prediction": label,
+        "suggestion": suggestions.get(label, "Belum ada saran yang tersedia untuk saat ini.")
+    }
+    for class_id, label in enumerate(class_labels)
+]
+classes_response = StaticJSON({"classes": CLASS_INFO})
+
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+FILE_TOO_LARGE = "Ukuran file terlalu besar. Maksimal 5MB."
 allowed_extensions = {"jpg", "jpeg", "png"}
+IMAGE_TYPES = {"image/jpeg", "image/png"}
 
-@app.post("/predict")
-async def predict(file: UploadFile = File(...)):
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="Empty file name")
+# Ukuran gambar input model, dipakai jika model tidak menyebutkannya
+IMAGE_SIZE = (224, 224)
+# Jumlah gambar maksimal dalam satu request tensor mentah (/predict/tensor)
+TENSOR_MAX_BATCH = int(os.environ.get("TENSOR_MAX_BATCH", 64))
 
-    ext = file.filename.split(".")[-1].lower()
-    if ext not in allowed_extensions:
-        raise HTTPException(status_code=400, detail="Format file tidak didukung. Gunakan JPG atau PNG.")
+MIN_CONFIDENCE = 0.93
+NOT_A_PEST = "Gambar yang diunggah tampaknya tidak menunjukkan keberadaan hama tanaman seperti serangga. Sistem tidak dapat melakukan identifikasi hama berdasarkan gambar ini."
+
+# Upload yang terlalu besar ditolak dari Content-Length sebelum form dibaca
+app.add_middleware(UploadLimitMiddleware, limits={"/predict": MAX_FILE_SIZE}, detail=FILE_TOO_LARGE)
+
+# Batas request yang diproses bersamaan dan antriannya; saat penuh request langsung
+# dijawab 503 dengan Retry-After, lihat common/admission.py
+admission = AdmissionController.from_env()
+metrics.track_queue("admission", lambda: admission.waiting)
+app.add_middleware(
+    AdmissionMiddleware,
+    paths=("/predict", "/predict/tensor"),
+    controller=admission,
+    rate_limiter=RateLimiter.from_env(),
+    metrics=metrics
+)
+
+# Request yang kliennya sudah pergi atau batas waktunya (REQUEST_TIMEOUT_MS atau
+# X-Request-Timeout-Ms) habis dihentikan di antara tahap, lihat common/deadlines.py
+app.add_middleware(DeadlineMiddleware, paths=("/predict", "/predict/tensor"), metrics=metrics)
+app.add_exception_handler(RequestAbandoned, abandoned_response)
+
+# Memuat satu file model sesuai MODEL_BACKEND; mengembalikan predictor dan
+# normalisasi yang dilakukan di host (None jika sudah di dalam graph model)
+def load_predictor(path: str):
+    # Normalisasi ditentukan sekali per versi model (MODEL_NORMALIZATION)
+    normalization = resolve_normalization(path)
+    in_graph = graph_preprocessing_enabled()
+
+    def load_keras_model():
+        configure_tensorflow()
+        keras_model = load_model(path)
+        return with_preprocessing(keras_model, normalization) if in_graph else keras_model
+
+    if MODEL_BACKEND == "tflite":
+        predictor = load_tflite_predictor(
+            path,
+            load_keras_model,
+            calibration_scale=1.0 if in_graph else 1.0 / 255.0,
+            variant=f"uint8-{normalization}" if in_graph else None
+        )
+    else:
+        predictor = build_predictor(load_keras_model())
+    return predictor, None if in_graph else normalization
+
+# Memuat dan memanaskan satu versi model; dipakai registry saat start dan saat hot-swap
+def load_version(path: str) -> ModelVersion:
+    load_started = time.perf_counter()
+    quantization = os.environ.get("TFLITE_QUANTIZATION", "dynamic")
+    # MODEL_VERSION hanya untuk file model yang di-deploy bersama proses; file hasil swap
+    # (termasuk MODEL_PATH yang ditimpa) di-fingerprint
+    version = model_registry.deployed_version(path) or file_model_version(path, MODEL_BACKEND, quantization)
 
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail="Ukuran file terlalu besar. Maksimal 5MB.")
+    predictor, host_normalization = load_predictor(path)
+    metrics.model_load.set(time.perf_counter() - load_started)
+    predictor.warmup()
 
+    # host_normalization: normalisasi yang dilakukan di host; None jika sudah di dalam graph model
+    input_size = tuple(predictor.input_shape[1:3])
+    info = {
+        "host_normalization": host_normalization,
+        "input_size": input_size if None not in input_size else IMAGE_SIZE,
+        "first_stage": None,
+        "first_stage_version": None
+    }
+
+    # Model tahap pertama dimuat ulang bersama setiap versi model penuh (juga saat hot-swap)
+    # Tanpa file di path bawaan hanya gate yang dipakai; CASCADE_MODEL_PATH yang diisi harus ada
+    if cascade.enabled and (os.path.exists(CASCADE_MODEL_PATH) or "CASCADE_MODEL_PATH" in os.environ):
+        first_stage, first_stage_normalization = load_predictor(CASCADE_MODEL_PATH)
+        first_stage.warmup()
+        info["first_stage"] = first_stage
+        info["first_stage_normalization"] = first_stage_normalization
+        info["first_stage_version"] = file_model_version(CASCADE_MODEL_PATH, MODEL_BACKEND, quantization)
+    info["cascade"] = cascade.tag(info["first_stage_version"])
+    return ModelVersion(version, predictor, path, info=info)
+
+# Versi model yang melayani request, bisa diganti tanpa downtime lewat /admin/model/swap atau SIGUSR2
+model_registry = ModelRegistry("pest", load_version, MODEL_PATH)
+app.include_router(admin_router(model_registry))
+
+# Dipanggil oleh common/runner.py sebelum fork supaya semua worker berbagi model,
+# dan lagi saat SIGUSR2 supaya worker baru memakai model terbaru.
+# Hanya model TFLite yang aman di-fork; model Keras dimuat oleh tiap worker.
+def preload_model():
+    if MODEL_BACKEND in FORK_SAFE_BACKENDS:
+        model_registry.load()
+
+@app.on_event("startup")
+async def startup_event():
+    # Gagal dimuat tidak menghentikan service; /predict menjawab 500 dengan load_error
+    model_registry.ensure_loaded()
+    model_registry.install_signal_handler()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_executors()
+
+# Dijalankan di image pool (thread atau process), jadi harus fungsi level modul.
+# Tanpa normalisasi hasilnya uint8 dan model yang melakukan scaling.
+def preprocess_image(contents: bytes, normalization: str = None) -> np.ndarray:
     try:
         img = Image.open(io.BytesIO(contents))
     except UnidentifiedImageError:
-        raise HTTPException(status_code=400, detail="File bukan gambar yang valid")
+        raise ValueError("File bukan gambar yang valid")
 
     img = img.convert("RGB")
-    img = img.resize((224, 224))
-    img_array = np.array(img) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
+    img = img.resize(IMAGE_SIZE[::-1])
+    img_array = np.expand_dims(np.asarray(img, dtype=np.uint8), axis=0)
+    if normalization is None:
+        return img_array
+    return normalize_pixels(img_array, normalization)
 
+# Hasil mentah (indeks kelas, confidence, dan tahap yang memutuskan) untuk batch
+# piksel uint8. Dengan kaskade, gambar yang ditolak gate atau diputuskan model tahap
+# pertama tidak dijalankan di model penuh; "rejected" berarti bukan hama.
+async def run_models(version: ModelVersion, pixels: np.ndarray) -> list:
+    inference = get_executor("inference", kinds=("thread",))
+    results = [None] * len(pixels)
+    pending = np.arange(len(pixels))
+
+    if cascade.enabled:
+        with metrics.time_stage("cascade_gate"):
+            flat = cascade.gate(pixels)
+        for i in np.flatnonzero(flat):
+            results[i] = {"class_index": None, "confidence": 0.0, "stage": "gate", "rejected": True}
+        cascade.record("gate", "rejected", int(flat.sum()))
+        pending = pending[~flat]
+
+        first_stage = version.info["first_stage"]
+        if first_stage is not None and pending.size:
+            with metrics.time_stage("cascade_first_stage"):
+                batch = pixels[pending]
+                if version.info["first_stage_normalization"] is not None:
+                    batch = normalize_pixels(batch, version.info["first_stage_normalization"])
+                probabilities = await inference.run(first_stage, batch)
+            accepted, rejected = cascade.decide(probabilities)
+            for i, prediction, accept, reject in zip(pending, probabilities, accepted, rejected):
+                if accept or reject:
+                    results[i] = {
+                        "class_index": int(np.argmax(prediction)),
+                        "confidence": float(np.max(prediction)),
+                        "stage": "first_stage",
+                        "rejected": bool(reject)
+                    }
+            cascade.record("first_stage", "accepted", int(accepted.sum()))
+            cascade.record("first_stage", "rejected", int(rejected.sum()))
+            pending = pending[~(accepted | rejected)]
+
+    if pending.size:
+        batch = pixels[pending]
+        if version.info["host_normalization"] is not None:
+            with metrics.time_stage("preprocess"):
+                batch = normalize_pixels(batch, version.info["host_normalization"])
+        with metrics.time_stage("inference"):
+            predictions = await inference.run(version.predictor, batch)
+        for i, prediction in zip(pending, predictions):
+            results[i] = {
+                "class_index": int(np.argmax(prediction)),
+                "confidence": float(np.max(prediction)),
+                "stage": "full_model",
+                "rejected": False
+            }
+        if cascade.enabled:
+            cascade.record("full_model", "escalated", len(pending))
+    return results
+
+# Hasil mentah satu upload yang disimpan di cache
+async def classify(version: ModelVersion, contents: bytes) -> dict:
     try:
-        prediction = model.predict(img_array)
+        with metrics.time_stage("preprocess"):
+            pixels = await get_executor("image").run(preprocess_image, contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        return (await run_models(version, pixels))[0]
+    except RequestAbandoned:
+        raise
     except Exception:
         raise HTTPException(status_code=500, detail="Model gagal melakukan prediksi. Periksa format gambar.")
 
-    confidence = float(np.max(prediction))
-    confidence_percent = round(confidence * 100, 2)
+# Isi field "data" untuk satu hasil run_models; None jika bukan hama atau confidence di bawah MIN_CONFIDENCE
+def describe(result: dict, version: ModelVersion):
+    confidence = result["confidence"]
+    if result.get("rejected") or confidence < MIN_CONFIDENCE:
+        return None
+
+    info = CLASS_INFO[result["class_index"]]
+    return {
+        "class_id": info["class_id"],
+        "prediction": info["prediction"],
+        "confidence": f"{round(confidence * 100, 2)}%",
+        "suggestion": info["suggestion"],
+        "model_version": version.version
+    }
 
-    if confidence < 0.93:
-        raise HTTPException(
-            status_code=400,
-            detail="Gambar yang diunggah tampaknya tidak menunjukkan keberadaan hama tanaman seperti serangga. Sistem tidak dapat melakukan identifikasi hama berdasarkan gambar ini."
+@app.post("/predict")
+async def predict(
+    file: UploadFile = File(...),
+    compact: bool = Query(False, description="Hanya class_id, confidence, dan model_version; metadata kelas dari /classes")
+):
+    if model_registry.current() is None:
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Model gagal dimuat", "detail": model_registry.load_error}
         )
 
-    class_index = int(np.argmax(prediction))
-    class_name_id = class_labels[class_index]
+    if not file.filename:
+        raise HTTPException(status_code=400, detail="Empty file name")
 
-    suggestion = suggestions.get(class_name_id, "Belum ada saran yang tersedia untuk saat ini.")
+    ext = file.filename.split(".")[-1].lower()
+    if ext not in allowed_extensions:
+        raise HTTPException(status_code=400, detail="Format file tidak didukung. Gunakan JPG atau PNG.")
 
-    return {
-        "data": {
-            "prediction": class_name_id,
-            "confidence": f"{confidence_percent}%",
-            "suggestion": suggestion
-        }
-    }
\ No newline at end of file
+    # Dibaca per chunk: berhenti begitu melewati batas ukuran, dan isi file
+    # harus JPG atau PNG (dicek dari magic bytes, bukan dari ekstensi)
+    try:
+        with metrics.time_stage("read"):
+            contents = await read_upload(file, MAX_FILE_SIZE, image_types=IMAGE_TYPES)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=FILE_TOO_LARGE)
+    except UnsupportedUpload:
+        raise HTTPException(status_code=400, detail="File bukan gambar yang valid")
+
+    # Satu request memakai satu versi model walaupun ada swap di tengah jalan
+    with model_registry.acquire() as version:
+        cache_key = PredictionCache.make_key(contents, version.version, cascade=version.info["cascade"])
+        result, _ = await prediction_cache.get_or_compute(cache_key, lambda: classify(version, contents))
+
+    data = describe(result, version)
+    if data is None:
+        raise HTTPException(status_code=400, detail=NOT_A_PEST)
+    return {"data": compact_result(data) if compact else data}
+
+# Jalur cepat untuk klien yang sudah punya frame RGB uint8 seukuran input model
+# (.npy atau format biner RGB8, lihat common/tensors.py): tanpa decode dan resize.
+# Satu gambar dijawab seperti /predict; batch dijawab per gambar, dengan "error"
+# untuk gambar yang bukan hama.
+@app.post("/predict/tensor")
+async def predict_tensor(
+    request: Request,
+    compact: bool = Query(False, description="Hanya class_id, confidence, dan model_version; metadata kelas dari /classes")
+):
+    if model_registry.current() is None:
+        return JSONResponse(
+            status_code=500,
+            content={"error": "Model gagal dimuat", "detail": model_registry.load_error}
+        )
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in TENSOR_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Gunakan application/x-npy atau application/octet-stream")
+
+    with model_registry.acquire() as version:
+        input_size = version.info["input_size"]
+        try:
+            with metrics.time_stage("read"):
+                body = await read_body(request, tensor_body_limit(TENSOR_MAX_BATCH, input_size))
+            batch, batched = parse_tensor(body, content_type, input_size, TENSOR_MAX_BATCH)
+        except UploadTooLarge:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Tensor melebihi {TENSOR_MAX_BATCH} gambar berukuran {input_size[0]}x{input_size[1]}"
+            )
+        except InvalidTensor as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        try:
+            results = [describe(result, version) for result in await run_models(version, batch)]
+        except RequestAbandoned:
+            raise
+        except Exception:
+            raise HTTPException(status_code=500, detail="Model gagal melakukan prediksi.")
+
+    if compact:
+        results = [compact_result(data) if data is not None else None for data in results]
+    if not batched:
+        if results[0] is None:
+            raise HTTPException(status_code=400, detail=NOT_A_PEST)
+        return {"data": results[0]}
+    return {"data": [data if data is not None else {"error": NOT_A_PEST} for data in results]}
+
+# Metadata semua kelas dengan ETag dan header cache panjang (304 jika tidak berubah)
+@app.get("/classes")
+def classes(request: Request):
+    return classes_response.response(request)
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return prediction_cache.stats()
+
+# Jumlah dan porsi gambar yang diputuskan di tiap tahap kaskade
+@app.get("/stats/cascade")
+async def cascade_stats():
+    current = model_registry.current()
+    first_stage = current.info["first_stage_version"] if current is not None else None
+    return {**cascade.stats(), "first_stage_model": first_stage}
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
@@ -4,29 +4,39 @@ Plant Disease Classification API
 This FastAPI application provides an API for classifying plant diseases using a Keras model.
 It includes endpoints for health checks and image prediction with proper error handling.
 Enhanced with plant/leaf detection to validate that uploaded images contain plant leaves.
+
+TensorFlow and OpenCV are imported where they are first needed, so a replica
+serving a cached TFLite artifact (FAST_START) never loads TensorFlow at all.
 """
 
+import time
+
+IMPORT_STARTED = time.perf_counter()
+
 import os
 import io
+import sys
+import json
+import asyncio
+import threading
+import zipfile
+import tempfile
+import itertools
 import traceback
 import logging
-from typing import List, Tuple, Dict, Any, Optional
+from typing import List, Tuple, Dict, Any, Optional, Iterator, AsyncIterator
 import mimetypes
-import imghdr
-import cv2
-import requests
 import numpy as np
-import tensorflow as tf
 
 from PIL import Image, UnidentifiedImageError
-from fastapi import FastAPI, File, UploadFile, HTTPException, status, Depends, Query
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, status, Depends, Query, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.exceptions import RequestValidationError
 from fastapi.encoders import jsonable_encoder
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
-from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+from starlette.datastructures import Headers
+
+from .batching import MicroBatcher, SampleExpired
 
 logging.basicConfig(
     level=logging.INFO,
@@ -34,7 +44,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-import os
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+if BACKEND_DIR not in sys.path:
+    sys.path.append(BACKEND_DIR)
+
+from common.admission import AdmissionController, AdmissionMiddleware, RateLimiter
+from common.cache import PredictionCache, file_model_version
+from common.deadlines import DeadlineMiddleware, RequestAbandoned, abandoned_response, current_deadline
+from common.executor import get_executor, shutdown_executors
+from common.inference import build_predictor
+from common.metrics import CONTENT_TYPE, MetricsMiddleware, ServiceMetrics
+from common.preprocessing import (
+    NORMALIZATIONS,
+    graph_preprocessing_enabled,
+    normalize_pixels,
+    resolve_normalization,
+    with_preprocessing
+)
+from common.profiling import ProfilingMiddleware, current_profile
+from common.registry import ModelRegistry, ModelVersion, admin_router
+from common.responses import StaticJSON, compact_result
+from common.runner import FORK_SAFE_BACKENDS
+from common.tensors import TENSOR_CONTENT_TYPES, InvalidTensor, parse_tensor, read_body, tensor_body_limit
+from common.threads import configure_tensorflow, import_cv2
+from common.tflite import MODEL_BACKENDS, load_tflite_predictor
+from common.uploads import UnsupportedUpload, UploadLimitMiddleware, UploadTooLarge, read_upload
 
 MODEL_DIR = os.path.join(
     os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
@@ -373,144 +407,255 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-model = None
-input_size = DEFAULT_INPUT_SIZE
+# Request, per-stage latency and queue depth metrics served on /metrics
+metrics = ServiceMetrics("disease")
+metrics.track_queue("image", lambda: get_executor("image").pending())
+metrics.track_queue("inference", lambda: get_executor("inference", kinds=("thread",)).pending())
+metrics.track_queue("upload", lambda: get_executor("upload", kinds=("thread",)).pending())
+metrics.track_queue("batcher", lambda: ModelService.batcher_queue_depth())
+
+app.add_middleware(MetricsMiddleware, metrics=metrics)
+# Server-Timing and cProfile/tracemalloc summaries for trusted callers (PROFILING_TOKEN)
+app.add_middleware(ProfilingMiddleware, paths=("/predict-disease",))
+
+batcher_lock = threading.Lock()
+
+prediction_cache = PredictionCache.from_env()
 
 MAX_IMAGE_SIZE = 10 * 1024 * 1024
+MAX_IMAGE_PIXELS = int(os.environ.get("MAX_IMAGE_PIXELS", 50_000_000))
+
+PLANT_ANALYSIS_SIZE = (224, 224)
+
+BATCHING_ENABLED = os.environ.get("BATCHING_ENABLED", "true").lower() == "true"
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 16))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", 5))
+
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "keras").lower()
+
+# Serve the cached TFLite artifact next to MODEL_PATH (unquantized unless
+# TFLITE_QUANTIZATION is set); with ai-edge-litert installed TensorFlow is never imported
+FAST_START = os.environ.get("FAST_START", "false").lower() == "true"
+IS_PRODUCTION = os.environ.get("ENVIRONMENT", "development") != "development"
+
+startup_timings: Dict[str, float] = {}
 
 SUPPORTED_FORMATS = {'image/jpeg', 'image/png', 'image/jpg'}
 
+ZIP_FORMATS = {'application/zip', 'application/x-zip-compressed'}
+
+BATCH_ENDPOINT_MAX_FILES = int(os.environ.get("BATCH_ENDPOINT_MAX_FILES", 1000))
+BATCH_ENDPOINT_MAX_UPLOAD_SIZE = int(os.environ.get("BATCH_ENDPOINT_MAX_UPLOAD_SIZE", 512 * 1024 * 1024))
+
+# Largest number of images in one raw tensor request (/predict-disease/tensor)
+TENSOR_MAX_BATCH = int(os.environ.get("TENSOR_MAX_BATCH", 64))
+
+# Images in one batch request, counting the members of zip archives
+TOO_MANY_IMAGES = f"Jumlah gambar melebihi batas maksimum {BATCH_ENDPOINT_MAX_FILES} per request"
+
+# Oversized uploads are refused from Content-Length before the form is parsed
+app.add_middleware(
+    UploadLimitMiddleware,
+    limits={
+        "/predict-disease": MAX_IMAGE_SIZE,
+        "/predict-disease/batch": (
+            BATCH_ENDPOINT_MAX_UPLOAD_SIZE,
+            f"Ukuran upload melebihi batas maksimum {BATCH_ENDPOINT_MAX_UPLOAD_SIZE / (1024 * 1024)}MB",
+            status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    },
+    detail=f"Ukuran gambar melebihi batas maksimum {MAX_IMAGE_SIZE / (1024 * 1024)}MB",
+    status_code=status.HTTP_400_BAD_REQUEST
+)
+
+# Bounded concurrency and queue in front of decoding and inference; when
+# saturated, requests get a fast 503 with Retry-After (see common/admission.py)
+admission = AdmissionController.from_env()
+metrics.track_queue("admission", lambda: admission.waiting)
+app.add_middleware(
+    AdmissionMiddleware,
+    paths=("/predict-disease", "/predict-disease/tensor", "/predict-disease/batch"),
+    controller=admission,
+    rate_limiter=RateLimiter.from_env(),
+    metrics=metrics
+)
+
+# Requests whose client left or whose budget (REQUEST_TIMEOUT_MS or
+# X-Request-Timeout-Ms) ran out are stopped between stages, see common/deadlines.py
+app.add_middleware(DeadlineMiddleware, paths=("/predict-disease", "/predict-disease/tensor"), metrics=metrics)
+app.add_exception_handler(RequestAbandoned, abandoned_response)
+
 class PlantDetector:
     """Service for detecting if an image contains plant leaves"""
     
+    # Union of the two green hue bands (25-40 and 40-80) in OpenCV's 0-180 hue scale
+    GREEN_LOWER = np.array([25, 40, 40], dtype=np.uint8)
+    GREEN_UPPER = np.array([80, 255, 255], dtype=np.uint8)
+    
+    TEXTURE_KERNEL = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]], dtype=np.float32)
+    
     @staticmethod
-    def analyze_color_features(img: Image.Image) -> Dict[str, float]:
+    def extract_features(images: np.ndarray) -> Dict[str, np.ndarray]:
         """
-        Analyze color features to detect plant characteristics
+        Compute color and texture features for one image or a stack of images in one pass
+        
+        Color conversions run once over the whole stack viewed as one tall image.
+        Gradients and the texture filter run per image into reused float32 and
+        uint8 buffers, with OpenCV reductions, so no full-size float64
+        temporaries are allocated.
         
         Args:
-            img: PIL Image to analyze
-            
+            images: RGB uint8 array of shape (H, W, 3) or (N, H, W, 3)
+        
         Returns:
-            Dictionary with color feature scores
+            Dictionary of feature name to float array of shape (N,)
         """
-        img_array = np.array(img)
-        
-        hsv = cv2.cvtColor(img_array, cv2.COLOR_RGB2HSV)
-        
-        lower_green1 = np.array([40, 40, 40])
-        upper_green1 = np.array([80, 255, 255])
+        cv2 = import_cv2()
         
-        lower_green2 = np.array([25, 40, 40])
-        upper_green2 = np.array([40, 255, 255])
+        stack = images if images.ndim == 4 else images[np.newaxis]
+        n, height, width, _ = stack.shape
         
-        mask1 = cv2.inRange(hsv, lower_green1, upper_green1)
-        mask2 = cv2.inRange(hsv, lower_green2, upper_green2)
-        green_mask = cv2.bitwise_or(mask1, mask2)
+        tall = np.ascontiguousarray(stack, dtype=np.uint8).reshape(n * height, width, 3)
+        hsv = cv2.cvtColor(tall, cv2.COLOR_RGB2HSV)
+        gray = cv2.cvtColor(tall, cv2.COLOR_RGB2GRAY)
+        green_mask = cv2.inRange(hsv, PlantDetector.GREEN_LOWER, PlantDetector.GREEN_UPPER)
         
-        total_pixels = img_array.shape[0] * img_array.shape[1]
-        green_pixels = np.sum(green_mask > 0)
-        green_percentage = green_pixels / total_pixels
+        grad_x = np.empty((height, width), dtype=np.float32)
+        grad_y = np.empty((height, width), dtype=np.float32)
+        magnitude = np.empty((height, width), dtype=np.float32)
+        texture = np.empty((height, width), dtype=np.uint8)
         
-        saturation = hsv[:, :, 1]
-        avg_saturation = np.mean(saturation) / 255.0
-        
-        value = hsv[:, :, 2]
-        avg_value = np.mean(value) / 255.0
+        features = np.empty((5, n), dtype=np.float64)
+        for i in range(n):
+            rows = slice(i * height, (i + 1) * height)
+            features[0, i] = cv2.countNonZero(green_mask[rows])
+            _, features[1, i], features[2, i], _ = cv2.mean(hsv[rows])
+            
+            cv2.Sobel(gray[rows], cv2.CV_32F, 1, 0, dst=grad_x, ksize=3)
+            cv2.Sobel(gray[rows], cv2.CV_32F, 0, 1, dst=grad_y, ksize=3)
+            cv2.magnitude(grad_x, grad_y, magnitude=magnitude)
+            features[3, i] = cv2.mean(magnitude)[0]
+            
+            # ddepth=-1 keeps the uint8 output, which saturates negative and >255 responses
+            cv2.filter2D(gray[rows], -1, PlantDetector.TEXTURE_KERNEL, dst=texture)
+            features[4, i] = cv2.meanStdDev(texture)[1][0, 0] ** 2
         
         return {
-            'green_percentage': float(green_percentage),
-            'avg_saturation': float(avg_saturation),
-            'avg_value': float(avg_value)
+            'green_percentage': features[0] / (height * width),
+            'avg_saturation': features[1] / 255.0,
+            'avg_value': features[2] / 255.0,
+            'edge_density': features[3] / 255.0,
+            'texture_variance': features[4] / (255.0 ** 2)
         }
     
     @staticmethod
-    def analyze_texture_features(img: Image.Image) -> Dict[str, float]:
+    def score_features(features: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
         """
-        Analyze texture features that are common in plant leaves
+        Combine extracted features into per-image plant confidence scores
         
         Args:
-            img: PIL Image to analyze
-            
+            features: Output of extract_features
+        
         Returns:
-            Dictionary with texture feature scores
+            Dictionary of score name to float array of shape (N,), including plant_confidence
         """
-        gray = cv2.cvtColor(np.array(img), cv2.COLOR_RGB2GRAY)
+        green_percentage = features['green_percentage']
+        avg_saturation = features['avg_saturation']
+        
+        green_score = np.minimum(green_percentage * 2.5, 1.0)
+        saturation_score = avg_saturation
+        texture_score = np.minimum(features['edge_density'] * 3.0, 1.0)
+        brightness_score = np.minimum(features['avg_value'] * 1.5, 1.0)
         
-        grad_x = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        grad_y = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-        gradient_magnitude = np.sqrt(grad_x**2 + grad_y**2)
-        edge_density = np.mean(gradient_magnitude) / 255.0
+        plant_confidence = (
+            green_score * 0.4 +
+            saturation_score * 0.25 +
+            texture_score * 0.25 +
+            brightness_score * 0.1
+        )
         
-        kernel = np.array([[-1, -1, -1], [-1, 8, -1], [-1, -1, -1]])
-        texture_response = cv2.filter2D(gray, -1, kernel)
-        texture_variance = np.var(texture_response) / (255.0 ** 2)
+        low_color = (avg_saturation < 0.1) & (green_percentage < 0.05)
+        plant_confidence = np.where(low_color, plant_confidence * 0.3, plant_confidence)
+        plant_confidence = np.where(green_percentage < 0.02, plant_confidence * 0.5, plant_confidence)
         
         return {
-            'edge_density': float(edge_density),
-            'texture_variance': float(texture_variance)
+            'green_score': green_score,
+            'saturation_score': saturation_score,
+            'texture_score': texture_score,
+            'brightness_score': brightness_score,
+            'plant_confidence': plant_confidence
         }
     
     @staticmethod
-    def detect_plant_leaf(img: Image.Image, threshold: float = 0.6) -> Tuple[bool, float, Dict[str, Any]]:
+    def detect_plant_leaves(images: np.ndarray, threshold: float = 0.6) -> List[Tuple[bool, float, Dict[str, Any]]]:
         """
-        Detect if the image contains a plant leaf based on multiple features
+        Detect plant leaves in a stack of images with one vectorized call
         
         Args:
-            img: PIL Image to analyze
+            images: RGB uint8 array of shape (N, H, W, 3), normally at PLANT_ANALYSIS_SIZE
             threshold: Confidence threshold for plant detection
-            
+        
         Returns:
-            Tuple of (is_plant_leaf, confidence_score, analysis_details)
+            List of (is_plant_leaf, confidence_score, analysis_details), one per image
         """
-        try:
-            analysis_size = (224, 224)
-            img_resized = img.resize(analysis_size)
-            
-            color_features = PlantDetector.analyze_color_features(img_resized)
-            
-            texture_features = PlantDetector.analyze_texture_features(img_resized)
-            
-            green_score = min(color_features['green_percentage'] * 2.5, 1.0)
-            
-            saturation_score = color_features['avg_saturation']
-            
-            texture_score = min(texture_features['edge_density'] * 3.0, 1.0)
-            
-            brightness_score = min(color_features['avg_value'] * 1.5, 1.0)
-            
-            plant_confidence = (
-                green_score * 0.4 +
-                saturation_score * 0.25 +
-                texture_score * 0.25 +
-                brightness_score * 0.1
-            )
-            
-            if color_features['avg_saturation'] < 0.1 and color_features['green_percentage'] < 0.05:
-                plant_confidence *= 0.3
-            
-            if color_features['green_percentage'] < 0.02:
-                plant_confidence *= 0.5
-            
+        features = PlantDetector.extract_features(images)
+        scores = PlantDetector.score_features(features)
+        
+        results = []
+        for i in range(len(scores['plant_confidence'])):
+            plant_confidence = float(scores['plant_confidence'][i])
             is_plant = plant_confidence >= threshold
-            
             analysis_details = {
-                'color_features': color_features,
-                'texture_features': texture_features,
+                'color_features': {
+                    'green_percentage': float(features['green_percentage'][i]),
+                    'avg_saturation': float(features['avg_saturation'][i]),
+                    'avg_value': float(features['avg_value'][i])
+                },
+                'texture_features': {
+                    'edge_density': float(features['edge_density'][i]),
+                    'texture_variance': float(features['texture_variance'][i])
+                },
                 'scores': {
-                    'green_score': green_score,
-                    'saturation_score': saturation_score,
-                    'texture_score': texture_score,
-                    'brightness_score': brightness_score
+                    'green_score': float(scores['green_score'][i]),
+                    'saturation_score': float(scores['saturation_score'][i]),
+                    'texture_score': float(scores['texture_score'][i]),
+                    'brightness_score': float(scores['brightness_score'][i])
                 },
                 'plant_confidence': plant_confidence,
                 'threshold_used': threshold
             }
+            results.append((is_plant, plant_confidence, analysis_details))
+        return results
+    
+    @staticmethod
+    def detect_plant_leaf(img_array: np.ndarray, threshold: float = 0.6) -> Tuple[bool, float, Dict[str, Any]]:
+        """
+        Detect if the image contains a plant leaf based on multiple features
+        
+        Args:
+            img_array: RGB uint8 array, normally the shared buffer from ImageProcessor.ingest_image
+            threshold: Confidence threshold for plant detection
+        
+        Returns:
+            Tuple of (is_plant_leaf, confidence_score, analysis_details)
+        """
+        try:
+            if img_array.shape[:2] != PLANT_ANALYSIS_SIZE:
+                cv2 = import_cv2()
+                img_array = cv2.resize(
+                    img_array,
+                    (PLANT_ANALYSIS_SIZE[1], PLANT_ANALYSIS_SIZE[0]),
+                    interpolation=cv2.INTER_AREA
+                )
+            
+            is_plant, plant_confidence, analysis_details = PlantDetector.detect_plant_leaves(
+                img_array[np.newaxis], threshold
+            )[0]
             
             logger.info(f"Plant detection - Confidence: {plant_confidence:.3f}, Is plant: {is_plant}")
             
             return is_plant, plant_confidence, analysis_details
-            
+        
         except Exception as e:
             logger.error(f"Error in plant detection: {str(e)}")
             return True, 0.5, {'error': str(e)}
@@ -519,36 +664,103 @@ class ModelService:
     """Service for model operations"""
     
     @staticmethod
-    def load_model() -> Optional[tf.keras.Model]:
+    def load_version(path: str) -> ModelVersion:
         """
-        Load the Keras model from the specified path.
+        Load, warm up and return a model version from the specified path.
+        
+        With MODEL_BACKEND=tflite the Keras model is converted to a cached,
+        quantized TFLite artifact and the TFLite predictor is served instead.
+        
+        The input normalization is resolved here, once per version. With
+        GRAPH_PREPROCESSING the model is wrapped to take uint8 pixels and scale
+        them in-graph; otherwise prepare_image scales them on the host.
+        
+        Args:
+            path: Path of the Keras model file
         
         Returns:
-            Loaded Keras model or None if loading fails
+            ModelVersion whose info holds the model, input size and normalization
+        
+        Raises:
+            Exception: If the model cannot be loaded
         """
-        global model, input_size
+        if MODEL_BACKEND not in MODEL_BACKENDS:
+            raise ValueError(f"MODEL_BACKEND must be one of {MODEL_BACKENDS}, got '{MODEL_BACKEND}'")
         
-        try:
-            if model is None:
-                logger.info(f"Loading model from: {MODEL_PATH}")
-                model = load_model(MODEL_PATH, compile=False)
-                logger.info("Model loaded successfully")
-                model.summary()
-                
-                input_size = ModelService.detect_input_size(model)
-            return model
-        except Exception as e:
-            logger.error(f"Error loading model: {str(e)}")
-            logger.error(traceback.format_exc())
+        load_started = time.perf_counter()
+        normalization = resolve_normalization(path)
+        in_graph = graph_preprocessing_enabled()
+        
+        def load_keras_model() -> Any:
+            configure_tensorflow()
+            from tensorflow.keras.models import load_model
+            keras_model = load_model(path, compile=False)
+            return with_preprocessing(keras_model, normalization) if in_graph else keras_model
+        
+        backend = "tflite" if FAST_START else MODEL_BACKEND
+        quantization = os.environ.get("TFLITE_QUANTIZATION", "none" if FAST_START else "dynamic")
+        
+        if backend == "tflite":
+            loaded_model = load_tflite_predictor(
+                path,
+                load_keras_model,
+                quantization=quantization,
+                calibration_scale=1.0 if in_graph else 1.0 / 255.0,
+                variant=f"uint8-{normalization}" if in_graph else None
+            )
+            loaded_predictor = loaded_model
+        else:
+            logger.info(f"Loading model from: {path}")
+            loaded_model = load_keras_model()
+            if not IS_PRODUCTION:
+                loaded_model.summary()
+            loaded_predictor = build_predictor(loaded_model)
+        startup_timings["model_load"] = time.perf_counter() - load_started
+        metrics.model_load.set(startup_timings["model_load"])
+        logger.info("Model loaded successfully")
+        
+        input_size = ModelService.detect_input_size(loaded_model)
+        
+        logger.info(f"Input normalization '{normalization}' applied {'in-graph' if in_graph else 'on the host'}")
+        
+        # The new version is warm before it takes traffic
+        startup_timings["warmup"] = loaded_predictor.warmup((1, BATCH_MAX_SIZE) if BATCHING_ENABLED else (1,))
+        
+        # MODEL_VERSION names the model file deployed with the process; swapped-in files,
+        # including a MODEL_PATH replaced in place, are fingerprinted
+        return ModelVersion(
+            model_registry.deployed_version(path) or file_model_version(path, backend, quantization, normalization),
+            loaded_predictor,
+            path,
+            info={
+                "model": loaded_model,
+                "input_size": input_size,
+                "input_normalization": normalization,
+                "host_normalization": None if in_graph else normalization
+            },
+            on_close=ModelService.stop_batcher
+        )
+    
+    @staticmethod
+    def load_model() -> Optional[Any]:
+        """
+        Load the model from MODEL_PATH unless a version is serving already.
+        
+        Returns:
+            Serving Keras model or TFLite predictor, or None if loading fails
+        """
+        version = model_registry.ensure_loaded()
+        if version is None:
             return None
+        return version.info["model"]
     
     @staticmethod
-    def detect_input_size(model: tf.keras.Model) -> Tuple[int, int]:
+    def detect_input_size(model: Any) -> Tuple[int, int]:
         """
         Detect the expected input size from the model.
         
         Args:
-            model: Loaded Keras model
+            model: Loaded Keras model or TFLite predictor
             
         Returns:
             Tuple of (height, width) for the model's expected input
@@ -565,6 +777,85 @@ class ModelService:
         
         logger.info(f"Using default input size: {DEFAULT_INPUT_SIZE}")
         return DEFAULT_INPUT_SIZE
+    
+    @staticmethod
+    def get_predictor() -> Optional[Any]:
+        """
+        Get the warmed-up predictor of the serving version.
+        
+        Returns:
+            TFLite, compiled or Keras predictor depending on MODEL_BACKEND and
+            INFERENCE_MODE, or None if loading fails
+        """
+        version = model_registry.ensure_loaded()
+        if version is None:
+            return None
+        return version.predictor
+    
+    @staticmethod
+    def get_model_version() -> Optional[str]:
+        """
+        Get the version of the serving model, used to key cached predictions.
+        
+        Returns:
+            MODEL_VERSION for the deployed model file if set, otherwise a fingerprint
+            of the model file, backend and quantization; None if loading fails
+        """
+        version = model_registry.ensure_loaded()
+        if version is None:
+            return None
+        return version.version
+    
+    @staticmethod
+    def get_batcher(version: Optional[ModelVersion] = None) -> Optional[MicroBatcher]:
+        """
+        Get the micro-batcher that groups concurrent predictions into one forward pass.
+        
+        Each model version has its own batcher, so a batch never mixes two models.
+        
+        Args:
+            version: Model version, defaults to the serving one
+        
+        Returns:
+            Running MicroBatcher, or None if batching is disabled or the model failed to load
+        """
+        if not BATCHING_ENABLED:
+            return None
+        
+        version = version or model_registry.ensure_loaded()
+        if version is None:
+            return None
+        
+        with batcher_lock:
+            batcher = version.info.get("batcher")
+            if batcher is None and version.predictor is not None:
+                batcher = MicroBatcher(
+                    version.predictor,
+                    max_batch_size=BATCH_MAX_SIZE,
+                    max_wait_ms=BATCH_MAX_WAIT_MS
+                )
+                batcher.start()
+                version.info["batcher"] = batcher
+        return batcher
+    
+    @staticmethod
+    def stop_batcher(version: ModelVersion) -> None:
+        """Stop the micro-batcher of a version that no longer serves"""
+        with batcher_lock:
+            batcher = version.info.pop("batcher", None)
+        if batcher is not None:
+            batcher.stop()
+    
+    @staticmethod
+    def batcher_queue_depth() -> int:
+        """Number of predictions waiting in the serving version's micro-batcher"""
+        version = model_registry.current()
+        batcher = version.info.get("batcher") if version is not None else None
+        return batcher.queue_depth() if batcher is not None else 0
+
+# Serving model version, replaced without downtime through /admin/model/swap or SIGUSR2
+model_registry = ModelRegistry("disease", ModelService.load_version, MODEL_PATH)
+app.include_router(admin_router(model_registry))
 
 class ImageValidator:
     """Image validation service"""
@@ -584,6 +875,31 @@ class ImageValidator:
             max_size_mb = MAX_IMAGE_SIZE / (1024 * 1024)
             raise ValueError(f"Ukuran gambar melebihi batas maksimum {max_size_mb}MB")
     
+    @staticmethod
+    async def read_image_upload(file: UploadFile) -> bytes:
+        """
+        Read an uploaded image in chunks within MAX_IMAGE_SIZE.
+        
+        Reading stops as soon as the size limit is passed, and the magic bytes
+        of the first chunk must be JPEG or PNG whatever the declared MIME type.
+        
+        Args:
+            file: Uploaded image file
+            
+        Returns:
+            Bytes of the image file
+            
+        Raises:
+            ValueError: If the file is too large or not a JPEG or PNG image
+        """
+        try:
+            return await read_upload(file, MAX_IMAGE_SIZE, image_types=SUPPORTED_FORMATS)
+        except UploadTooLarge:
+            max_size_mb = MAX_IMAGE_SIZE / (1024 * 1024)
+            raise ValueError(f"Ukuran gambar melebihi batas maksimum {max_size_mb}MB")
+        except UnsupportedUpload:
+            raise ValueError("File yang diunggah bukan gambar yang valid")
+    
     @staticmethod
     def validate_mime_type(content_type: str) -> None:
         """
@@ -603,40 +919,31 @@ class ImageValidator:
             raise ValueError(f"Format gambar tidak didukung. Format yang didukung: {supported_formats}")
     
     @staticmethod
-    def validate_image_file(file_bytes: bytes) -> str:
+    def validate_image_header(img: Image.Image) -> None:
         """
-        Validate image file contents
+        Validate image dimensions from the header, before any pixels are decoded
         
         Args:
-            file_bytes: Image file bytes
-            
-        Returns:
-            Image format detected
+            img: Lazily opened PIL Image
             
         Raises:
-            ValueError: If file is not a valid image
+            ValueError: If the image has no pixels or exceeds the pixel budget
         """
-        if not file_bytes:
-            raise ValueError("File yang diunggah kosong")
-        
-        image_format = imghdr.what(None, file_bytes)
-        if not image_format:
+        width, height = img.size
+        if width <= 0 or height <= 0:
             raise ValueError("File yang diunggah bukan gambar yang valid")
         
-        try:
-            with Image.open(io.BytesIO(file_bytes)) as img:
-                img.verify()
-                return image_format
-        except Exception as e:
-            raise ValueError(f"File gambar tidak valid: {str(e)}")
+        if width * height > MAX_IMAGE_PIXELS:
+            max_megapixels = MAX_IMAGE_PIXELS / 1_000_000
+            raise ValueError(f"Resolusi gambar melebihi batas maksimum {max_megapixels:g} megapiksel")
     
     @staticmethod
-    def validate_plant_content(img: Image.Image, strict_mode: bool = True) -> Tuple[bool, Dict[str, Any]]:
+    def validate_plant_content(img_array: np.ndarray, strict_mode: bool = True) -> Tuple[bool, Dict[str, Any]]:
         """
         Validate that the image contains plant/leaf content
         
         Args:
-            img: PIL Image to validate
+            img_array: RGB uint8 array to validate
             strict_mode: Whether to use strict validation threshold
             
         Returns:
@@ -646,7 +953,7 @@ class ImageValidator:
             ValueError: If image doesn't contain plant content
         """
         threshold = 0.7 if strict_mode else 0.5
-        is_plant, confidence, details = PlantDetector.detect_plant_leaf(img, threshold)
+        is_plant, confidence, details = PlantDetector.detect_plant_leaf(img_array, threshold)
         
         if not is_plant:
             error_msg = (
@@ -661,52 +968,80 @@ class ImageProcessor:
     """Service for image processing operations"""
     
     @staticmethod
-    def read_image(file_bytes: bytes) -> Image.Image:
+    def ingest_image(file_bytes: bytes, target_size: Tuple[int, int], validate_image: bool = True) -> np.ndarray:
         """
-        Read image file bytes and convert to PIL Image.
+        Decode image bytes once, straight to the model input size.
+        
+        Only the header is parsed before the pixel budget is checked. JPEGs are
+        decoded in draft mode, which lets libjpeg scale by 1/2, 1/4 or 1/8 while
+        decoding, so a 12 MP photo never materializes at full resolution. The
+        result is the single buffer shared by plant detection and preprocessing.
         
         Args:
             file_bytes: Bytes of the image file
+            target_size: Target size (height, width)
+            validate_image: Whether decoding failures are reported as validation errors
             
         Returns:
-            PIL Image object in RGB format
+            RGB uint8 array of shape (height, width, 3)
         
         Raises:
-            ValueError: If image cannot be read or processed
+            ValueError: If image cannot be read or exceeds the pixel budget
         """
+        if not file_bytes:
+            raise ValueError("File yang diunggah kosong")
+        
         try:
-            return Image.open(io.BytesIO(file_bytes)).convert("RGB")
+            img = Image.open(io.BytesIO(file_bytes))
         except UnidentifiedImageError as e:
             logger.error(f"Image format not recognized: {str(e)}")
-            raise ValueError(f"Image format not recognized: {str(e)}")
+            raise ValueError("File yang diunggah bukan gambar yang valid")
+        
+        ImageValidator.validate_image_header(img)
+        
+        try:
+            height, width = target_size
+            img.draft("RGB", (width, height))
+            img = img.convert("RGB")
+            if img.size != (width, height):
+                img = img.resize((width, height), Image.BICUBIC, reducing_gap=3.0)
+            return np.asarray(img, dtype=np.uint8)
         except Exception as e:
             logger.error(f"Error reading image: {str(e)}")
+            if validate_image:
+                raise ValueError(f"File gambar tidak valid: {str(e)}")
             raise ValueError(f"Error reading image: {str(e)}")
     
     @staticmethod
-    def preprocess_image(img: Image.Image, target_size: Tuple[int, int]) -> List[np.ndarray]:
+    def preprocess_image(
+        img_array: np.ndarray,
+        target_size: Tuple[int, int],
+        normalization: Optional[str] = None
+    ) -> np.ndarray:
         """
-        Preprocess image for model prediction using multiple methods.
+        Preprocess image for model prediction.
         
         Args:
-            img: PIL Image to preprocess
+            img_array: RGB uint8 array, normally already at target_size
             target_size: Target size (height, width) for resizing
+            normalization: Scheme to apply on the host, or None when the model
+                normalizes in-graph and takes uint8 pixels
             
         Returns:
-            List of preprocessed image arrays using different methods
+            Image array with a batch axis of 1
         
         Raises:
             ValueError: If image cannot be preprocessed
         """
         try:
-            img = img.resize(target_size)
-            img_array = image.img_to_array(img)
+            if img_array.shape[:2] != tuple(target_size):
+                cv2 = import_cv2()
+                img_array = cv2.resize(img_array, (target_size[1], target_size[0]), interpolation=cv2.INTER_AREA)
             img_array = np.expand_dims(img_array, axis=0)
             
-            normalized = img_array / 255.0
-            mobilenet_preprocessed = preprocess_input(img_array.copy())
-            
-            return [normalized, mobilenet_preprocessed]
+            if normalization is None:
+                return img_array
+            return normalize_pixels(img_array, normalization)
         except Exception as e:
             logger.error(f"Error preprocessing image: {str(e)}")
             raise ValueError(f"Error preprocessing image: {str(e)}")
@@ -756,11 +1091,120 @@ class PredictionService:
         return class_name.replace('_', ' ')
     
     @staticmethod
-    def predict(img_array: np.ndarray, method_idx: int) -> Dict[str, Any]:
+    def class_info(class_id: int, raw_class: str) -> Dict[str, Any]:
+        """
+        Build the per-class part of a prediction response.
+        
+        Args:
+            class_id: Index of the class in the model output
+            raw_class: Original class name with underscores
+            
+        Returns:
+            Dictionary with the Indonesian and English names and treatment suggestions
+        """
+        return {
+            "class_id": class_id,
+            "prediction": PredictionService.format_class_name(raw_class),
+            "raw_class": raw_class,
+            "prediction_english": PredictionService.format_class_name_english(raw_class),
+            "suggestions": TREATMENT_SUGGESTIONS.get(raw_class, "Tidak ada saran pengobatan yang tersedia untuk penyakit ini.")
+        }
+    
+    @staticmethod
+    def run_model(version: ModelVersion, img_array: np.ndarray) -> np.ndarray:
+        """
+        Run the model on a preprocessed image, through the micro-batcher when enabled.
+        
+        Args:
+            version: Model version pinned by the request
+            img_array: Preprocessed image array with a batch axis of 1
+            
+        Returns:
+            Model output with a batch axis of 1
+        """
+        active_batcher = ModelService.get_batcher(version)
+        if active_batcher is not None:
+            return active_batcher.predict(img_array)
+        return version.predictor(img_array)
+    
+    @staticmethod
+    async def run_model_async(version: ModelVersion, img_array: np.ndarray) -> np.ndarray:
+        """
+        Await the model output for a preprocessed image without blocking the event loop
+        while the micro-batcher fills the batch.
+        
+        Args:
+            version: Model version pinned by the request
+            img_array: Preprocessed image array with a batch axis of 1
+            
+        Returns:
+            Model output with a batch axis of 1
+        
+        Raises:
+            RequestAbandoned: If the request's deadline passed or its client disconnected
+        """
+        active_batcher = ModelService.get_batcher(version)
+        if active_batcher is None:
+            return await get_executor("inference", kinds=("thread",)).run(version.predictor, img_array)
+        
+        profile = current_profile()
+        if profile is not None and profile.mode == "cprofile":
+            profile.note("Inference ran in a shared micro-batch and is not in the cProfile summary")
+        
+        # The batcher drops the sample if the deadline passes while it is queued
+        deadline = current_deadline()
+        if deadline is not None:
+            await deadline.check("batcher")
+        try:
+            output = await asyncio.wrap_future(
+                active_batcher.submit(img_array, deadline.expires_at if deadline is not None else None)
+            )
+        except SampleExpired:
+            raise deadline.exceeded("batcher")
+        return np.expand_dims(output, axis=0)
+    
+    @staticmethod
+    def build_result(preds: np.ndarray, method_idx: int, model_version: str) -> Dict[str, Any]:
+        """
+        Build the prediction response from the model output.
+        
+        Args:
+            preds: Model output with a batch axis of 1
+            method_idx: Index of preprocessing method used
+            model_version: Version of the model that produced preds
+            
+        Returns:
+            Dictionary with prediction results
+        """
+        pred_idx = int(np.argmax(preds[0]))
+        if pred_idx < len(CLASS_INFO):
+            info = CLASS_INFO[pred_idx]
+        else:
+            info = PredictionService.class_info(pred_idx, str(pred_idx))
+        
+        confidence = float(np.max(preds[0]))
+        confidence_percentage = f"{confidence * 100:.2f}%"
+        
+        logger.info(f"Prediction successful with method #{method_idx+1}")
+        
+        return {
+            "class_id": pred_idx,
+            "prediction": info["prediction"], 
+            "raw_class": info["raw_class"],
+            "confidence": confidence_percentage,
+            "preprocessing_method": method_idx+1,
+            "prediction_english": info["prediction_english"],
+            "suggestions": info["suggestions"],
+            "model_version": model_version
+        }
+    
+    @staticmethod
+    def predict(version: ModelVersion, img_array: np.ndarray, method_idx: int) -> Dict[str, Any]:
         """
         Make a prediction using the model.
         
         Args:
+            version: Model version pinned by the request
             img_array: Preprocessed image array
             method_idx: Index of preprocessing method used
             
@@ -770,47 +1214,540 @@ class PredictionService:
         Raises:
             ValueError: If prediction fails
         """
-        loaded_model = ModelService.load_model()
-        if loaded_model is None:
-            raise ValueError("Model failed to load")
+        try:
+            logger.info(f"Making prediction with method #{method_idx+1}, shape: {img_array.shape}")
+            preds = PredictionService.run_model(version, img_array)
+            return PredictionService.build_result(preds, method_idx, version.version)
+        except Exception as e:
+            logger.error(f"Error making prediction: {str(e)}")
+            raise ValueError(f"Error making prediction: {str(e)}")
+    
+    @staticmethod
+    async def predict_async(version: ModelVersion, img_array: np.ndarray, method_idx: int) -> Dict[str, Any]:
+        """
+        Make a prediction using the model, batched with concurrent requests.
         
+        Args:
+            version: Model version pinned by the request
+            img_array: Preprocessed image array
+            method_idx: Index of preprocessing method used
+            
+        Returns:
+            Dictionary with prediction results
+            
+        Raises:
+            ValueError: If prediction fails
+        """
         try:
             logger.info(f"Making prediction with method #{method_idx+1}, shape: {img_array.shape}")
+            preds = await PredictionService.run_model_async(version, img_array)
+            return PredictionService.build_result(preds, method_idx, version.version)
+        except RequestAbandoned:
+            raise
+        except Exception as e:
+            logger.error(f"Error making prediction: {str(e)}")
+            raise ValueError(f"Error making prediction: {str(e)}")
+    
+    @staticmethod
+    async def prepare_upload(
+        version: ModelVersion,
+        file_bytes: bytes,
+        validate_image: bool,
+        validate_plant: bool,
+        strict_plant_detection: bool
+    ) -> Tuple[np.ndarray, Optional[Dict[str, Any]]]:
+        """
+        Run prepare_image on the image pool and record its stage timings.
+        
+        Args:
+            version: Model version whose input size and normalization are used
+            file_bytes: Raw uploaded bytes
+            validate_image: Whether to perform comprehensive image validation
+            validate_plant: Whether to validate that the image contains plant leaves
+            strict_plant_detection: Whether to use a strict threshold for plant detection
+        
+        Returns:
+            Tuple of (preprocessed image array, plant analysis details or None)
+        
+        Raises:
+            ValueError: If the image fails validation
+        """
+        started = time.perf_counter()
+        img_array, plant_analysis, timings = await get_executor("image").run(
+            prepare_image, file_bytes, version.info["input_size"], version.info["host_normalization"],
+            validate_image, validate_plant, strict_plant_detection
+        )
+        for stage, seconds in timings.items():
+            metrics.observe_stage(stage, seconds)
+        # Waiting for a pool slot, plus pickling when the pool is a process pool
+        metrics.observe_stage("image_queue", max(time.perf_counter() - started - sum(timings.values()), 0.0))
+        return img_array, plant_analysis
+    
+    @staticmethod
+    async def predict_upload(
+        version: ModelVersion,
+        file_bytes: bytes,
+        validate_image: bool,
+        validate_plant: bool,
+        strict_plant_detection: bool
+    ) -> Dict[str, Any]:
+        """
+        Preprocess an uploaded image and predict.
+        
+        Args:
+            version: Model version pinned by the request
+            file_bytes: Raw uploaded bytes
+            validate_image: Whether to perform comprehensive image validation
+            validate_plant: Whether to validate that the image contains plant leaves
+            strict_plant_detection: Whether to use a strict threshold for plant detection
+        
+        Returns:
+            Dictionary with prediction results
+        
+        Raises:
+            ValueError: If the image fails validation
+            HTTPException: If the prediction fails
+        """
+        img_array, plant_analysis = await PredictionService.prepare_upload(
+            version, file_bytes, validate_image, validate_plant, strict_plant_detection
+        )
+        
+        try:
+            with metrics.time_stage("inference"):
+                prediction_result = await PredictionService.predict_async(
+                    version, img_array, NORMALIZATIONS.index(version.info["input_normalization"])
+                )
+        except RequestAbandoned:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Prediksi gagal: {str(e)}"
+            )
+        
+        if plant_analysis:
+            plant_confidence = plant_analysis.get('plant_confidence', 0)
+            prediction_result['plant_detection'] = {
+                'confidence': f"{plant_confidence * 100:.2f}%",
+                'validated': True
+            }
+        
+        return prediction_result
+    
+    @staticmethod
+    async def predict_tensor(version: ModelVersion, batch: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        Predict from decoded uint8 pixels at the model input size, skipping decoding and plant detection.
+        
+        A single image goes through the micro-batcher like an upload; larger
+        batches run in forward passes of up to BATCH_MAX_SIZE images.
+        
+        Args:
+            version: Model version pinned by the request
+            batch: uint8 array of shape (N, H, W, 3) matching the version's input size
+            
+        Returns:
+            Prediction result dictionaries in input order
+        
+        Raises:
+            HTTPException: If the prediction fails
+        """
+        method_idx = NORMALIZATIONS.index(version.info["input_normalization"])
+        if version.info["host_normalization"] is not None:
+            with metrics.time_stage("preprocess"):
+                batch = normalize_pixels(batch, version.info["host_normalization"])
+        
+        try:
+            if len(batch) == 1:
+                with metrics.time_stage("inference"):
+                    return [await PredictionService.predict_async(version, batch, method_idx)]
+            
+            results = []
+            for start in range(0, len(batch), BATCH_MAX_SIZE):
+                with metrics.time_stage("batch_inference"):
+                    preds = await get_executor("inference", kinds=("thread",)).run(
+                        version.predictor, batch[start:start + BATCH_MAX_SIZE]
+                    )
+                results.extend(
+                    PredictionService.build_result(preds[row:row + 1], method_idx, version.version)
+                    for row in range(len(preds))
+                )
+            return results
+        except RequestAbandoned:
+            raise
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Prediksi gagal: {str(e)}"
+            )
+
+# Per-class response fields, formatted once instead of on every prediction,
+# and the /classes body that lets compact responses carry only the class id
+CLASS_INFO = [PredictionService.class_info(class_id, raw_class) for class_id, raw_class in enumerate(CLASS_NAMES)]
+classes_response = StaticJSON({"classes": CLASS_INFO})
+
+def prepare_image(
+    file_bytes: bytes,
+    target_size: Tuple[int, int],
+    normalization: Optional[str],
+    validate_image: bool,
+    validate_plant: bool,
+    strict_plant_detection: bool
+) -> Tuple[np.ndarray, Optional[Dict[str, Any]], Dict[str, float]]:
+    """
+    Validate, decode and preprocess an uploaded image.
+    
+    The bytes are decoded once into a target-size buffer that both plant
+    detection and model preprocessing read. This is the CPU-bound part of a
+    prediction request. It runs on the image pool, so it must stay a
+    picklable module-level function.
+    
+    Args:
+        file_bytes: Uploaded image bytes
+        target_size: Model input size (height, width)
+        normalization: Scheme to apply on the host, or None to keep uint8 pixels
+        validate_image: Whether to perform comprehensive image validation
+        validate_plant: Whether to validate that the image contains plant leaves
+        strict_plant_detection: Whether to use a strict threshold for plant detection
+        
+    Returns:
+        Tuple of (preprocessed image array, plant analysis details or None,
+        seconds spent in each stage)
+        
+    Raises:
+        ValueError: If the image is invalid or does not contain a plant leaf
+    """
+    timings = {}
+    started = time.perf_counter()
+    img_array = ImageProcessor.ingest_image(file_bytes, target_size, validate_image)
+    timings["decode"] = time.perf_counter() - started
+    
+    plant_analysis = None
+    if validate_plant:
+        started = time.perf_counter()
+        is_plant, plant_analysis = ImageValidator.validate_plant_content(img_array, strict_plant_detection)
+        timings["plant_detection"] = time.perf_counter() - started
+        logger.info(f"Plant validation passed with confidence: {plant_analysis.get('plant_confidence', 'N/A')}")
+    
+    started = time.perf_counter()
+    img_array = ImageProcessor.preprocess_image(img_array, target_size, normalization)
+    timings["preprocess"] = time.perf_counter() - started
+    return img_array, plant_analysis, timings
+
+class BatchPredictionService:
+    """Service for multi-image prediction requests"""
+    
+    @staticmethod
+    def is_zip(filename: Optional[str], content_type: Optional[str]) -> bool:
+        """
+        Check whether an uploaded part is a zip archive of images.
+        
+        Args:
+            filename: Uploaded file name
+            content_type: MIME type of the upload
             
-            preds = loaded_model.predict(img_array)
-            pred_idx = np.argmax(preds[0])
+        Returns:
+            True if the upload should be expanded as a zip archive
+        """
+        return content_type in ZIP_FORMATS or (filename or "").lower().endswith(".zip")
+    
+    @staticmethod
+    def iter_zip_images(archive: Any, archive_name: str, max_images: int) -> Iterator[Tuple[str, Optional[str], Any]]:
+        """
+        Iterate over the images in a zip archive, reading one member at a time.
+        
+        Args:
+            archive: Seekable file object containing the zip archive
+            archive_name: Name of the archive, used as a prefix in result file names
+            max_images: Largest number of members to yield; the archive's
+                remaining members are reported as one error
             
-            raw_class = CLASS_NAMES[pred_idx] if pred_idx < len(CLASS_NAMES) else str(pred_idx)
-            formatted_class = PredictionService.format_class_name(raw_class)
+        Yields:
+            Tuple of (file name, MIME type, image bytes or ValueError)
+        """
+        try:
+            with zipfile.ZipFile(archive) as zf:
+                images = 0
+                for info in zf.infolist():
+                    name = info.filename
+                    if info.is_dir() or name.startswith("__MACOSX/") or os.path.basename(name).startswith("."):
+                        continue
+                    
+                    if images >= max_images:
+                        yield archive_name, None, ValueError(TOO_MANY_IMAGES)
+                        return
+                    images += 1
+                    
+                    content_type = mimetypes.guess_type(name)[0]
+                    display_name = f"{archive_name}/{name}"
+                    if info.file_size > MAX_IMAGE_SIZE:
+                        max_size_mb = MAX_IMAGE_SIZE / (1024 * 1024)
+                        yield display_name, content_type, ValueError(f"Ukuran gambar melebihi batas maksimum {max_size_mb}MB")
+                        continue
+                    
+                    with zf.open(info) as member:
+                        yield display_name, content_type, member.read(MAX_IMAGE_SIZE + 1)
+        except zipfile.BadZipFile as e:
+            yield archive_name, None, ValueError(f"Arsip zip tidak valid: {str(e)}")
+    
+    @staticmethod
+    def iter_uploaded_images(uploads: List[Any]) -> Iterator[Tuple[str, Optional[str], Any]]:
+        """
+        Iterate over uploaded images, expanding zip archives.
+        
+        Only one image is held in memory at a time; multipart uploads are
+        spooled to disk by the form parser. At most BATCH_ENDPOINT_MAX_FILES
+        images are read, zip members included; the first one past the limit
+        is reported as an error and ends the iteration.
+        
+        Args:
+            uploads: Uploaded files from the multipart form
             
-            confidence = float(np.max(preds[0]))
-            confidence_percentage = f"{confidence * 100:.2f}%"
+        Yields:
+            Tuple of (file name, MIME type, image bytes or ValueError)
+        """
+        remaining = BATCH_ENDPOINT_MAX_FILES
+        for upload in uploads:
+            filename = upload.filename or "unknown"
+            if remaining <= 0:
+                yield filename, upload.content_type, ValueError(TOO_MANY_IMAGES)
+                return
+            if BatchPredictionService.is_zip(upload.filename, upload.content_type):
+                for item in BatchPredictionService.iter_zip_images(upload.file, filename, remaining):
+                    remaining -= 1
+                    yield item
+                # The archive went past the limit and ended with its error
+                if remaining < 0:
+                    return
+            else:
+                remaining -= 1
+                upload.file.seek(0)
+                yield filename, upload.content_type, upload.file.read(MAX_IMAGE_SIZE + 1)
+    
+    @staticmethod
+    def take_chunk(
+        images: Iterator[Tuple[int, Tuple[str, Optional[str], Any]]],
+        size: int
+    ) -> List[Tuple[int, str, Optional[str], Any]]:
+        """
+        Read the next images of a batch request.
+        
+        Reading spooled uploads and inflating zip members blocks, so this runs
+        on the thread-only upload pool; the open files cannot be sent to an
+        image process pool.
+        
+        Args:
+            images: Enumerated iter_uploaded_images of the request
+            size: Largest number of images to read
             
-            suggestions = TREATMENT_SUGGESTIONS.get(raw_class, "Tidak ada saran pengobatan yang tersedia untuk penyakit ini.")
+        Returns:
+            Tuples of (index, file name, MIME type, image bytes or ValueError),
+            empty once every image was read
+        """
+        return [
+            (index, filename, content_type, file_bytes)
+            for index, (filename, content_type, file_bytes) in itertools.islice(images, size)
+        ]
+    
+    @staticmethod
+    def error_line(index: int, filename: str, error: Exception) -> Dict[str, Any]:
+        """
+        Build the NDJSON result for an image that failed.
+        
+        Args:
+            index: Position of the image in the request
+            filename: Image file name
+            error: Validation or processing error
             
-            logger.info(f"Prediction successful with method #{method_idx+1}")
+        Returns:
+            Dictionary with the error details
+        """
+        is_client_error = isinstance(error, ValueError)
+        if not is_client_error:
+            logger.error(f"Unexpected error for batch image {filename}: {str(error)}")
+        return {
+            "index": index,
+            "filename": filename,
+            "status": "error",
+            "status_code": status.HTTP_400_BAD_REQUEST if is_client_error else status.HTTP_500_INTERNAL_SERVER_ERROR,
+            "detail": str(error)
+        }
+    
+    @staticmethod
+    async def prepare(
+        version: ModelVersion,
+        content_type: Optional[str],
+        file_bytes: Any,
+        validate_image: bool,
+        validate_plant: bool,
+        strict_plant_detection: bool
+    ) -> Tuple[np.ndarray, Optional[Dict[str, Any]]]:
+        """
+        Validate and preprocess one image of a batch on the image pool.
+        
+        Args:
+            version: Model version pinned by the batch request
+            content_type: Declared MIME type of the image
+            file_bytes: Image bytes, or the error raised while reading them
+            validate_image: Whether to perform comprehensive image validation
+            validate_plant: Whether to validate that the image contains plant leaves
+            strict_plant_detection: Whether to use a strict threshold for plant detection
+        
+        Returns:
+            Tuple of (preprocessed image array, plant analysis details or None)
+        
+        Raises:
+            ValueError: If the image is invalid
+        """
+        if isinstance(file_bytes, Exception):
+            raise file_bytes
+        ImageValidator.validate_mime_type(content_type or "")
+        ImageValidator.validate_image_size(len(file_bytes))
+        return await PredictionService.prepare_upload(
+            version, file_bytes, validate_image, validate_plant, strict_plant_detection
+        )
+    
+    @staticmethod
+    async def predict_chunk(
+        version: ModelVersion,
+        prepared: List[Tuple[int, str, np.ndarray, Optional[Dict[str, Any]]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Run one forward pass over a chunk of preprocessed images.
+        
+        Args:
+            version: Model version pinned by the batch request
+            prepared: Tuples of (index, file name, preprocessed array, plant analysis)
             
-            return {
-                "prediction": formatted_class, 
-                "raw_class": raw_class,
-                "confidence": confidence_percentage,
-                "preprocessing_method": method_idx+1,
-                "prediction_english": PredictionService.format_class_name_english(raw_class),
-                "suggestions": suggestions
-            }
-        except Exception as e:
-            logger.error(f"Error making prediction: {str(e)}")
-            raise ValueError(f"Error making prediction: {str(e)}")
+        Returns:
+            NDJSON result dictionaries in chunk order
+        """
+        method_idx = NORMALIZATIONS.index(version.info["input_normalization"])
+        batch = np.concatenate([img_array for _, _, img_array, _ in prepared])
+        with metrics.time_stage("batch_inference"):
+            preds = await get_executor("inference", kinds=("thread",)).run(version.predictor, batch)
+        
+        results = []
+        for row, (index, filename, _, plant_analysis) in enumerate(prepared):
+            result = PredictionService.build_result(preds[row:row + 1], method_idx, version.version)
+            if plant_analysis:
+                result['plant_detection'] = {
+                    'confidence': f"{plant_analysis.get('plant_confidence', 0) * 100:.2f}%",
+                    'validated': True
+                }
+            results.append({"index": index, "filename": filename, "status": "ok", **result})
+        return results
+    
+    @staticmethod
+    async def stream_predictions(
+        version: ModelVersion,
+        uploads: List[Any],
+        validate_image: bool,
+        validate_plant: bool,
+        strict_plant_detection: bool
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Validate, preprocess and classify uploaded images in chunks of BATCH_MAX_SIZE.
+        
+        Validation errors are yielded as soon as they are known; predictions
+        are yielded after each chunk's forward pass. At most one chunk of
+        images is held in memory.
+        
+        Args:
+            version: Model version used for every image of the request
+            uploads: Uploaded files from the multipart form
+            validate_image: Whether to perform comprehensive image validation
+            validate_plant: Whether to validate that images contain plant leaves
+            strict_plant_detection: Whether to use a strict threshold for plant detection
+            
+        Yields:
+            NDJSON result dictionaries, followed by a summary
+        """
+        images = enumerate(BatchPredictionService.iter_uploaded_images(uploads))
+        succeeded = failed = 0
+        
+        while True:
+            chunk = await get_executor("upload", kinds=("thread",)).run(
+                BatchPredictionService.take_chunk, images, BATCH_MAX_SIZE
+            )
+            if not chunk:
+                break
+            
+            async def prepare_one(item):
+                index, filename, content_type, file_bytes = item
+                try:
+                    img_array, plant_analysis = await BatchPredictionService.prepare(
+                        version, content_type, file_bytes, validate_image, validate_plant, strict_plant_detection
+                    )
+                    return index, filename, img_array, plant_analysis, None
+                except Exception as e:
+                    return index, filename, None, None, e
+            
+            prepared = []
+            for task in asyncio.as_completed([prepare_one(item) for item in chunk]):
+                index, filename, img_array, plant_analysis, error = await task
+                if error is not None:
+                    failed += 1
+                    yield BatchPredictionService.error_line(index, filename, error)
+                else:
+                    prepared.append((index, filename, img_array, plant_analysis))
+            del chunk
+            
+            if not prepared:
+                continue
+            
+            prepared.sort(key=lambda item: item[0])
+            try:
+                results = await BatchPredictionService.predict_chunk(version, prepared)
+            except Exception as e:
+                for index, filename, _, _ in prepared:
+                    failed += 1
+                    yield BatchPredictionService.error_line(index, filename, e)
+                continue
+            
+            for result in results:
+                succeeded += 1
+                yield result
+        
+        yield {"summary": {"total": succeeded + failed, "succeeded": succeeded, "failed": failed}}
+
+def preload_model() -> None:
+    """
+    Load the model in the prefork parent (common/runner.py) so workers share it.
+    
+    Only TFLite models survive the fork; with the Keras backend each worker
+    loads its own copy on startup.
+    """
+    backend = "tflite" if FAST_START else MODEL_BACKEND
+    if backend in FORK_SAFE_BACKENDS:
+        # Also re-run by the runner on SIGUSR2, so workers forked later start with the new model
+        model_registry.load()
+    else:
+        logger.info(f"Backend '{backend}' is not fork-safe, each worker loads its own model")
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize model when application starts"""
     try:
         ModelService.load_model()
+        ModelService.get_batcher()
+        model_registry.install_signal_handler()
+        startup_timings["total"] = time.perf_counter() - IMPORT_STARTED
+        logger.info(
+            "Startup timing: " + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in startup_timings.items())
+        )
         logger.info("API started successfully")
     except Exception as e:
         logger.error(f"Error during startup: {str(e)}")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the micro-batcher and worker pools when application stops"""
+    version = model_registry.current()
+    if version is not None:
+        ModelService.stop_batcher(version)
+    shutdown_executors()
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request, exc):
     """Handle validation errors"""
@@ -832,12 +1769,60 @@ def root() -> Dict[str, str]:
         return {"message": "PERINGATAN: Model gagal dimuat. API tidak berfungsi penuh."}
     return {"message": "API Klasifikasi Penyakit Tanaman berjalan dengan deteksi tanaman yang diaktifkan."}
 
+@app.get("/stats/batching")
+def batching_stats() -> Dict[str, Any]:
+    """
+    Micro-batching statistics endpoint.
+    
+    Returns:
+        Dictionary with batch-size distribution and queue-wait statistics
+    """
+    if not BATCHING_ENABLED:
+        return {"enabled": False}
+    
+    active_batcher = ModelService.get_batcher()
+    if active_batcher is None:
+        return {"enabled": True, "message": "Model gagal dimuat"}
+    return {"enabled": True, **active_batcher.stats()}
+
+@app.get("/stats/cache")
+def cache_stats() -> Dict[str, Any]:
+    """
+    Prediction cache statistics endpoint.
+    
+    Returns:
+        Dictionary with cache size and hit/miss/coalesced counters
+    """
+    return prediction_cache.stats()
+
+@app.get("/classes")
+def classes(request: Request) -> Response:
+    """
+    Class metadata endpoint.
+    
+    Returns:
+        All classes with their Indonesian and English names and treatment
+        suggestions, with an ETag and long-lived cache headers (304 when unchanged)
+    """
+    return classes_response.response(request)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint() -> Response:
+    """
+    Prometheus metrics endpoint.
+    
+    Returns:
+        Request counts, stage latencies, queue depths and model load time in the Prometheus text format
+    """
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
 @app.post("/predict-disease")
 async def predict(
     file: UploadFile = File(...),
     validate_image: bool = Query(True, description="Whether to perform comprehensive image validation"),
     validate_plant: bool = Query(True, description="Whether to validate that image contains plant leaves"),
-    strict_plant_detection: bool = Query(True, description="Whether to use strict plant detection threshold")
+    strict_plant_detection: bool = Query(True, description="Whether to use strict plant detection threshold"),
+    compact: bool = Query(False, description="Return only class_id, confidence and model_version, see /classes")
 ) -> JSONResponse:
     """
     Predicts plant diseases from the uploaded image.
@@ -847,6 +1832,7 @@ async def predict(
         validate_image: Whether to perform comprehensive image validation.
         validate_plant: Whether to validate that the image contains plant leaves.
         strict_plant_detection: Whether to use a strict threshold for plant detection.
+        compact: Whether to leave out the class metadata served by /classes.
 
     Returns:
         JSONResponse with the prediction results.
@@ -864,46 +1850,32 @@ async def predict(
     try:
         ImageValidator.validate_mime_type(file.content_type)
         
-        file_bytes = await file.read()
-        
-        ImageValidator.validate_image_size(len(file_bytes))
-        
-        if validate_image:
-            image_format = ImageValidator.validate_image_file(file_bytes)
-            logger.info(f"Image validated successfully, format: {image_format}")
-        
-        img = ImageProcessor.read_image(file_bytes)
-        
-        plant_analysis = None
-        if validate_plant:
-            is_plant, plant_analysis = ImageValidator.validate_plant_content(img, strict_plant_detection)
-            logger.info(f"Plant validation passed with confidence: {plant_analysis.get('plant_confidence', 'N/A')}")
-        
-        preprocessed_images = ImageProcessor.preprocess_image(img, input_size)
+        with metrics.time_stage("read"):
+            file_bytes = await ImageValidator.read_image_upload(file)
         
-        last_error = None
-        for i, img_array in enumerate(preprocessed_images):
-            try:
-                prediction_result = PredictionService.predict(img_array, i)
-                
-                if plant_analysis:
-                    plant_confidence = plant_analysis.get('plant_confidence', 0)
-                    prediction_result['plant_detection'] = {
-                        'confidence': f"{plant_confidence * 100:.2f}%",
-                        'validated': True
-                    }
-                
-                return JSONResponse(content=prediction_result)
-            except Exception as e:
-                last_error = str(e)
-                logger.error(f"Preprocessing method #{i+1} failed: {last_error}")
-                continue
+        # The whole prediction uses one model version, even if a swap happens meanwhile
+        with model_registry.acquire() as version:
+            cache_key = PredictionCache.make_key(
+                file_bytes,
+                version.version,
+                validate_image=validate_image,
+                validate_plant=validate_plant,
+                strict_plant_detection=strict_plant_detection
+            )
+            prediction_result, cache_status = await prediction_cache.get_or_compute(
+                cache_key,
+                lambda: PredictionService.predict_upload(
+                    version, file_bytes, validate_image, validate_plant, strict_plant_detection
+                )
+            )
         
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
-            detail=f"Semua metode preprocessing gagal. Error terakhir: {last_error}"
+        return JSONResponse(
+            content=compact_result(prediction_result) if compact else prediction_result,
+            headers={"X-Cache": cache_status.upper()}
         )
         
+    except RequestAbandoned:
+        raise
     except ValueError as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, 
@@ -916,3 +1888,175 @@ async def predict(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, 
             detail=f"Prediksi gagal: {str(e)}"
         )
+
+@app.post("/predict-disease/tensor")
+async def predict_tensor(
+    request: Request,
+    compact: bool = Query(False, description="Return only class_id, confidence and model_version, see /classes")
+) -> JSONResponse:
+    """
+    Predicts plant diseases from raw uint8 RGB pixels at the model input size.
+    
+    For clients that already hold decoded frames: the body is a .npy file
+    (application/x-npy) or the RGB8 binary format (application/octet-stream)
+    described in common/tensors.py, with shape (H, W, 3) or (N, H, W, 3).
+    There is no image decoding, resizing or plant detection.
+    
+    Args:
+        request: The incoming request.
+        compact: Whether to leave out the class metadata served by /classes.
+    
+    Returns:
+        JSONResponse with the prediction result for a single image, or
+        {"predictions": [...]} in input order for a batch.
+    
+    Raises:
+        HTTPException: If the model is unavailable or the tensor is invalid.
+    """
+    if ModelService.load_model() is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+            detail="Model gagal dimuat. Silakan periksa log server."
+        )
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in TENSOR_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Gunakan application/x-npy atau application/octet-stream"
+        )
+    
+    with model_registry.acquire() as version:
+        input_size = version.info["input_size"]
+        try:
+            with metrics.time_stage("read"):
+                body = await read_body(request, tensor_body_limit(TENSOR_MAX_BATCH, input_size))
+            batch, batched = parse_tensor(body, content_type, input_size, TENSOR_MAX_BATCH)
+        except UploadTooLarge:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Tensor melebihi {TENSOR_MAX_BATCH} gambar berukuran {input_size[0]}x{input_size[1]}"
+            )
+        except InvalidTensor as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        
+        results = await PredictionService.predict_tensor(version, batch)
+    
+    if compact:
+        results = [compact_result(result) for result in results]
+    
+    return JSONResponse(content={"predictions": results} if batched else results[0])
+
+@app.post(
+    "/predict-disease/batch",
+    response_class=StreamingResponse,
+    openapi_extra={
+        "requestBody": {
+            "content": {
+                "multipart/form-data": {
+                    "schema": {
+                        "type": "object",
+                        "properties": {
+                            "files": {"type": "array", "items": {"type": "string", "format": "binary"}}
+                        },
+                        "required": ["files"]
+                    }
+                },
+                "application/zip": {"schema": {"type": "string", "format": "binary"}}
+            },
+            "required": True
+        }
+    }
+)
+async def predict_batch(
+    request: Request,
+    validate_image: bool = Query(True, description="Whether to perform comprehensive image validation"),
+    validate_plant: bool = Query(True, description="Whether to validate that images contain plant leaves"),
+    strict_plant_detection: bool = Query(True, description="Whether to use strict plant detection threshold"),
+    compact: bool = Query(False, description="Return only class_id, confidence and model_version per image, see /classes")
+) -> StreamingResponse:
+    """
+    Predicts plant diseases for many images in one request.
+    
+    Accepts multipart uploads in the "files" field (images and/or zip archives
+    of images) or a zip archive as the raw request body. Results stream back
+    as NDJSON, one line per image in completion order, each with its index in
+    the request. Invalid images produce an error line instead of failing the
+    whole request. The last line is a summary.
+
+    Args:
+        request: The incoming request.
+        validate_image: Whether to perform comprehensive image validation.
+        validate_plant: Whether to validate that images contain plant leaves.
+        strict_plant_detection: Whether to use a strict threshold for plant detection.
+        compact: Whether to leave out the class metadata served by /classes.
+
+    Returns:
+        StreamingResponse with application/x-ndjson results.
+
+    Raises:
+        HTTPException: If the model is unavailable or the request body is invalid.
+    """
+    if ModelService.load_model() is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, 
+            detail="Model gagal dimuat. Silakan periksa log server."
+        )
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    
+    if content_type in ZIP_FORMATS:
+        archive = tempfile.SpooledTemporaryFile(max_size=MAX_IMAGE_SIZE)
+        received = 0
+        async for chunk in request.stream():
+            received += len(chunk)
+            if received > BATCH_ENDPOINT_MAX_UPLOAD_SIZE:
+                archive.close()
+                raise HTTPException(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    detail=f"Ukuran arsip melebihi batas maksimum {BATCH_ENDPOINT_MAX_UPLOAD_SIZE / (1024 * 1024)}MB"
+                )
+            archive.write(chunk)
+        archive.seek(0)
+        uploads = [UploadFile(archive, filename="upload.zip", headers=Headers({"content-type": content_type}))]
+        close_uploads = archive.close
+    elif content_type == "multipart/form-data":
+        # The form is parsed here rather than through File(...) so the spooled
+        # files stay open while the response streams.
+        form = await request.form(max_files=BATCH_ENDPOINT_MAX_FILES)
+        uploads = [item for item in form.getlist("files") if not isinstance(item, str)]
+        close_uploads = form.close
+        if not uploads:
+            await form.close()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Tidak ada file pada field 'files'"
+            )
+    else:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Gunakan multipart/form-data dengan field 'files' atau application/zip"
+        )
+    
+    async def ndjson_lines() -> AsyncIterator[bytes]:
+        try:
+            with model_registry.acquire() as version:
+                async for result in BatchPredictionService.stream_predictions(
+                    version, uploads, validate_image, validate_plant, strict_plant_detection
+                ):
+                    if compact and result.get("status") == "ok":
+                        result = {
+                            "index": result["index"],
+                            "filename": result["filename"],
+                            "status": "ok",
+                            **compact_result(result)
+                        }
+                    yield (json.dumps(result) + "\n").encode("utf-8")
+        finally:
+            result = close_uploads()
+            if asyncio.iscoroutine(result):
+                await result
+    
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
+
+startup_timings["imports"] = time.perf_counter() - IMPORT_STARTED
@@ -0,0 +1,248 @@
+"""
+Dynamic micro-batching for model inference
+
+Concurrent prediction requests are collected into a single batch and run
+through the model in one forward pass. Each caller receives its own row of
+the batched output through a future. Samples whose deadline passed while
+they were queued are dropped before the batch is built.
+"""
+
+import threading
+import time
+import logging
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+class SampleExpired(Exception):
+    """The sample's deadline passed before it was batched, so it was not run"""
+
+class MicroBatcher:
+    """Collects single-sample requests into batches for one forward pass"""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 16,
+        max_wait_ms: float = 5.0,
+        stats_window: int = 1000
+    ):
+        """
+        Create a micro-batcher around a batched predict function.
+
+        Args:
+            predict_fn: Function that maps an (N, ...) input array to an (N, ...) output array
+            max_batch_size: Maximum number of samples run in a single forward pass
+            max_wait_ms: Maximum time the first queued sample waits for the batch to fill
+            stats_window: Number of recent batches kept for queue-wait statistics
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+
+        self._queue: Deque[Tuple[np.ndarray, Future, float, Optional[float]]] = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        self._stats_lock = threading.Lock()
+        self._batch_count = 0
+        self._request_count = 0
+        self._expired_count = 0
+        self._batch_size_counts: Dict[int, int] = {}
+        self._recent_waits: Deque[float] = deque(maxlen=stats_window)
+        self._recent_inference: Deque[float] = deque(maxlen=stats_window)
+
+    def start(self) -> None:
+        """Start the background batching thread if it is not running yet"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+            self._thread.start()
+        logger.info(
+            f"Micro-batcher started (max_batch_size={self.max_batch_size}, "
+            f"max_wait_ms={self.max_wait * 1000:.1f})"
+        )
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Stop the batching thread. Requests still queued are failed.
+
+        Args:
+            timeout: Seconds to wait for the batching thread to exit
+        """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+        with self._condition:
+            while self._queue:
+                _, future, _, _ = self._queue.popleft()
+                if not future.done():
+                    future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    def submit(self, sample: np.ndarray, expires_at: Optional[float] = None) -> Future:
+        """
+        Queue a single sample for batched prediction.
+
+        Args:
+            sample: Input array for one sample, with or without a leading batch axis of 1
+            expires_at: time.monotonic() after which the sample is dropped
+                instead of run, failing the future with SampleExpired
+
+        Returns:
+            Future resolving to the model output row for this sample
+        """
+        if sample.ndim > 0 and sample.shape[0] == 1:
+            sample = sample[0]
+
+        future: Future = Future()
+        with self._condition:
+            if not self._running:
+                raise RuntimeError("Micro-batcher is not running")
+            self._queue.append((sample, future, time.perf_counter(), expires_at))
+            self._condition.notify()
+        return future
+
+    def predict(self, sample: np.ndarray, timeout: Optional[float] = None) -> np.ndarray:
+        """
+        Blocking helper that submits a sample and waits for its output row.
+
+        Args:
+            sample: Input array for one sample
+            timeout: Maximum seconds to wait for the result
+
+        Returns:
+            Model output for the sample with a leading batch axis of 1
+        """
+        return np.expand_dims(self.submit(sample).result(timeout), axis=0)
+
+    def queue_depth(self) -> int:
+        """Number of samples currently waiting to be batched"""
+        with self._condition:
+            return len(self._queue)
+
+    def _collect_batch(self) -> List[Tuple[np.ndarray, Future, float, Optional[float]]]:
+        """Wait for the first sample, then fill the batch until it is full or max_wait expires"""
+        with self._condition:
+            while self._running and not self._queue:
+                self._condition.wait()
+            if not self._running:
+                return []
+
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or not self._running:
+                    break
+                self._condition.wait(remaining)
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch_size:
+                batch.append(self._queue.popleft())
+            return batch
+
+    def _run(self) -> None:
+        """Batching loop executed on the background thread"""
+        while True:
+            batch = self._collect_batch()
+            if not batch:
+                if not self._running:
+                    return
+                continue
+
+            batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+            now = time.monotonic()
+            expired = [item for item in batch if item[3] is not None and item[3] <= now]
+            if expired:
+                for _, future, _, _ in expired:
+                    future.set_exception(SampleExpired("Deadline passed while the sample was queued"))
+                batch = [item for item in batch if item[3] is None or item[3] > now]
+                with self._stats_lock:
+                    self._expired_count += len(expired)
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            waits = [started - enqueued for _, _, enqueued, _ in batch]
+
+            try:
+                inputs = np.stack([sample for sample, _, _, _ in batch])
+                outputs = np.asarray(self.predict_fn(inputs))
+                if outputs.shape[0] != len(batch):
+                    raise ValueError(
+                        f"Model returned {outputs.shape[0]} outputs for a batch of {len(batch)}"
+                    )
+                for i, (_, future, _, _) in enumerate(batch):
+                    future.set_result(outputs[i])
+            except Exception as e:
+                logger.error(f"Batched prediction failed for {len(batch)} samples: {str(e)}")
+                logger.error(traceback.format_exc())
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            self._record(len(batch), waits, time.perf_counter() - started)
+
+    def _record(self, batch_size: int, waits: List[float], inference_time: float) -> None:
+        """Update batch-size and queue-wait statistics"""
+        with self._stats_lock:
+            self._batch_count += 1
+            self._request_count += batch_size
+            self._batch_size_counts[batch_size] = self._batch_size_counts.get(batch_size, 0) + 1
+            self._recent_waits.extend(waits)
+            self._recent_inference.append(inference_time)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Report batching statistics for tuning max_batch_size and max_wait_ms.
+
+        Returns:
+            Dictionary with batch-size distribution and queue-wait percentiles in milliseconds
+        """
+        with self._stats_lock:
+            waits_ms = np.array(self._recent_waits, dtype=np.float64) * 1000.0
+            inference_ms = np.array(self._recent_inference, dtype=np.float64) * 1000.0
+            batch_count = self._batch_count
+            request_count = self._request_count
+            expired_count = self._expired_count
+            size_counts = dict(sorted(self._batch_size_counts.items()))
+
+        def percentiles(values: np.ndarray) -> Dict[str, float]:
+            if values.size == 0:
+                return {"mean": 0.0, "p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            return {
+                "mean": round(float(values.mean()), 3),
+                "p50": round(float(p50), 3),
+                "p95": round(float(p95), 3),
+                "p99": round(float(p99), 3),
+                "max": round(float(values.max()), 3)
+            }
+
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": batch_count,
+            "requests": request_count,
+            "expired": expired_count,
+            "avg_batch_size": round(request_count / batch_count, 3) if batch_count else 0.0,
+            "batch_size_distribution": {str(size): count for size, count in size_counts.items()},
+            "queue_depth": self.queue_depth(),
+            "queue_wait_ms": percentiles(waits_ms),
+            "inference_ms": percentiles(inference_ms)
+        }
@@ -7,17 +7,22 @@ import logging
 import traceback
 import os
 from .app import app
+from common.runner import serve
 
 logger = logging.getLogger(__name__)
 
-def run_server(host: str = "0.0.0.0", port: int = None, reload: bool = False):
+def run_server(host: str = "0.0.0.0", port: int = None, reload: bool = False, workers: int = None):
     """
     Run the FastAPI server with the specified host and port.
     
+    Without reload the model is loaded once and shared by forked workers,
+    see common/runner.py.
+    
     Args:
         host: Host address to bind the server to
         port: Port to run the server on
         reload: Whether to enable auto-reload for development
+        workers: Number of worker processes, defaults to WEB_CONCURRENCY or the CPU count
     
     Raises:
         Exception: If server fails to start
@@ -26,7 +31,10 @@ def run_server(host: str = "0.0.0.0", port: int = None, reload: bool = False):
         port = int(os.environ.get("PORT", 9000)) if port is None else port
         
         logger.info(f"Starting server on {host}:{port} (reload={reload})")
-        uvicorn.run("api.app:app", host=host, port=port, reload=reload)
+        if reload:
+            uvicorn.run("api.app:app", host=host, port=port, reload=reload)
+        else:
+            serve("api.app:app", host=host, port=port, workers=workers, preload="api.app:preload_model")
     except Exception as e:
         logger.error(f"Failed to start server: {str(e)}")
         logger.error(traceback.format_exc())
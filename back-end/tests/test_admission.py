@@ -0,0 +1,84 @@
+"""
+Admission control: requests within max_concurrent + max_queue are never shed
+
+Run from back-end/:
+
+    python -m pytest tests
+"""
+
+import os
+import sys
+import asyncio
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.admission import AdmissionController, Overloaded
+
+async def admitted(controller: AdmissionController, work: float) -> str:
+    """One request: take a slot, work, release; the outcome as "ok" or the shed reason"""
+    try:
+        await controller.acquire()
+    except Overloaded as e:
+        return e.reason
+    try:
+        await asyncio.sleep(work)
+    finally:
+        controller.release()
+    return "ok"
+
+def test_full_capacity_in_flight_is_not_shed():
+    async def run():
+        controller = AdmissionController(4, max_queue=4, queue_timeout=5.0)
+        in_flight = asyncio.Semaphore(controller.max_concurrent + controller.max_queue)
+
+        async def request():
+            async with in_flight:
+                return await admitted(controller, 0.005)
+
+        outcomes = await asyncio.gather(*(request() for _ in range(64)))
+        return outcomes, controller.stats()
+
+    outcomes, stats = asyncio.run(run())
+    assert outcomes.count("ok") == len(outcomes), outcomes
+    assert stats["active"] == 0 and stats["waiting"] == 0
+
+def test_requests_beyond_the_queue_are_shed():
+    async def run():
+        controller = AdmissionController(2, max_queue=1, queue_timeout=5.0)
+        return await asyncio.gather(*(admitted(controller, 0.05) for _ in range(5)))
+
+    outcomes = asyncio.run(run())
+    assert sorted(outcomes) == ["ok", "ok", "ok", "queue_full", "queue_full"]
+
+def test_queue_timeout():
+    async def run():
+        controller = AdmissionController(1, max_queue=1, queue_timeout=0.01)
+        return await asyncio.gather(admitted(controller, 0.1), admitted(controller, 0.1))
+
+    assert asyncio.run(run()) == ["ok", "queue_timeout"]
+
+def test_cancelled_waiter_passes_its_slot_on():
+    async def run():
+        controller = AdmissionController(1, max_queue=2, queue_timeout=5.0)
+        await controller.acquire()
+        first = asyncio.ensure_future(controller.acquire())
+        second = asyncio.ensure_future(controller.acquire())
+        await asyncio.sleep(0)
+
+        # The slot is handed to the first waiter, which is cancelled before it resumes.
+        # Depending on the Python version wait_for either raises or returns the slot.
+        controller.release()
+        first.cancel()
+        try:
+            await first
+            controller.release()
+        except asyncio.CancelledError:
+            pass
+        await asyncio.wait_for(second, 1.0)
+        stats = controller.stats()
+        controller.release()
+        return stats, controller.stats()
+
+    held, idle = asyncio.run(run())
+    assert held["active"] == 1 and held["waiting"] == 0
+    assert idle["active"] == 0 and idle["waiting"] == 0
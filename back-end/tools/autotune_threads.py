@@ -0,0 +1,219 @@
+"""
+Find the worker, thread and batch-size configuration with the best throughput
+
+Sweeps combinations of runner workers (WEB_CONCURRENCY), TensorFlow intra-op
+threads per worker (TF_INTRA_OP_THREADS) and micro-batch size
+(BATCH_MAX_SIZE) on this machine. For each combination it starts that many
+worker processes, configured through common/threads.py the same way the
+services are, runs back-to-back forward passes on synthetic inputs for
+--duration seconds, and records throughput and forward-pass latency. The
+recommended configuration is the one with the highest throughput whose p95
+latency stays within --slo-ms:
+
+    python tools/autotune_threads.py --model plant-disease-classification/keras_model/best_model.h5 \\
+        --workers 1 2 4 --threads 1 2 4 --batch-sizes 1 4 16 --slo-ms 250
+
+Run from back-end/ on the machine (or instance type) that serves traffic,
+with nothing else running. Combinations with more busy threads than twice
+the available cores are skipped. --backend tflite measures the cached TFLite
+artifact of the model (converted first if needed), with TFLITE_THREADS
+following the thread count.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.threads import BLAS_VARIABLES, available_cpus
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def load_predictor(model_path: str, backend: str, quantization: str) -> Any:
+    """Load a model the way the services serve it, with uint8 input for image models"""
+    from common.inference import build_predictor
+    from common.preprocessing import resolve_normalization, with_preprocessing
+    from common.threads import configure_tensorflow
+    from common.tflite import load_tflite_predictor
+
+    configure_tensorflow()
+    from tensorflow.keras.models import load_model
+    keras_model = load_model(model_path, compile=False)
+    variant = None
+    if len(keras_model.input_shape) == 4:
+        # Image models take uint8 pixels, as the services serve them
+        normalization = resolve_normalization(model_path)
+        keras_model = with_preprocessing(keras_model, normalization)
+        variant = f"uint8-{normalization}"
+
+    if backend == "tflite":
+        return load_tflite_predictor(
+            model_path,
+            lambda: keras_model,
+            quantization=quantization,
+            calibration_scale=1.0,
+            variant=variant
+        )
+    return build_predictor(keras_model)
+
+def synthetic_batch(predictor: Any, batch_size: int) -> np.ndarray:
+    """Random input of the model's shape: pixels for image models, standard normal features otherwise"""
+    rng = np.random.default_rng(0)
+    shape = (batch_size,) + tuple(predictor.input_shape[1:])
+    if np.issubdtype(predictor.dtype, np.integer):
+        return rng.integers(0, 256, size=shape, dtype=predictor.dtype)
+    return rng.standard_normal(shape).astype(predictor.dtype)
+
+def run_worker(
+    index: int,
+    config: Dict[str, Any],
+    args: argparse.Namespace,
+    barrier: Any,
+    results: Any
+) -> None:
+    """One benchmark worker: pin and load like a runner worker, then predict until the duration is over"""
+    logging.disable(logging.WARNING)
+
+    from common.threads import pin_worker
+    pin_worker(index, config["workers"])
+
+    predictor = load_predictor(args.model, args.backend, args.quantization)
+    batch = synthetic_batch(predictor, config["batch_size"])
+    predictor.warmup((config["batch_size"],))
+
+    barrier.wait()
+    latencies = []
+    started = time.perf_counter()
+    while time.perf_counter() - started < args.duration:
+        call_started = time.perf_counter()
+        predictor(batch)
+        latencies.append(time.perf_counter() - call_started)
+    results.put(latencies)
+
+def measure(config: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    """Run one combination and summarize throughput and latency"""
+    # Spawned, like the services' process pools: TensorFlow is not fork-safe
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(config["workers"])
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(index, config, args, barrier, results))
+        for index in range(config["workers"])
+    ]
+    # Spawned processes import NumPy before running anything, so the thread
+    # variables are set in the parent's environment while they start
+    environment = {
+        "RUNNER_PID": str(os.getpid()),
+        "WEB_CONCURRENCY": str(config["workers"]),
+        "TF_INTRA_OP_THREADS": str(config["threads"]),
+        "TF_INTER_OP_THREADS": str(min(2, config["threads"])),
+        "TFLITE_THREADS": str(config["threads"]),
+        "OPENCV_THREADS": str(config["threads"]),
+        "CPU_AFFINITY": "true" if args.affinity else "false",
+        **{variable: str(config["threads"]) for variable in BLAS_VARIABLES}
+    }
+    saved = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    try:
+        for process in processes:
+            process.start()
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+    latencies = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    calls = np.concatenate([np.array(worker, dtype=np.float64) for worker in latencies]) * 1000.0
+    images = len(calls) * config["batch_size"]
+    return {
+        **config,
+        "throughput": round(images / args.duration, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(calls, 50)), 2),
+            "p95": round(float(np.percentile(calls, 95)), 2),
+            "p99": round(float(np.percentile(calls, 99)), 2)
+        }
+    }
+
+def recommend(report: List[Dict[str, Any]], slo_ms: float) -> Optional[Dict[str, Any]]:
+    """Highest-throughput result whose p95 latency meets the SLO"""
+    within = [row for row in report if row["latency_ms"]["p95"] <= slo_ms]
+    return max(within, key=lambda row: row["throughput"]) if within else None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", required=True, help="Path to the Keras .h5 model")
+    parser.add_argument("--backend", default="keras", choices=("keras", "tflite"))
+    parser.add_argument("--quantization", default="dynamic", help="TFLite quantization for --backend tflite")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4], help="Intra-op threads per worker")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--slo-ms", type=float, default=250.0, help="Largest acceptable p95 forward-pass latency")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured per combination")
+    parser.add_argument("--affinity", action="store_true", help="Pin workers to their cores, as CPU_AFFINITY=true")
+    parser.add_argument("--output", help="Write the report as JSON")
+    args = parser.parse_args()
+
+    cores = len(available_cpus())
+    configs = [
+        {"workers": workers, "threads": threads, "batch_size": batch_size}
+        for workers, threads, batch_size in itertools.product(args.workers, args.threads, args.batch_sizes)
+        if workers * threads <= 2 * cores
+    ]
+    logger.info(f"Measuring {len(configs)} combinations on {cores} cores, {args.duration:.0f}s each")
+
+    report = []
+    for config in configs:
+        result = measure(config, args)
+        logger.info(
+            f"workers={config['workers']} threads={config['threads']} batch={config['batch_size']}: "
+            f"{result['throughput']} inputs/s, p95 {result['latency_ms']['p95']}ms"
+        )
+        report.append(result)
+
+    print(f"\nThroughput on {cores} cores ({args.backend}, SLO p95 <= {args.slo_ms:.0f}ms)")
+    print(f"{'workers':>8}{'threads':>9}{'batch':>7}{'inputs/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'SLO':>6}")
+    for row in sorted(report, key=lambda row: -row["throughput"]):
+        print(
+            f"{row['workers']:>8}{row['threads']:>9}{row['batch_size']:>7}{row['throughput']:>11.1f}"
+            f"{row['latency_ms']['p50']:>10.2f}{row['latency_ms']['p95']:>10.2f}"
+            f"{'ok' if row['latency_ms']['p95'] <= args.slo_ms else '-':>6}"
+        )
+
+    best = recommend(report, args.slo_ms)
+    if best is None:
+        print(f"\nNo combination meets p95 <= {args.slo_ms:.0f}ms; try smaller batch sizes or more threads")
+    else:
+        print("\nRecommended configuration:")
+        print(f"WEB_CONCURRENCY={best['workers']}")
+        print(f"TF_INTRA_OP_THREADS={best['threads']}")
+        if args.backend == "tflite":
+            print(f"TFLITE_THREADS={best['threads']}")
+        print(f"BATCH_MAX_SIZE={best['batch_size']}")
+        if args.affinity:
+            print("CPU_AFFINITY=true")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"cores": cores, "slo_ms": args.slo_ms, "recommended": best, "results": report}, f, indent=2)
+        logger.info(f"Wrote report to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+Check the NumPy engine against Keras for a dense model
+
+Runs the same inputs through the Keras model and through
+common/numpy_engine.py, and reports the largest output difference, top-1
+agreement, per-request and batch latency, and the startup time and peak
+memory of a fresh process loading each backend. Exits with status 1 when
+the outputs differ by more than --tolerance or any top-1 prediction
+differs, so it can gate an image build or a model update before the
+service runs it with CROP_BACKEND=numpy:
+
+    python tools/numpy_backend.py parity --model crop-recommendation/saved_model/model_crop_recom.h5 \\
+        --csv /data/Crop_recommendation.csv
+
+Run from back-end/. --csv takes rows with a header, whose first numeric
+columns are the model inputs in order (extra columns such as the label are
+ignored). Without it, --samples rows are drawn uniformly between 0 and
+--scale.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import multiprocessing
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.numpy_engine import load_numpy_predictor
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("keras", "numpy")
+
+def load_predictor(model_path: str, backend: str) -> Any:
+    """Load a model the way the crop service does for CROP_BACKEND"""
+    if backend == "numpy":
+        return load_numpy_predictor(model_path)
+
+    from common.inference import build_predictor
+    from common.threads import configure_tensorflow
+    configure_tensorflow()
+    from tensorflow.keras.models import load_model
+    return build_predictor(load_model(model_path, compile=False))
+
+def load_samples(args: argparse.Namespace, features: int) -> np.ndarray:
+    """Evaluation rows from --csv, or uniform random rows"""
+    if args.csv:
+        data = np.genfromtxt(args.csv, delimiter=",", skip_header=1, dtype=np.float64)
+        if data.ndim == 1:
+            data = data[np.newaxis]
+        # Non-numeric columns read as NaN; the inputs are the first fully numeric ones
+        numeric = [i for i in range(data.shape[1]) if np.isfinite(data[:, i]).all()]
+        if len(numeric) < features:
+            raise ValueError(f"{args.csv} has {len(numeric)} numeric columns, the model takes {features}")
+        return data[:args.samples, numeric[:features]]
+    rng = np.random.default_rng(0)
+    return rng.uniform(0.0, args.scale, size=(args.samples, features))
+
+def peak_rss_mb() -> Optional[float]:
+    """Peak resident memory of this process; ru_maxrss would include the parent's, as it survives exec"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    return None
+
+def measure_startup(model_path: str, backend: str, results: Any) -> None:
+    """Import the backend, load the model and run the first request in this fresh process"""
+    logging.disable(logging.WARNING)
+    started = time.perf_counter()
+    predictor = load_predictor(model_path, backend)
+    predictor.warmup()
+    elapsed = time.perf_counter() - started
+    results.put({
+        "startup_s": round(elapsed, 3),
+        "peak_rss_mb": peak_rss_mb(),
+        "tensorflow_imported": "tensorflow" in sys.modules
+    })
+
+def startup(model_path: str, backend: str) -> Dict[str, Any]:
+    """Startup time and peak memory of a new process loading the backend"""
+    # Spawned, so neither NumPy nor TensorFlow is already imported
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(target=measure_startup, args=(model_path, backend, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+def latencies(predictor: Any, samples: np.ndarray, batch_size: int) -> Dict[str, Any]:
+    """Per-request latency one row at a time, as /predict/recom calls it, and batch throughput"""
+    predictor.warmup((1, batch_size))
+    single = []
+    for sample in samples[:1000]:
+        started = time.perf_counter()
+        predictor(sample[np.newaxis])
+        single.append((time.perf_counter() - started) * 1000.0)
+
+    batches = [samples[i:i + batch_size] for i in range(0, len(samples), batch_size)]
+    started = time.perf_counter()
+    for batch in batches:
+        predictor(batch)
+    elapsed = time.perf_counter() - started
+
+    single = np.array(single)
+    return {
+        "p50_ms": round(float(np.percentile(single, 50)), 4),
+        "p95_ms": round(float(np.percentile(single, 95)), 4),
+        "rows_per_s": round(len(samples) / max(elapsed, 1e-9), 1)
+    }
+
+def parity(args: argparse.Namespace) -> bool:
+    """Compare the NumPy engine with Keras; True if the outputs agree"""
+    predictors = {backend: load_predictor(args.model, backend) for backend in BACKENDS}
+    samples = load_samples(args, predictors["numpy"].input_shape[1])
+    outputs = {backend: predictor(samples) for backend, predictor in predictors.items()}
+
+    difference = float(np.abs(outputs["numpy"] - outputs["keras"]).max())
+    agreement = float((outputs["numpy"].argmax(axis=1) == outputs["keras"].argmax(axis=1)).mean())
+    passed = difference <= args.tolerance and agreement == 1.0
+
+    report: Dict[str, Any] = {
+        "model": args.model,
+        "samples": len(samples),
+        "max_abs_diff": difference,
+        "top1_agreement": round(agreement, 6),
+        "tolerance": args.tolerance,
+        "passed": passed,
+        "backends": {}
+    }
+    for backend, predictor in predictors.items():
+        report["backends"][backend] = {
+            **latencies(predictor, samples, args.batch_size),
+            **({} if args.skip_startup else startup(args.model, backend))
+        }
+
+    print(f"\nNumPy engine parity over {len(samples)} rows for {args.model}")
+    print(f"max abs diff {difference:.3g} (tolerance {args.tolerance:g}), top-1 agreement {agreement:.4%}")
+    print(f"{'backend':<10}{'p50 ms':>10}{'p95 ms':>10}{'rows/s':>14}{'startup s':>12}{'peak MB':>10}")
+    for backend, row in report["backends"].items():
+        print(
+            f"{backend:<10}{row['p50_ms']:>10.4f}{row['p95_ms']:>10.4f}{row['rows_per_s']:>14.1f}"
+            f"{row.get('startup_s', float('nan')):>12.2f}{row.get('peak_rss_mb') or float('nan'):>10.1f}"
+        )
+    print("PASSED" if passed else "FAILED: the NumPy engine does not match Keras for this model")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote report to {args.output}")
+    return passed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    sub = subparsers.add_parser("parity")
+    sub.add_argument("--model", required=True, help="Path to the Keras .h5 or .keras model")
+    sub.add_argument("--csv", help="CSV of evaluation rows with a header, inputs in the first numeric columns")
+    sub.add_argument("--samples", type=int, default=10000, help="Maximum evaluation rows")
+    sub.add_argument("--scale", type=float, default=300.0, help="Upper bound of random rows without --csv")
+    sub.add_argument("--tolerance", type=float, default=1e-4, help="Largest accepted output difference")
+    sub.add_argument("--batch-size", type=int, default=4096, help="Rows per call for throughput, as BULK_BATCH_SIZE")
+    sub.add_argument("--skip-startup", action="store_true", help="Do not measure startup in fresh processes")
+    sub.add_argument("--output", help="Write the parity report as JSON")
+
+    args = parser.parse_args()
+    if not parity(args):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+"""
+Distill and evaluate the first stage of the pest classifier cascade
+
+Train the small first-stage model on a folder of images labelled by the full
+model (soft targets, so no annotation is needed). The student is a
+MobileNetV3-Small at reduced resolution that takes the same 224x224 pixels
+as the full model and downsizes them in-graph:
+
+    python tools/pest_cascade.py distill --images /data/pest-uploads --size 96 --epochs 15
+
+Measure, for each combination of thresholds, how many images every stage
+decides, how often the cascade's answer (class or "not a pest") agrees with
+the full model's, and the estimated inference time saved:
+
+    python tools/pest_cascade.py evaluate --images /data/pest-uploads \\
+        --accept 0.95 0.98 0.99 --reject 0.3 0.5 0.7 --min-contrast 0 6 12
+
+Run from back-end/. The images should look like real uploads, non-pest
+photos included, and may be nested in folders. Images go through the
+service's own preprocessing and models are loaded as the service loads them
+(MODEL_BACKEND, GRAPH_PREPROCESSING); the student is written to, and read
+from, the service's CASCADE_MODEL_PATH unless --first-stage is given.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import itertools
+import importlib.util
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from common.cascade import Cascade
+from common.preprocessing import normalize_pixels
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Answer of an image that is not a pest, next to class indices
+NOT_A_PEST = -1
+
+def load_pest_service() -> Any:
+    """Import pest-classification/app.py, for its preprocessing, model loading and thresholds"""
+    spec = importlib.util.spec_from_file_location(
+        "pest_app", os.path.join(BACKEND_DIR, "pest-classification", "app.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def load_images(service: Any, directory: str, limit: int) -> Tuple[np.ndarray, List[str]]:
+    """Preprocess up to limit images under directory the way /predict does"""
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )[:limit]
+
+    pixels, loaded = [], []
+    for path in paths:
+        with open(path, "rb") as f:
+            contents = f.read()
+        try:
+            pixels.append(service.preprocess_image(contents)[0])
+        except ValueError as e:
+            logger.warning(f"Skipping {path}: {str(e)}")
+            continue
+        loaded.append(path)
+
+    if not pixels:
+        raise ValueError(f"No images found in {directory}")
+    logger.info(f"Loaded {len(pixels)} images from {directory}")
+    return np.stack(pixels), loaded
+
+def predict_all(predictor: Any, normalization: Optional[str], pixels: np.ndarray, batch_size: int = 32) -> np.ndarray:
+    """Run a served model over uint8 pixels in batches"""
+    outputs = []
+    for start in range(0, len(pixels), batch_size):
+        batch = pixels[start:start + batch_size]
+        if normalization is not None:
+            batch = normalize_pixels(batch, normalization)
+        outputs.append(np.asarray(predictor(batch)))
+    return np.concatenate(outputs)
+
+def time_per_image(predictor: Any, normalization: Optional[str], pixels: np.ndarray, samples: int = 50) -> float:
+    """Median milliseconds per single-image call, as requests run the models"""
+    latencies = []
+    for sample in pixels[:samples]:
+        batch = sample[np.newaxis]
+        started = time.perf_counter()
+        if normalization is not None:
+            batch = normalize_pixels(batch, normalization)
+        predictor(batch)
+        latencies.append((time.perf_counter() - started) * 1000.0)
+    return float(np.median(latencies))
+
+def answers(probabilities: np.ndarray, min_confidence: float) -> np.ndarray:
+    """Class index per image, or NOT_A_PEST below the service's confidence threshold"""
+    top = probabilities.argmax(axis=1)
+    return np.where(probabilities.max(axis=1) >= min_confidence, top, NOT_A_PEST)
+
+def build_student(num_classes: int, input_shape: Tuple[int, ...], size: int, weights: Optional[str], alpha: float) -> Any:
+    """MobileNetV3-Small at size x size behind an in-graph resize from the full model's input"""
+    from tensorflow import keras
+
+    inputs = keras.Input(shape=input_shape, name="pixels")
+    resized = keras.layers.Resizing(size, size, name="downsample")(inputs)
+    # include_preprocessing adds the Rescaling layer, so the student takes 0-255 pixels
+    backbone = keras.applications.MobileNetV3Small(
+        input_shape=(size, size, 3),
+        alpha=alpha,
+        include_top=False,
+        weights=weights,
+        pooling="avg",
+        include_preprocessing=True
+    )
+    features = keras.layers.Dropout(0.2)(backbone(resized))
+    outputs = keras.layers.Dense(num_classes, activation="softmax", name="classes")(features)
+    return keras.Model(inputs, outputs, name="model_hama_cascade")
+
+def distill(args: argparse.Namespace, service: Any) -> None:
+    """Train the first-stage model on the full model's outputs"""
+    from tensorflow import keras
+
+    pixels, _ = load_images(service, args.images, args.samples)
+    teacher, teacher_normalization = service.load_predictor(service.MODEL_PATH)
+    targets = predict_all(teacher, teacher_normalization, pixels)
+
+    rng = np.random.default_rng(0)
+    order = rng.permutation(len(pixels))
+    validation = order[:max(1, int(len(order) * args.validation_split))]
+    training = order[len(validation):]
+
+    student = build_student(
+        targets.shape[1],
+        pixels.shape[1:],
+        args.size,
+        None if args.weights == "none" else args.weights,
+        args.alpha
+    )
+    augment = keras.Sequential([keras.layers.RandomFlip("horizontal"), keras.layers.RandomRotation(0.05)])
+    dataset_inputs = pixels.astype(np.float32)
+
+    student.compile(optimizer=keras.optimizers.Adam(args.learning_rate), loss="categorical_crossentropy")
+    started = time.perf_counter()
+    for epoch in range(args.epochs):
+        shuffled = rng.permutation(training)
+        losses = []
+        for start in range(0, len(shuffled), args.batch_size):
+            index = shuffled[start:start + args.batch_size]
+            batch = augment(dataset_inputs[index], training=True)
+            losses.append(float(student.train_on_batch(batch, targets[index])))
+        student_answers = answers(student.predict(dataset_inputs[validation], verbose=0), service.MIN_CONFIDENCE)
+        agreement = float((student_answers == answers(targets[validation], service.MIN_CONFIDENCE)).mean())
+        logger.info(f"Epoch {epoch + 1}/{args.epochs}: loss {np.mean(losses):.4f}, validation agreement {agreement:.4f}")
+
+    # The .keras format, since MobileNetV3's hard-swish does not load back from .h5 in Keras 3
+    output = args.first_stage or service.CASCADE_MODEL_PATH
+    student.save(output)
+    logger.info(
+        f"Wrote {output} ({os.path.getsize(output) / (1024 * 1024):.2f}MB) "
+        f"after {time.perf_counter() - started:.0f}s; check it with the evaluate command"
+    )
+
+def evaluate(args: argparse.Namespace, service: Any) -> List[Dict[str, Any]]:
+    """Compare the cascade with the full model for each combination of thresholds"""
+    pixels, _ = load_images(service, args.images, args.samples)
+    min_confidence = service.MIN_CONFIDENCE
+
+    full, full_normalization = service.load_predictor(service.MODEL_PATH)
+    full.warmup()
+    full_probabilities = predict_all(full, full_normalization, pixels)
+    full_answers = answers(full_probabilities, min_confidence)
+    full_ms = time_per_image(full, full_normalization, pixels)
+
+    first_stage_path = args.first_stage or service.CASCADE_MODEL_PATH
+    first_probabilities, first_ms = None, 0.0
+    if os.path.exists(first_stage_path):
+        first_stage, first_normalization = service.load_predictor(first_stage_path)
+        first_stage.warmup()
+        first_probabilities = predict_all(first_stage, first_normalization, pixels)
+        first_ms = time_per_image(first_stage, first_normalization, pixels)
+    else:
+        logger.warning(f"No first-stage model at {first_stage_path}, evaluating the gate alone")
+
+    report = []
+    for accept, reject, min_contrast in itertools.product(args.accept, args.reject, args.min_contrast):
+        if reject >= accept:
+            continue
+        cascade = Cascade(True, accept, reject, min_contrast)
+        gated = cascade.gate(pixels)
+        cascade_answers = full_answers.copy()
+        stage = np.full(len(pixels), "full_model", dtype=object)
+
+        if first_probabilities is not None:
+            accepted, rejected = cascade.decide(first_probabilities)
+            accepted &= ~gated
+            rejected &= ~gated
+            # An accepted answer still has to pass the service's confidence threshold
+            cascade_answers[accepted] = answers(first_probabilities[accepted], min_confidence)
+            cascade_answers[rejected] = NOT_A_PEST
+            stage[accepted | rejected] = "first_stage"
+        cascade_answers[gated] = NOT_A_PEST
+        stage[gated] = "gate"
+
+        agree = cascade_answers == full_answers
+        escalated = float((stage == "full_model").mean())
+        # The gate costs microseconds; every image not gated pays for the first stage
+        cascade_ms = (1.0 - float(gated.mean())) * first_ms + escalated * full_ms
+        report.append({
+            "accept": accept,
+            "reject": reject,
+            "min_contrast": min_contrast,
+            "agreement": round(float(agree.mean()), 4),
+            "fractions": {name: round(float((stage == name).mean()), 4) for name in ("gate", "first_stage", "full_model")},
+            "stage_agreement": {
+                name: round(float(agree[stage == name].mean()), 4)
+                for name in ("gate", "first_stage") if (stage == name).any()
+            },
+            "missed_pests": int(((cascade_answers == NOT_A_PEST) & (full_answers != NOT_A_PEST)).sum()),
+            "false_pests": int(((cascade_answers != NOT_A_PEST) & (full_answers == NOT_A_PEST)).sum()),
+            "wrong_class": int(((cascade_answers != full_answers) & (cascade_answers != NOT_A_PEST) & (full_answers != NOT_A_PEST)).sum()),
+            "inference_ms": round(cascade_ms, 3),
+            "speedup": round(full_ms / max(cascade_ms, 1e-9), 2)
+        })
+
+    print(
+        f"\nCascade against the full model over {len(pixels)} images "
+        f"(full model {full_ms:.2f}ms, first stage {first_ms:.2f}ms per image)"
+    )
+    print(
+        f"{'accept':>8}{'reject':>8}{'contrast':>10}{'agree':>8}{'gate':>8}{'first':>8}{'full':>8}"
+        f"{'missed':>8}{'false':>7}{'wrong':>7}{'ms':>8}{'speedup':>9}"
+    )
+    for row in report:
+        fractions = row["fractions"]
+        print(
+            f"{row['accept']:>8.2f}{row['reject']:>8.2f}{row['min_contrast']:>10.1f}{row['agreement']:>8.4f}"
+            f"{fractions['gate']:>8.3f}{fractions['first_stage']:>8.3f}{fractions['full_model']:>8.3f}"
+            f"{row['missed_pests']:>8}{row['false_pests']:>7}{row['wrong_class']:>7}"
+            f"{row['inference_ms']:>8.2f}{row['speedup']:>9.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"images": len(pixels), "full_model_ms": full_ms, "first_stage_ms": first_ms, "results": report}, f, indent=2)
+        logger.info(f"Wrote report to {args.output}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("distill", "evaluate"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--images", required=True, help="Directory of upload-like images, searched recursively")
+        sub.add_argument("--samples", type=int, default=5000, help="Maximum images to use")
+        sub.add_argument("--first-stage", help="First-stage model path, defaults to the service's CASCADE_MODEL_PATH")
+
+        if name == "distill":
+            sub.add_argument("--size", type=int, default=96, help="Student input resolution")
+            sub.add_argument("--alpha", type=float, default=0.75, help="MobileNetV3-Small width multiplier")
+            sub.add_argument("--weights", default="imagenet", help="Backbone weights, 'imagenet' or 'none'")
+            sub.add_argument("--epochs", type=int, default=15)
+            sub.add_argument("--batch-size", type=int, default=32)
+            sub.add_argument("--learning-rate", type=float, default=1e-3)
+            sub.add_argument("--validation-split", type=float, default=0.1)
+        else:
+            sub.add_argument("--accept", type=float, nargs="+", default=[0.95, 0.98, 0.99])
+            sub.add_argument("--reject", type=float, nargs="+", default=[0.3, 0.5, 0.7])
+            sub.add_argument("--min-contrast", type=float, nargs="+", default=[6.0])
+            sub.add_argument("--output", help="Write the report as JSON")
+
+    args = parser.parse_args()
+    service = load_pest_service()
+    if args.command == "distill":
+        distill(args, service)
+    else:
+        evaluate(args, service)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Convert Keras models to TFLite and check parity against the Keras model
+
+Convert at image build time so services start without converting:
+
+    python tools/tflite_backend.py convert --model plant-disease-classification/keras_model/best_model.h5 --quantization dynamic
+
+Report top-1 agreement and per-image latency of each quantization mode:
+
+    python tools/tflite_backend.py parity --model pest-classification/saved_model/model_hama.h5 \\
+        --images /data/pest-samples --quantization dynamic float16 int8
+
+Run from back-end/. Converted files are written next to the Keras model as
+<model>.uint8-<normalization>.<quantization>.tflite (or <model>.<quantization>.tflite
+with --host-preprocessing), the same cache the services load at startup.
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Any, Dict, List
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.inference import build_predictor
+from common.preprocessing import NORMALIZATIONS, normalize_pixels, resolve_normalization, with_preprocessing
+from common.tflite import (
+    TFLITE_QUANTIZATIONS,
+    TFLitePredictor,
+    convert_to_tflite,
+    load_calibration_images,
+    tflite_path_for
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+def load_keras_model(args: argparse.Namespace) -> Any:
+    """
+    Load a Keras model the way the services serve it.
+
+    Unless --host-preprocessing is given, the model is wrapped to take uint8
+    pixels and normalize them in-graph.
+    """
+    from tensorflow.keras.models import load_model
+    keras_model = load_model(args.model, compile=False)
+    if args.host_preprocessing:
+        return keras_model
+    return with_preprocessing(keras_model, args.normalization)
+
+def model_inputs(args: argparse.Namespace, pixels: np.ndarray) -> np.ndarray:
+    """Turn 0-255 pixels into what the served model takes"""
+    if args.host_preprocessing:
+        return normalize_pixels(pixels, args.normalization)
+    return pixels.astype(np.uint8)
+
+def load_samples(args: argparse.Namespace, target_size) -> np.ndarray:
+    """
+    Load evaluation samples from --images, or synthetic images when no directory is given.
+
+    Synthetic images only measure latency and numeric drift; use real images
+    for a meaningful top-1 agreement.
+    """
+    if args.images:
+        return model_inputs(args, load_calibration_images(args.images, target_size, scale=1.0, limit=args.samples))
+
+    logger.warning("No --images given, using random images; top-1 agreement is not meaningful")
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(args.samples,) + tuple(target_size) + (3,), dtype=np.uint8)
+    return model_inputs(args, pixels)
+
+def convert(args: argparse.Namespace, keras_model: Any, quantization: str) -> str:
+    """Convert the model and write it to the service cache path"""
+    calibration_data = None
+    if quantization == "int8":
+        if not args.calibration and not args.images:
+            raise ValueError("int8 quantization needs --calibration or --images")
+        calibration_data = model_inputs(args, load_calibration_images(
+            args.calibration or args.images,
+            tuple(keras_model.input_shape[1:3]),
+            scale=1.0,
+            limit=args.calibration_samples
+        ))
+
+    started = time.perf_counter()
+    flatbuffer = convert_to_tflite(keras_model, quantization, calibration_data)
+    variant = None if args.host_preprocessing else f"uint8-{args.normalization}"
+    path = tflite_path_for(args.model, quantization, variant)
+    with open(path, "wb") as f:
+        f.write(flatbuffer)
+    logger.info(f"Wrote {path} ({len(flatbuffer) / (1024 * 1024):.2f}MB) in {time.perf_counter() - started:.1f}s")
+    return path
+
+def time_predictions(predictor: Any, samples: np.ndarray) -> Dict[str, Any]:
+    """Run samples one at a time, as requests do, and collect outputs and latencies"""
+    predictor.warmup()
+    outputs, latencies = [], []
+    for sample in samples:
+        started = time.perf_counter()
+        outputs.append(predictor(sample[np.newaxis])[0])
+        latencies.append((time.perf_counter() - started) * 1000.0)
+
+    latencies = np.array(latencies)
+    return {
+        "outputs": np.stack(outputs),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p95": round(float(np.percentile(latencies, 95)), 3),
+            "mean": round(float(latencies.mean()), 3)
+        }
+    }
+
+def parity(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Compare each quantization mode against the Keras model"""
+    keras_model = load_keras_model(args)
+    samples = load_samples(args, tuple(keras_model.input_shape[1:3]))
+
+    reference = time_predictions(build_predictor(keras_model, mode="compiled"), samples)
+    reference_top1 = reference["outputs"].argmax(axis=1)
+    report = [{
+        "backend": "keras",
+        "size_mb": round(os.path.getsize(args.model) / (1024 * 1024), 3),
+        "latency_ms": reference["latency_ms"]
+    }]
+
+    for quantization in args.quantization:
+        path = convert(args, keras_model, quantization)
+        result = time_predictions(TFLitePredictor(path, num_threads=args.threads), samples)
+        report.append({
+            "backend": f"tflite-{quantization}",
+            "size_mb": round(os.path.getsize(path) / (1024 * 1024), 3),
+            "latency_ms": result["latency_ms"],
+            "top1_agreement": round(float((result["outputs"].argmax(axis=1) == reference_top1).mean()), 4),
+            "max_abs_diff": round(float(np.abs(result["outputs"] - reference["outputs"]).max()), 6),
+            "speedup_p50": round(reference["latency_ms"]["p50"] / max(result["latency_ms"]["p50"], 1e-9), 2)
+        })
+
+    print(f"\nParity over {len(samples)} images for {args.model}")
+    print(f"{'backend':<18}{'size MB':>10}{'p50 ms':>10}{'p95 ms':>10}{'top-1':>10}{'max diff':>12}{'speedup':>10}")
+    for row in report:
+        print(
+            f"{row['backend']:<18}{row['size_mb']:>10.3f}{row['latency_ms']['p50']:>10.3f}"
+            f"{row['latency_ms']['p95']:>10.3f}{row.get('top1_agreement', 1.0):>10.4f}"
+            f"{row.get('max_abs_diff', 0.0):>12.6f}{row.get('speedup_p50', 1.0):>10.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote report to {args.output}")
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    for name in ("convert", "parity"):
+        sub = subparsers.add_parser(name)
+        sub.add_argument("--model", required=True, help="Path to the Keras .h5 model")
+        sub.add_argument("--quantization", nargs="+", default=["dynamic"], choices=TFLITE_QUANTIZATIONS)
+        sub.add_argument("--images", help="Directory of evaluation images")
+        sub.add_argument("--calibration", help="Directory of int8 calibration images, defaults to --images")
+        sub.add_argument("--calibration-samples", type=int, default=200)
+        sub.add_argument("--normalization", default="auto", choices=("auto",) + NORMALIZATIONS)
+        sub.add_argument("--host-preprocessing", action="store_true", help="Convert the model without in-graph normalization")
+        sub.add_argument("--samples", type=int, default=100, help="Maximum evaluation images")
+        sub.add_argument("--threads", type=int, default=None, help="TFLite interpreter threads")
+        sub.add_argument("--output", help="Write the parity report as JSON")
+
+    args = parser.parse_args()
+    args.normalization = resolve_normalization(args.model, args.normalization)
+    if args.command == "convert":
+        keras_model = load_keras_model(args)
+        for quantization in args.quantization:
+            convert(args, keras_model, quantization)
+    else:
+        parity(args)
+
+if __name__ == "__main__":
+    main()